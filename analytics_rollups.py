@@ -0,0 +1,237 @@
+"""
+Analytics Rollups - Pre-aggregated messaging activity per day and per hour
+Campaign counter increments are also added to the rows of each (organization,
+channel, day) and (campaign, hour), in the same transaction, so dashboards
+read a few hundred rollup rows instead of every campaign and delivery in the
+period. Each key is split over ROLLUP_SHARDS rows written at random, so send
+workers of one organization do not all queue on the same row lock; readers
+sum the shards. rebuild_rollups recomputes both tables from the delivery
+history.
+"""
+
+import os
+import random
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import CampaignHourlyRollup, DailyChannelRollup, MessageCampaign, MessageDelivery, Suppression, Template
+
+# Counter columns on both rollup tables, named like the campaign counters
+ROLLUP_COUNTERS = (
+    'messages_sent', 'messages_delivered', 'messages_failed', 'messages_opened',
+    'messages_clicked', 'messages_bounced', 'unsubscribes'
+)
+
+# Rows per rollup key that concurrent writers spread over
+ROLLUP_SHARDS = max(1, int(os.environ.get('ROLLUP_SHARDS', '8')))
+
+# Rows read per query while rebuilding
+ROLLUP_REBUILD_BATCH_SIZE = int(os.environ.get('ROLLUP_REBUILD_BATCH_SIZE', '5000'))
+
+# Campaigns whose organization and channel are kept in memory
+ROLLUP_CAMPAIGN_CACHE_SIZE = 10000
+
+_campaign_dimensions: Dict[int, Tuple[int, str]] = {}
+_campaign_dimensions_lock = threading.Lock()
+
+
+def campaign_dimensions(campaign_ids: Iterable[int]) -> Dict[int, Tuple[int, str]]:
+    """Organization and channel of campaigns, which never change once a campaign exists"""
+    campaign_ids = set(campaign_ids)
+    with _campaign_dimensions_lock:
+        found = {campaign_id: _campaign_dimensions[campaign_id]
+                 for campaign_id in campaign_ids if campaign_id in _campaign_dimensions}
+    missing = campaign_ids - set(found)
+    if missing:
+        rows = db.session.query(
+            MessageCampaign.id, MessageCampaign.organization_id, Template.template_type
+        ).join(Template, Template.id == MessageCampaign.template_id).filter(
+            MessageCampaign.id.in_(missing)
+        ).all()
+        loaded = {row.id: (row.organization_id, row.template_type) for row in rows}
+        with _campaign_dimensions_lock:
+            if len(_campaign_dimensions) + len(loaded) > ROLLUP_CAMPAIGN_CACHE_SIZE:
+                _campaign_dimensions.clear()
+            _campaign_dimensions.update(loaded)
+        found.update(loaded)
+    return found
+
+
+def _hour(at: datetime) -> datetime:
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+def _add_to_row(model, key: Dict, counters: Dict[str, int]):
+    """UPDATE col = col + n on the row with `key`, creating it if it does not exist yet"""
+    values = {getattr(model, name): getattr(model, name) + amount for name, amount in counters.items()}
+    query = model.query.filter_by(**key)
+    if query.update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **counters))
+    except IntegrityError:
+        # Another worker created the row first
+        query.update(values, synchronize_session=False)
+
+
+def record_rollups(increments: Dict[int, Dict[str, int]], at: datetime = None):
+    """
+    Add campaign counter increments to the rollups in the current transaction
+
+    Args:
+        increments: Campaign id -> counter name -> amount
+        at: When the counted events happened, default now
+    """
+    at = at or datetime.utcnow()
+    increments = {campaign_id: {name: amount for name, amount in counters.items() if amount}
+                  for campaign_id, counters in increments.items()}
+    increments = {campaign_id: counters for campaign_id, counters in increments.items() if counters}
+    if not increments:
+        return
+
+    dimensions = campaign_dimensions(increments)
+    daily: Dict[Tuple[int, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for campaign_id, counters in increments.items():
+        if campaign_id not in dimensions:
+            continue
+        for name, amount in counters.items():
+            daily[dimensions[campaign_id]][name] += amount
+
+    # One shard per transaction, rows in key order, so concurrent
+    # transactions lock them consistently
+    shard = random.randrange(ROLLUP_SHARDS)
+    for organization_id, channel in sorted(daily):
+        _add_to_row(DailyChannelRollup, {
+            'organization_id': organization_id, 'channel': channel, 'day': at.date(), 'shard': shard
+        }, dict(daily[(organization_id, channel)]))
+    for campaign_id in sorted(increments):
+        if campaign_id in dimensions:
+            _add_to_row(CampaignHourlyRollup, {
+                'campaign_id': campaign_id, 'hour': _hour(at), 'shard': shard
+            }, increments[campaign_id])
+
+
+def record_campaign_created(campaign: MessageCampaign, channel: str):
+    """Count a new campaign in its organization's daily rollup, in the current transaction"""
+    _add_to_row(DailyChannelRollup, {
+        'organization_id': campaign.organization_id, 'channel': channel,
+        'day': (campaign.created_at or datetime.utcnow()).date(), 'shard': random.randrange(ROLLUP_SHARDS)
+    }, {'campaigns': 1})
+
+
+def _keyset(query, id_column, batch_size: int):
+    """Rows of a query in id order, read in bounded batches"""
+    last_id = 0
+    while True:
+        rows = query.filter(id_column > last_id).order_by(id_column).limit(batch_size).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def rebuild_rollups(organization_id: Optional[int] = None, batch_size: int = None) -> int:
+    """
+    Recompute the rollups of one or all organizations from campaigns,
+    deliveries and suppressions, and commit
+
+    Must run inside an app context, and once after upgrading, since the
+    rollups start empty and dashboards show no earlier history until then.
+    Totals are written to shard 0. Events are dated by the delivery
+    timestamps; failures and bounces, which have none of their own, by the
+    delivery's last update. Counts made while the rebuild runs can be lost,
+    so run it while sending is stopped.
+
+    Returns:
+        Number of rollup rows written
+    """
+    batch_size = batch_size or ROLLUP_REBUILD_BATCH_SIZE
+    daily = defaultdict(lambda: defaultdict(int))
+    hourly = defaultdict(lambda: defaultdict(int))
+    dimensions = {}
+
+    campaigns = db.session.query(
+        MessageCampaign.id, MessageCampaign.organization_id, MessageCampaign.created_at, Template.template_type
+    ).join(Template, Template.id == MessageCampaign.template_id)
+    if organization_id is not None:
+        campaigns = campaigns.filter(MessageCampaign.organization_id == organization_id)
+    for row in _keyset(campaigns, MessageCampaign.id, batch_size):
+        dimensions[row.id] = (row.organization_id, row.template_type)
+        if row.created_at:
+            daily[(row.organization_id, row.template_type, row.created_at.date())]['campaigns'] += 1
+
+    def count(campaign_id, name, at):
+        if campaign_id in dimensions and at:
+            daily[dimensions[campaign_id] + (at.date(),)][name] += 1
+            hourly[(campaign_id, _hour(at))][name] += 1
+
+    deliveries = db.session.query(
+        MessageDelivery.id, MessageDelivery.campaign_id, MessageDelivery.status, MessageDelivery.sent_at,
+        MessageDelivery.delivered_at, MessageDelivery.opened_at, MessageDelivery.clicked_at,
+        MessageDelivery.updated_at
+    )
+    if organization_id is not None:
+        deliveries = deliveries.join(
+            MessageCampaign, MessageCampaign.id == MessageDelivery.campaign_id
+        ).filter(MessageCampaign.organization_id == organization_id)
+    for row in _keyset(deliveries, MessageDelivery.id, batch_size):
+        count(row.campaign_id, 'messages_sent', row.sent_at)
+        count(row.campaign_id, 'messages_delivered', row.delivered_at)
+        count(row.campaign_id, 'messages_opened', row.opened_at)
+        count(row.campaign_id, 'messages_clicked', row.clicked_at)
+        if row.status == 'failed':
+            count(row.campaign_id, 'messages_failed', row.updated_at)
+        elif row.status == 'bounced':
+            count(row.campaign_id, 'messages_bounced', row.updated_at)
+
+    unsubscribes = db.session.query(Suppression.id, Suppression.campaign_id, Suppression.created_at).filter(
+        Suppression.reason == 'unsubscribe', Suppression.campaign_id.isnot(None)
+    )
+    if organization_id is not None:
+        unsubscribes = unsubscribes.filter(Suppression.organization_id == organization_id)
+    for row in _keyset(unsubscribes, Suppression.id, batch_size):
+        count(row.campaign_id, 'unsubscribes', row.created_at)
+
+    # Old rows are replaced in the same transaction, so readers never see partial rollups
+    daily_rows = DailyChannelRollup.query
+    hourly_rows = CampaignHourlyRollup.query
+    if organization_id is not None:
+        daily_rows = daily_rows.filter(DailyChannelRollup.organization_id == organization_id)
+        hourly_rows = hourly_rows.filter(CampaignHourlyRollup.campaign_id.in_(
+            db.session.query(MessageCampaign.id).filter(MessageCampaign.organization_id == organization_id)
+        ))
+    daily_rows.delete(synchronize_session=False)
+    hourly_rows.delete(synchronize_session=False)
+
+    zeros = {name: 0 for name in ROLLUP_COUNTERS}
+    daily_values = [
+        {**zeros, 'campaigns': 0, **counters, 'organization_id': org_id, 'channel': channel, 'day': day, 'shard': 0}
+        for (org_id, channel, day), counters in sorted(daily.items())
+    ]
+    hourly_values = [
+        {**zeros, **counters, 'campaign_id': campaign_id, 'hour': hour, 'shard': 0}
+        for (campaign_id, hour), counters in sorted(hourly.items())
+    ]
+    for model, values in ((DailyChannelRollup, daily_values), (CampaignHourlyRollup, hourly_values)):
+        for start in range(0, len(values), batch_size):
+            db.session.execute(insert(model), values[start:start + batch_size])
+    db.session.commit()
+    return len(daily_values) + len(hourly_values)
+
+
+if __name__ == "__main__":
+    import main  # noqa: F401 - registers routes before the app is used
+    from app import app
+
+    with app.app_context():
+        logging.info("Rebuilding analytics rollups")
+        count = rebuild_rollups()
+        logging.info(f"Wrote {count} rollup rows")
@@ -14,6 +14,9 @@ from models import (
     UserRole, ApiKey, MessageLog
 )
 from utils import get_current_user, login_required
+from messaging import MessagingService
+from idempotency import idempotency_keys, request_fingerprint
+from retry_policy import circuit_breakers
 
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 
@@ -284,6 +287,54 @@ def create_contacts_bulk():
         db.session.rollback()
         return jsonify({'error': f'Database error: {str(e)}'}), 500
 
+# Messaging API Routes
+@api_bp.route('/messages/send', methods=['POST'])
+@api_key_required
+@check_api_permission('message')
+def send_messages():
+    """Send a template to contacts; retries with the same Idempotency-Key are not sent again"""
+    organization = request.api_organization
+    data = request.get_json()
+    
+    if not data or not data.get('template_id') or not data.get('contact_ids'):
+        return jsonify({'error': 'template_id and contact_ids required'}), 400
+    
+    try:
+        template_id = int(data['template_id'])
+        contact_ids = [int(contact_id) for contact_id in data['contact_ids']]
+        scheduled_at = datetime.fromisoformat(data['scheduled_at']) if data.get('scheduled_at') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid template_id, contact_ids or scheduled_at'}), 400
+    custom_variables = data.get('custom_variables') or {}
+    priority = data.get('priority')
+    
+    def send():
+        return MessagingService().send_message(
+            template_id=template_id,
+            contact_ids=contact_ids,
+            custom_variables=custom_variables,
+            organization_id=organization.id,
+            scheduled_at=scheduled_at,
+            priority=priority
+        )
+    
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        fingerprint = request_fingerprint({
+            'template_id': template_id,
+            'contact_ids': contact_ids,
+            'custom_variables': custom_variables,
+            'scheduled_at': scheduled_at,
+            'priority': priority
+        })
+        result = idempotency_keys.run(organization.id, idempotency_key, fingerprint, send)
+    else:
+        result = send()
+    
+    if not result.get('success'):
+        return jsonify(result), 409 if result.get('conflict') else 400
+    return jsonify(result), 202
+
 # Analytics API Routes
 @api_bp.route('/analytics/summary', methods=['GET'])
 @api_key_required
@@ -321,9 +372,12 @@ def get_analytics_summary():
 # Health Check
 @api_bp.route('/health', methods=['GET'])
 def health_check():
-    """API health check"""
+    """API health check, with the providers this process currently short-circuits"""
+    # Breaker keys can hold tenant gateway URLs; only provider names are shown
+    degraded = sorted({key.split(':', 1)[0] for key, state in circuit_breakers.states().items() if state != 'closed'})
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'open_circuits': degraded
     })
\ No newline at end of file
@@ -13,6 +13,17 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
+def database_pool_options():
+    """Connection pool sized for web requests plus the background threads of this process"""
+    from messaging_dispatch import DISPATCH_IN_PROCESS, get_dispatch_thread_count
+    
+    # Tracking flusher, plus send workers, scheduler and recovery when they run here
+    background = 1 + (get_dispatch_thread_count() + 2 if DISPATCH_IN_PROCESS else 0)
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5 + background)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+    }
+
 def create_app():
     # Create the app
     app = Flask(__name__)
@@ -25,6 +36,8 @@ def create_app():
         "pool_recycle": 300,
         "pool_pre_ping": True,
     }
+    if not (app.config["SQLALCHEMY_DATABASE_URI"] or "").startswith("sqlite"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"].update(database_pool_options())
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     
     # Initialize the app with the extension
@@ -37,8 +50,9 @@ def create_app():
     from templates_mgmt import templates_bp
     from users import users_bp
     from organizations import organizations_bp
+    from messaging_analytics import analytics_bp
     # from messaging import messaging_bp  # Will add after fixing
-    # from api import api_bp  # Temporarily disabled due to missing models
+    from api import api_bp
     
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(contacts_bp, url_prefix='/contacts')
@@ -46,8 +60,9 @@ def create_app():
     app.register_blueprint(templates_bp, url_prefix='/templates')
     app.register_blueprint(users_bp, url_prefix='/users')
     app.register_blueprint(organizations_bp, url_prefix='/organizations')
+    app.register_blueprint(analytics_bp, url_prefix='/analytics')
     # app.register_blueprint(messaging_bp, url_prefix='/messaging')  # Will add after fixing
-    # app.register_blueprint(api_bp)  # Temporarily disabled due to missing models
+    app.register_blueprint(api_bp)  # Prefixed /api/v1 by the blueprint
     
     # Import main routes to register them with the app
     import main
@@ -58,6 +73,15 @@ def create_app():
         db.create_all()
         logging.info("Database tables created")
     
+    # Outbox send workers and the campaign scheduler run in this process unless
+    # standalone workers are deployed; starting them here also resumes
+    # campaigns interrupted by a restart
+    from messaging_dispatch import DISPATCH_IN_PROCESS, dispatcher
+    from campaign_scheduler import scheduler
+    if DISPATCH_IN_PROCESS:
+        dispatcher.start(app)
+        scheduler.start(app)
+    
     return app
 
 # Create app instance
@@ -4,6 +4,7 @@ from app import db
 from models import User, PasswordResetToken, Organization, UserRole
 from forms import LoginForm, RegisterForm, PasswordResetRequestForm, PasswordResetForm
 from utils import generate_token
+from messaging import MessagingService
 import logging
 
 auth_bp = Blueprint('auth', __name__)
@@ -125,9 +126,16 @@ def reset_request():
                     db.session.add(reset_token)
                     db.session.commit()
                     
-                    # In a real application, you would send an email here
-                    # For now, we'll just log the token and show a message
-                    logging.info(f"Password reset token for {user.email}: {token}")
+                    # Reset emails go out on the transactional lane, ahead of campaigns
+                    reset_url = url_for('auth.reset_password', token=token, _external=True)
+                    MessagingService().send_system_email(
+                        user.email,
+                        'Reset your ContactHub password',
+                        f"Hello {user.first_name},\n\n"
+                        f"Use this link to reset your password (valid for 1 hour):\n{reset_url}\n\n"
+                        f"If you did not request a reset, you can ignore this email."
+                    )
+                    logging.info(f"Password reset email queued for {user.email}")
                     flash('Password reset instructions have been sent to your email.', 'info')
                     return redirect(url_for('auth.login'))
                 except Exception as e:
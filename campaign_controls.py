@@ -0,0 +1,178 @@
+"""
+Campaign Controls - Pause, resume, cancel and throttle in-flight campaigns
+Control actions update the campaign and its waiting deliveries in the
+database; send workers see the change through a short-lived in-process
+cache of campaign state checked between batches, not per message.
+"""
+
+import os
+import math
+import time
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+from flask import current_app
+from sqlalchemy import update
+
+from app import db
+from models import MessageCampaign, MessageDelivery
+
+# Seconds a worker trusts its cached view of a campaign's state
+CAMPAIGN_STATE_TTL_SECONDS = float(os.environ.get('CAMPAIGN_STATE_TTL_SECONDS', '2'))
+
+
+class CampaignStateCache:
+    """Process-wide cache of campaign status and send rate"""
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl or CAMPAIGN_STATE_TTL_SECONDS
+        self._states: Dict[int, SimpleNamespace] = {}
+        self._lock = threading.Lock()
+
+    def get(self, campaign_id: int) -> SimpleNamespace:
+        """Status and send_rate of a campaign, re-read after the TTL; needs an app context"""
+        state = self._states.get(campaign_id)
+        if state is not None and time.monotonic() - state.fetched_at < self.ttl:
+            return state
+
+        row = db.session.query(MessageCampaign.status, MessageCampaign.send_rate).filter(
+            MessageCampaign.id == campaign_id
+        ).first()
+        state = SimpleNamespace(
+            status=row.status if row else 'cancelled',
+            send_rate=row.send_rate if row else None,
+            fetched_at=time.monotonic()
+        )
+        with self._lock:
+            self._states[campaign_id] = state
+        return state
+
+    def invalidate(self, campaign_id: int = None):
+        """Drop cached state for a campaign, or for all campaigns"""
+        with self._lock:
+            if campaign_id is None:
+                self._states.clear()
+            else:
+                self._states.pop(campaign_id, None)
+
+
+campaign_states = CampaignStateCache()
+
+
+def _move_deliveries(campaign_id: int, from_statuses: tuple, to_status: str) -> int:
+    result = db.session.execute(
+        update(MessageDelivery).where(
+            MessageDelivery.campaign_id == campaign_id,
+            MessageDelivery.status.in_(from_statuses)
+        ).values(status=to_status).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def _apply(campaign: Optional[MessageCampaign], allowed: tuple, action: str) -> Optional[Dict[str, Any]]:
+    """Error result when a control action does not apply to the campaign"""
+    if campaign is None:
+        return {'success': False, 'error': 'Campaign not found'}
+    if campaign.status not in allowed:
+        return {'success': False, 'error': f'Cannot {action} a {campaign.status} campaign'}
+    return None
+
+
+def _transition(campaign: MessageCampaign, allowed: tuple, status: str, action: str,
+                **values) -> Optional[Dict[str, Any]]:
+    """
+    Move the campaign to a new status unless it changed since it was read
+
+    The conditional update keeps a concurrent change, such as the scheduler
+    completing the campaign, from being overwritten.
+    """
+    updated = MessageCampaign.query.filter(
+        MessageCampaign.id == campaign.id,
+        MessageCampaign.status.in_(allowed)
+    ).update(dict(values, status=status), synchronize_session=False)
+    if updated:
+        return None
+    db.session.rollback()
+    return _apply(campaign, allowed, action) or {'success': False, 'error': f'Cannot {action} the campaign now'}
+
+
+def _result(campaign: MessageCampaign, **extra) -> Dict[str, Any]:
+    campaign_states.invalidate(campaign.id)
+    return dict({'success': True, 'campaign_id': campaign.id, 'status': campaign.status,
+                 'send_rate': campaign.send_rate}, **extra)
+
+
+def pause_campaign(campaign: MessageCampaign) -> Dict[str, Any]:
+    """Stop sending a campaign; queued deliveries wait until it is resumed"""
+    error = _apply(campaign, ('sending',), 'pause')
+    if error:
+        return error
+    try:
+        error = _transition(campaign, ('sending',), 'paused', 'pause')
+        if error:
+            return error
+        held = _move_deliveries(campaign.id, ('queued',), 'paused')
+        db.session.commit()
+        return _result(campaign, held=held)
+    except Exception as e:
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}
+
+
+def resume_campaign(campaign: MessageCampaign) -> Dict[str, Any]:
+    """Continue a paused campaign where it stopped"""
+    from messaging_dispatch import DISPATCH_IN_PROCESS, dispatcher
+
+    error = _apply(campaign, ('paused',), 'resume')
+    if error:
+        return error
+    try:
+        error = _transition(campaign, ('paused',), 'sending', 'resume')
+        if error:
+            return error
+        released = _move_deliveries(campaign.id, ('paused',), 'queued')
+        db.session.commit()
+        channel, priority = campaign.template.template_type, campaign.priority or 'normal'
+        if DISPATCH_IN_PROCESS:
+            dispatcher.start(current_app._get_current_object(), [channel], [priority])
+        dispatcher.notify(channel, priority)
+        return _result(campaign, released=released)
+    except Exception as e:
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}
+
+
+def cancel_campaign(campaign: MessageCampaign) -> Dict[str, Any]:
+    """Stop a campaign for good; deliveries not yet sent are cancelled"""
+    error = _apply(campaign, ('scheduled', 'sending', 'paused'), 'cancel')
+    if error:
+        return error
+    try:
+        error = _transition(campaign, ('scheduled', 'sending', 'paused'), 'cancelled', 'cancel',
+                            completed_at=datetime.utcnow())
+        if error:
+            return error
+        cancelled = _move_deliveries(campaign.id, ('scheduled', 'queued', 'paused'), 'cancelled')
+        db.session.commit()
+        return _result(campaign, cancelled=cancelled)
+    except Exception as e:
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}
+
+
+def set_campaign_rate(campaign: MessageCampaign, send_rate: Optional[float]) -> Dict[str, Any]:
+    """Change the maximum messages per second of a campaign, None removes the limit"""
+    error = _apply(campaign, ('scheduled', 'sending', 'paused'), 'throttle')
+    if error:
+        return error
+    if send_rate is not None and (not math.isfinite(send_rate) or send_rate <= 0):
+        return {'success': False, 'error': 'Send rate must be a positive number'}
+    try:
+        campaign.send_rate = send_rate
+        db.session.commit()
+        return _result(campaign)
+    except Exception as e:
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}
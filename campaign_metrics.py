@@ -0,0 +1,153 @@
+"""
+Campaign Metrics - Atomic, batched updates of MessageCampaign counters
+Counters are only ever changed with UPDATE ... SET col = col + :n, never by
+read-modify-write on a loaded campaign, so concurrent workers cannot lose
+updates. Increments are collected per campaign and applied with one
+statement each. With CAMPAIGN_COUNTER_SHARDS set, increments go to one of
+several shard rows per campaign instead of the hot campaign row, and reads
+add the shards to the campaign's own columns. Every increment is also added
+to the analytics rollups in the same transaction.
+"""
+
+import os
+import random
+from collections import defaultdict
+from typing import Any, Dict, Iterable
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import CampaignCounterShard, MessageCampaign
+from analytics_rollups import record_rollups
+
+# Counter columns on MessageCampaign (and CampaignCounterShard)
+CAMPAIGN_COUNTERS = (
+    'messages_sent', 'messages_delivered', 'messages_failed', 'messages_opened',
+    'messages_clicked', 'messages_bounced', 'unsubscribes'
+)
+
+# Shard rows per campaign for counter increments (0 = update the campaign row)
+CAMPAIGN_COUNTER_SHARDS = int(os.environ.get('CAMPAIGN_COUNTER_SHARDS', '0'))
+
+
+def _check(counters: Dict[str, int]):
+    unknown = set(counters) - set(CAMPAIGN_COUNTERS)
+    if unknown:
+        raise ValueError(f"Unknown campaign counters: {', '.join(sorted(unknown))}")
+
+
+def increment_campaign_counters(campaign_id: int, counters: Dict[str, int], **values: Any):
+    """
+    Add to a campaign's counters in the current transaction
+
+    Args:
+        campaign_id: Campaign to update
+        counters: Counter name -> amount to add
+        values: Other MessageCampaign columns to set in the same statement
+            when counters are not sharded
+    """
+    _check(counters)
+    _increment(campaign_id, counters, values)
+    record_rollups({campaign_id: counters})
+
+
+def _increment(campaign_id: int, counters: Dict[str, int], values: Dict[str, Any]):
+    counters = {name: amount for name, amount in counters.items() if amount}
+
+    if counters and CAMPAIGN_COUNTER_SHARDS > 0:
+        _increment_shard(campaign_id, counters, random.randrange(CAMPAIGN_COUNTER_SHARDS))
+        counters = {}
+
+    update_values = {getattr(MessageCampaign, name): getattr(MessageCampaign, name) + amount
+                     for name, amount in counters.items()}
+    update_values.update({getattr(MessageCampaign, name): value for name, value in values.items()})
+    if update_values:
+        MessageCampaign.query.filter_by(id=campaign_id).update(update_values, synchronize_session=False)
+
+
+def _increment_shard(campaign_id: int, counters: Dict[str, int], shard: int):
+    shard_values = {getattr(CampaignCounterShard, name): getattr(CampaignCounterShard, name) + amount
+                    for name, amount in counters.items()}
+    query = CampaignCounterShard.query.filter_by(campaign_id=campaign_id, shard=shard)
+    if query.update(shard_values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(CampaignCounterShard(campaign_id=campaign_id, shard=shard, **{
+                name: counters.get(name, 0) for name in CAMPAIGN_COUNTERS
+            }))
+    except IntegrityError:
+        # Another worker created the shard row first
+        query.update(shard_values, synchronize_session=False)
+
+
+class CounterBatch:
+    """Collects counter increments for many campaigns and applies them together"""
+
+    def __init__(self):
+        self._increments: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, campaign_id: int, counter: str, amount: int = 1):
+        _check({counter: amount})
+        self._increments[campaign_id][counter] += amount
+
+    def __bool__(self) -> bool:
+        return bool(self._increments)
+
+    def apply(self) -> int:
+        """Issue one UPDATE per campaign in the current transaction; returns campaigns updated"""
+        # Campaign rows in id order, so concurrent batches lock them consistently
+        for campaign_id in sorted(self._increments):
+            _increment(campaign_id, self._increments[campaign_id], {})
+        record_rollups(self._increments)
+        applied = len(self._increments)
+        self._increments.clear()
+        return applied
+
+
+def campaign_counter_totals(campaign_ids: Iterable[int]) -> Dict[int, Dict[str, int]]:
+    """Current counters of campaigns, the campaign columns plus any shard rows"""
+    campaign_ids = list(campaign_ids)
+    if not campaign_ids:
+        return {}
+
+    rows = db.session.query(
+        MessageCampaign.id, *[getattr(MessageCampaign, name) for name in CAMPAIGN_COUNTERS]
+    ).filter(MessageCampaign.id.in_(campaign_ids)).all()
+    totals = {row.id: {name: getattr(row, name) or 0 for name in CAMPAIGN_COUNTERS} for row in rows}
+
+    shard_rows = db.session.query(
+        CampaignCounterShard.campaign_id,
+        *[func.sum(getattr(CampaignCounterShard, name)).label(name) for name in CAMPAIGN_COUNTERS]
+    ).filter(
+        CampaignCounterShard.campaign_id.in_(campaign_ids)
+    ).group_by(CampaignCounterShard.campaign_id).all()
+    for row in shard_rows:
+        if row.campaign_id in totals:
+            for name in CAMPAIGN_COUNTERS:
+                totals[row.campaign_id][name] += getattr(row, name) or 0
+    return totals
+
+
+def fold_counter_shards(campaign_id: int) -> int:
+    """
+    Move a campaign's shard totals into its own columns and commit
+
+    Shard rows are locked while they are read and deleted, so increments
+    running at the same time wait and then create fresh shard rows.
+    """
+    query = CampaignCounterShard.query.filter_by(campaign_id=campaign_id)
+    shards = query.with_for_update().all()
+    if not shards:
+        db.session.commit()
+        return 0
+    MessageCampaign.query.filter_by(id=campaign_id).update({
+        getattr(MessageCampaign, name): getattr(MessageCampaign, name) + sum(getattr(shard, name) for shard in shards)
+        for name in CAMPAIGN_COUNTERS
+    }, synchronize_session=False)
+    CampaignCounterShard.query.filter(
+        CampaignCounterShard.id.in_([shard.id for shard in shards])
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return len(shards)
@@ -0,0 +1,187 @@
+"""
+Campaign Scheduler - Starts scheduled campaigns and completes finished ones
+Due campaigns are found with an index seek on (status, scheduled_at) and the
+loop sleeps until the next scheduled start, so thousands of future campaigns
+cost nothing until they are due. The same loop is the time wheel for
+recipient-local send windows, releasing delivery slots as they come due.
+Run this module directly to start the scheduler process together with
+outbox send workers.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func
+
+from app import db
+from models import MessageCampaign
+from message_outbox import release_scheduled, release_due_slots, next_release_at
+from messaging_dispatch import DEFAULT_CHANNEL_CONCURRENCY, dispatcher
+
+# Longest the scheduler sleeps between checks, bounds start latency for new campaigns
+SCHEDULER_MAX_SLEEP_SECONDS = float(os.environ.get('SCHEDULER_MAX_SLEEP_SECONDS', '15'))
+
+# Shortest sleep between passes, keeps an overdue slot the scheduler cannot
+# release yet from turning the loop into a busy poll of the database
+SCHEDULER_MIN_SLEEP_SECONDS = float(os.environ.get('SCHEDULER_MIN_SLEEP_SECONDS', '1'))
+
+# Campaigns started per pass
+SCHEDULER_BATCH_SIZE = int(os.environ.get('SCHEDULER_BATCH_SIZE', '100'))
+
+
+class CampaignScheduler:
+    """Moves campaigns from scheduled to sending to completed"""
+
+    def __init__(self, max_sleep: float = None, batch_size: int = None):
+        self.max_sleep = max_sleep or SCHEDULER_MAX_SLEEP_SECONDS
+        self.batch_size = batch_size or SCHEDULER_BATCH_SIZE
+        self.logger = logging.getLogger(__name__)
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self, app):
+        """Start the scheduler loop in a background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, args=(app,),
+                                        name='campaign-scheduler', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """Re-check schedules now, e.g. after an earlier campaign was scheduled"""
+        self._wakeup.set()
+
+    def _loop(self, app):
+        while not self._stopping.is_set():
+            with app.app_context():
+                try:
+                    wait = self.run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    wait = self.max_sleep
+                    self.logger.error(f"Campaign scheduler error: {str(e)}")
+                finally:
+                    db.session.remove()
+
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    def run_once(self) -> float:
+        """
+        Start due campaigns and complete drained ones
+
+        Must run inside an app context.
+
+        Returns:
+            Seconds until the next check
+        """
+        now = datetime.utcnow()
+        due = db.session.query(MessageCampaign.id).filter(
+            MessageCampaign.status == 'scheduled',
+            MessageCampaign.scheduled_at <= now
+        ).order_by(MessageCampaign.scheduled_at).limit(self.batch_size).all()
+
+        for row in due:
+            self.start_campaign(row.id)
+
+        self.release_window_slots(now)
+        self.complete_finished_campaigns()
+
+        if len(due) == self.batch_size:
+            return 0
+        upcoming = [moment for moment in (self.next_scheduled_at(), next_release_at()) if moment]
+        if not upcoming:
+            return self.max_sleep
+        wait = (min(upcoming) - datetime.utcnow()).total_seconds()
+        return min(self.max_sleep, max(SCHEDULER_MIN_SLEEP_SECONDS, wait))
+
+    def release_window_slots(self, now: datetime) -> int:
+        """Queue the send-window deliveries whose time wheel slot has come"""
+        try:
+            released = release_due_slots(now)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.logger.error(f"Error releasing send window slots: {str(e)}")
+            return 0
+
+        if released:
+            for channel in DEFAULT_CHANNEL_CONCURRENCY:
+                dispatcher.notify(channel)
+            self.logger.info(f"Released {released} send window deliveries")
+        return released
+
+    def next_scheduled_at(self) -> Optional[datetime]:
+        """Earliest pending start time, answered from the (status, scheduled_at) index"""
+        return db.session.query(func.min(MessageCampaign.scheduled_at)).filter(
+            MessageCampaign.status == 'scheduled'
+        ).scalar()
+
+    def start_campaign(self, campaign_id: int) -> bool:
+        """
+        Move a due campaign to sending and release its deliveries to the outbox
+
+        The conditional update makes this safe with several schedulers running.
+        """
+        try:
+            started = MessageCampaign.query.filter_by(id=campaign_id, status='scheduled').update({
+                MessageCampaign.status: 'sending',
+                MessageCampaign.sent_at: datetime.utcnow()
+            }, synchronize_session=False)
+            if not started:
+                db.session.rollback()
+                return False
+
+            released = release_scheduled(campaign_id)
+            db.session.commit()
+
+            campaign = db.session.get(MessageCampaign, campaign_id)
+            dispatcher.notify(campaign.template.template_type)
+            self.logger.info(f"Campaign {campaign_id} started: {released} deliveries queued")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            self.logger.error(f"Error starting campaign {campaign_id}: {str(e)}")
+            return False
+
+    def complete_finished_campaigns(self):
+        """Complete sending campaigns whose deliveries are all processed"""
+        sending = db.session.query(MessageCampaign.id).filter(
+            MessageCampaign.status == 'sending'
+        ).all()
+        for row in sending:
+            dispatcher.finish_campaign(row.id)
+
+    def shutdown(self):
+        """Stop the scheduler loop"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stopping.clear()
+
+
+# Process-wide scheduler
+scheduler = CampaignScheduler()
+
+
+if __name__ == "__main__":
+    import main  # noqa: F401 - registers routes before the app is used
+    from app import app
+
+    logging.info("Starting campaign scheduler and outbox workers")
+    scheduler.start(app)
+    dispatcher.start(app)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        scheduler.shutdown()
+        dispatcher.shutdown()
@@ -0,0 +1,69 @@
+"""
+Shared pytest fixtures - the app on a throwaway SQLite database
+Background send workers are disabled; tests drive the outbox, scheduler
+and dispatcher directly. Every test starts from empty tables.
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+os.environ.setdefault('SESSION_SECRET', 'test-secret')
+os.environ['DISPATCH_IN_PROCESS'] = 'false'
+
+import pytest
+
+import main  # noqa: F401 - registers routes before the app is used
+from app import app as flask_app, db
+from models import Contact, MessageCampaign, Organization, Template, User
+from messaging import MessagingService
+
+
+@pytest.fixture
+def app():
+    """App context on empty tables"""
+    with flask_app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        yield flask_app
+        db.session.rollback()
+        db.session.remove()
+
+
+@pytest.fixture
+def organization(app):
+    """An organization with an SMS and an email template and 20 contacts"""
+    user = User(username='owner', email='owner@example.com', password_hash='x', first_name='Ada', last_name='Owner')
+    db.session.add(user)
+    db.session.commit()
+
+    organization = Organization(name='Acme', owner_id=user.id)
+    db.session.add(organization)
+    db.session.commit()
+
+    db.session.add_all([
+        Template(name='sms', template_type='sms', content='Hi {first_name}',
+                 organization_id=organization.id, created_by_id=user.id),
+        Template(name='email', template_type='email', subject='Hello {first_name}', content='Dear {full_name}',
+                 organization_id=organization.id, created_by_id=user.id),
+        *[Contact(first_name=f'First{i}', last_name='Last', email=f'contact{i}@example.com',
+                  phone=f'+1 555 010 {i:04d}', organization_id=organization.id, created_by_id=user.id)
+          for i in range(20)]
+    ])
+    db.session.commit()
+    return organization
+
+
+@pytest.fixture
+def queue_campaign(organization):
+    """Queue an SMS campaign to the first `count` contacts through MessagingService; returns the campaign"""
+    def queue(count: int = 10, **options) -> MessageCampaign:
+        template = Template.query.filter_by(organization_id=organization.id, template_type='sms').one()
+        contacts = Contact.query.filter_by(organization_id=organization.id).order_by(Contact.id).limit(count)
+        result = MessagingService().send_message(template.id, [contact.id for contact in contacts],
+                                                 organization_id=organization.id, **options)
+        assert result['success'], result
+        return db.session.get(MessageCampaign, result['campaign_id'])
+
+    return queue
@@ -0,0 +1,131 @@
+"""
+Contact Addresses - Canonical email and E.164 phone forms
+Messages go to one canonical form of each address, so contacts entered
+twice or sharing a number are recognised as the same recipient.
+"""
+
+import os
+from functools import lru_cache
+from typing import Optional
+
+# Calling code for local numbers of contacts without a known country, e.g. '1' or '91'
+DEFAULT_PHONE_COUNTRY_CODE = os.environ.get('DEFAULT_PHONE_COUNTRY_CODE', '').lstrip('+')
+
+# International calling codes by country code or name (lowercase)
+COUNTRY_CALLING_CODES = {
+    'us': '1', 'usa': '1', 'united states': '1', 'united states of america': '1',
+    'ca': '1', 'canada': '1',
+    'mx': '52', 'mexico': '52',
+    'br': '55', 'brazil': '55',
+    'ar': '54', 'argentina': '54',
+    'cl': '56', 'chile': '56',
+    'co': '57', 'colombia': '57',
+    'pe': '51', 'peru': '51',
+    'gb': '44', 'uk': '44', 'united kingdom': '44', 'great britain': '44', 'england': '44',
+    'scotland': '44',
+    'ie': '353', 'ireland': '353',
+    'pt': '351', 'portugal': '351',
+    'es': '34', 'spain': '34',
+    'fr': '33', 'france': '33',
+    'be': '32', 'belgium': '32',
+    'nl': '31', 'netherlands': '31',
+    'de': '49', 'germany': '49',
+    'ch': '41', 'switzerland': '41',
+    'at': '43', 'austria': '43',
+    'it': '39', 'italy': '39',
+    'dk': '45', 'denmark': '45',
+    'se': '46', 'sweden': '46',
+    'no': '47', 'norway': '47',
+    'fi': '358', 'finland': '358',
+    'pl': '48', 'poland': '48',
+    'cz': '420', 'czech republic': '420', 'czechia': '420',
+    'gr': '30', 'greece': '30',
+    'ro': '40', 'romania': '40',
+    'ua': '380', 'ukraine': '380',
+    'tr': '90', 'turkey': '90',
+    'ru': '7', 'russia': '7',
+    'il': '972', 'israel': '972',
+    'eg': '20', 'egypt': '20',
+    'za': '27', 'south africa': '27',
+    'ng': '234', 'nigeria': '234',
+    'ke': '254', 'kenya': '254',
+    'sa': '966', 'saudi arabia': '966',
+    'ae': '971', 'uae': '971', 'united arab emirates': '971',
+    'qa': '974', 'qatar': '974',
+    'pk': '92', 'pakistan': '92',
+    'in': '91', 'india': '91',
+    'lk': '94', 'sri lanka': '94',
+    'np': '977', 'nepal': '977',
+    'bd': '880', 'bangladesh': '880',
+    'th': '66', 'thailand': '66',
+    'vn': '84', 'vietnam': '84',
+    'my': '60', 'malaysia': '60',
+    'sg': '65', 'singapore': '65',
+    'id': '62', 'indonesia': '62',
+    'ph': '63', 'philippines': '63',
+    'cn': '86', 'china': '86',
+    'hk': '852', 'hong kong': '852',
+    'tw': '886', 'taiwan': '886',
+    'kr': '82', 'south korea': '82', 'korea': '82',
+    'jp': '81', 'japan': '81',
+    'au': '61', 'australia': '61',
+    'nz': '64', 'new zealand': '64'
+}
+
+
+def canonical_email(email: Optional[str]) -> Optional[str]:
+    """Trimmed, lowercased email address, or None when there is none"""
+    email = (email or '').strip().lower()
+    return email if '@' in email else None
+
+
+def normalize_phone(phone: Optional[str], country: Optional[str] = None) -> Optional[str]:
+    """
+    Best-effort E.164 form (+<country code><number>) of a phone number
+
+    Numbers without an international prefix take the calling code of the
+    contact's country, else DEFAULT_PHONE_COUNTRY_CODE; a leading trunk 0
+    is dropped. Returns None when the number cannot be resolved.
+    """
+    if not phone:
+        return None
+    return _normalize_phone(phone.strip(), (country or '').strip().lower())
+
+
+@lru_cache(maxsize=8192)
+def _normalize_phone(phone: str, country: str) -> Optional[str]:
+    digits = ''.join(filter(str.isdigit, phone))
+    if phone.startswith('+'):
+        number = digits
+    elif digits.startswith('00'):
+        number = digits[2:]
+    else:
+        code = COUNTRY_CALLING_CODES.get(country) or DEFAULT_PHONE_COUNTRY_CODE
+        if not code:
+            return None
+        # Italian numbers keep their leading 0 after the country code
+        national = digits.lstrip('0') if code != '39' else digits
+        # Longer than a national number: already carries the country code, e.g. 91 98...
+        if national.startswith(code) and len(national) > 10:
+            number = national
+        else:
+            number = code + national
+    if not 8 <= len(number) <= 15:
+        return None
+    return '+' + number
+
+
+def phone_key(phone: Optional[str], country: Optional[str] = None) -> Optional[str]:
+    """Key under which the same number compares equal: E.164, or bare digits if unresolved"""
+    e164 = normalize_phone(phone, country)
+    if e164:
+        return e164
+    digits = ''.join(filter(str.isdigit, phone or ''))
+    return digits or None
+
+
+def gateway_number(number: str) -> str:
+    """Number as digits only, the form SMS and WhatsApp gateways take (E.164 without the +)"""
+    if number.startswith('+') and number[1:].isdigit():
+        return number[1:]
+    return ''.join(filter(str.isdigit, number))
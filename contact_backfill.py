@@ -0,0 +1,72 @@
+"""
+Contact Address Backfill - Fill normalized address columns of existing contacts
+Contacts are normalized whenever they are saved; this job brings rows
+written before the columns existed (or by bulk SQL) up to date, in id
+order and in bounded batches. Safe to re-run.
+"""
+
+import os
+import logging
+from typing import Optional
+
+from sqlalchemy import update
+
+from app import db
+from models import Contact
+from contact_addresses import canonical_email, normalize_phone
+
+# Contacts read and updated per transaction
+CONTACT_BACKFILL_BATCH_SIZE = int(os.environ.get('CONTACT_BACKFILL_BATCH_SIZE', '1000'))
+
+
+def backfill_contact_addresses(batch_size: int = None, organization_id: Optional[int] = None) -> int:
+    """
+    Recompute email_canonical, phone_e164 and mobile_e164 where they are stale
+
+    Must run inside an app context.
+
+    Returns:
+        Number of contacts updated
+    """
+    batch_size = batch_size or CONTACT_BACKFILL_BATCH_SIZE
+    last_id = 0
+    updated = 0
+    while True:
+        query = db.session.query(
+            Contact.id, Contact.email, Contact.phone, Contact.mobile, Contact.country,
+            Contact.email_canonical, Contact.phone_e164, Contact.mobile_e164
+        ).filter(Contact.id > last_id)
+        if organization_id is not None:
+            query = query.filter(Contact.organization_id == organization_id)
+        rows = query.order_by(Contact.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        changes = []
+        for row in rows:
+            values = {
+                'email_canonical': canonical_email(row.email),
+                'phone_e164': normalize_phone(row.phone, row.country),
+                'mobile_e164': normalize_phone(row.mobile, row.country)
+            }
+            if (values['email_canonical'], values['phone_e164'], values['mobile_e164']) != (
+                    row.email_canonical, row.phone_e164, row.mobile_e164):
+                changes.append(dict(values, id=row.id))
+
+        if changes:
+            db.session.execute(update(Contact), changes)
+        db.session.commit()
+        updated += len(changes)
+        last_id = rows[-1].id
+
+    return updated
+
+
+if __name__ == "__main__":
+    import main  # noqa: F401 - registers routes before the app is used
+    from app import app
+
+    with app.app_context():
+        logging.info("Backfilling normalized contact addresses")
+        count = backfill_contact_addresses()
+        logging.info(f"Updated {count} contacts")
@@ -0,0 +1,112 @@
+"""
+Fair-Share Send Scheduling - Deficit round-robin across organizations
+Send workers ask which organization to serve next instead of draining the
+outbox in FIFO order, so one tenant's large campaign cannot starve the
+others. Each organization gets batches in proportion to its send_weight and
+never more concurrent batches than its send_concurrency_limit.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from models import OrganizationConfig
+from message_outbox import organizations_with_due_work
+
+# Seconds between refreshes of the organizations that have queued work
+FAIR_SHARE_REFRESH_SECONDS = float(os.environ.get('FAIR_SHARE_REFRESH_SECONDS', '2'))
+
+# Largest send_weight an organization can have; higher stored weights are capped
+FAIR_SHARE_MAX_WEIGHT = max(1, int(os.environ.get('FAIR_SHARE_MAX_WEIGHT', '10')))
+
+
+def send_weight(config: Optional[OrganizationConfig]) -> int:
+    """An organization's share of send workers, 1 to FAIR_SHARE_MAX_WEIGHT"""
+    weight = (config.send_weight if config else None) or 1
+    return min(FAIR_SHARE_MAX_WEIGHT, max(1, weight))
+
+
+def send_concurrency_limit(config: Optional[OrganizationConfig]) -> Optional[int]:
+    """An organization's cap on batches in flight, None for no cap (also for invalid stored caps)"""
+    limit = config.send_concurrency_limit if config else None
+    return limit if limit and limit >= 1 else None
+
+
+class FairShareQueue:
+    """Deficit round-robin over the organizations with due deliveries in one channel lane"""
+
+    def __init__(self, channel: str, priority: str, quantum: int, refresh_seconds: float = None):
+        self.channel = channel
+        self.priority = priority
+        self.quantum = quantum
+        self.refresh_seconds = refresh_seconds or FAIR_SHARE_REFRESH_SECONDS
+        self._ring: Deque[Optional[int]] = deque()
+        self._deficits: Dict[Optional[int], float] = {}
+        self._weights: Dict[Optional[int], int] = {}
+        self._limits: Dict[Optional[int], Optional[int]] = {}
+        self._in_flight: Dict[Optional[int], int] = {}
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Reload the organizations with work and their weights and caps; needs an app context"""
+        organization_ids = organizations_with_due_work(self.channel, self.priority)
+        configs = {config.organization_id: config for config in OrganizationConfig.query.filter(
+            OrganizationConfig.organization_id.in_([org for org in organization_ids if org is not None])
+        )} if organization_ids else {}
+
+        with self._lock:
+            self._refreshed = time.monotonic()
+            for org in organization_ids:
+                config = configs.get(org)
+                self._weights[org] = send_weight(config)
+                self._limits[org] = send_concurrency_limit(config)
+                if org not in self._deficits:
+                    self._deficits[org] = 0.0
+                    self._ring.append(org)
+
+    def acquire(self, max_batch: int) -> Optional[Tuple[Optional[int], int]]:
+        """
+        Pick the organization to serve next
+
+        The organization at the head keeps its turn until its deficit is
+        spent, then moves to the back of the ring.
+
+        Returns:
+            (organization_id, batch limit), or None when nothing can be served
+        """
+        with self._lock:
+            stale = not self._ring or time.monotonic() - self._refreshed >= self.refresh_seconds
+            if stale:
+                self._refreshed = time.monotonic()
+        if stale:
+            self.refresh()
+
+        with self._lock:
+            for _ in range(len(self._ring)):
+                org = self._ring[0]
+                limit = self._limits.get(org)
+                if limit and self._in_flight.get(org, 0) >= limit:
+                    self._ring.rotate(-1)
+                    continue
+
+                if self._deficits[org] < 1:
+                    self._deficits[org] += self.quantum * self._weights.get(org, 1)
+                batch = int(min(self._deficits[org], max_batch))
+                self._deficits[org] -= batch
+                if self._deficits[org] < 1:
+                    self._ring.rotate(-1)
+
+                self._in_flight[org] = self._in_flight.get(org, 0) + 1
+                return org, batch
+        return None
+
+    def release(self, organization_id: Optional[int], limit: int, claimed: int):
+        """Return a served turn; an organization that ran out of due work leaves the ring"""
+        with self._lock:
+            self._in_flight[organization_id] = max(0, self._in_flight.get(organization_id, 1) - 1)
+            if claimed < limit and organization_id in self._deficits:
+                del self._deficits[organization_id]
+                self._ring.remove(organization_id)
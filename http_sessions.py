@@ -0,0 +1,66 @@
+"""
+HTTP Gateway Sessions - Shared keep-alive sessions for HTTP messaging gateways
+One requests.Session per gateway, with a connection pool sized to the
+send workers of its channel and explicit connect/read timeouts
+"""
+
+import os
+import atexit
+import threading
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeout in seconds passed to every gateway request
+GATEWAY_TIMEOUT = (
+    float(os.environ.get('GATEWAY_CONNECT_TIMEOUT', '5')),
+    float(os.environ.get('GATEWAY_READ_TIMEOUT', '30'))
+)
+
+# Connections per gateway for channels whose send worker count was not set
+DEFAULT_GATEWAY_POOL_SIZE = int(os.environ.get('GATEWAY_POOL_SIZE', '16'))
+
+_sessions = {}
+_pool_sizes: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def set_channel_pool_size(channel: str, size: int):
+    """Size the pools of a channel's gateways created from now on, e.g. to its send worker count"""
+    with _lock:
+        _pool_sizes[channel] = max(1, size)
+
+
+def create_gateway_session(pool_size: int) -> requests.Session:
+    """Create a keep-alive session with a connection pool of the given size"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_gateway_session(gateway: str, channel: str = 'sms') -> requests.Session:
+    """Get the shared session for a gateway, creating it on first use"""
+    session = _sessions.get(gateway)
+    if session is None:
+        with _lock:
+            session = _sessions.get(gateway)
+            if session is None:
+                session = create_gateway_session(_pool_sizes.get(channel, DEFAULT_GATEWAY_POOL_SIZE))
+                _sessions[gateway] = session
+    return session
+
+
+def close_gateway_sessions():
+    """Close all shared gateway sessions"""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+# Close pooled gateway connections cleanly when the process exits
+atexit.register(close_gateway_sessions)
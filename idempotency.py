@@ -0,0 +1,194 @@
+"""
+Idempotency Keys - Answer retried send requests from their first result
+A client that retries a send with the same Idempotency-Key gets the stored
+result of the original request instead of messaging every contact again.
+Keys are kept hashed per organization in the idempotency_keys table, with a
+small in-process LRU in front so hot retries skip the database. A key whose
+request crashed before finishing can be taken over by a retry once its
+reservation is older than IDEMPOTENCY_IN_PROGRESS_SECONDS.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import IdempotencyKey
+
+# How long a key is remembered after its first use
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+
+# Seconds after which an unfinished reservation is presumed crashed and can be taken over
+IDEMPOTENCY_IN_PROGRESS_SECONDS = int(os.environ.get('IDEMPOTENCY_IN_PROGRESS_SECONDS', '600'))
+
+# Completed results kept in memory per process
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '1024'))
+
+# Longest accepted client key
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+KEY_IN_PROGRESS = 'A request with this Idempotency-Key is still in progress'
+KEY_REUSED = 'Idempotency-Key was already used for a different request'
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _conflict(error: str) -> Dict[str, Any]:
+    return {'success': False, 'conflict': True, 'error': error}
+
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """Stable hash of a request payload, to detect a key reused for a different request"""
+    return _digest(json.dumps(payload, sort_keys=True, default=str))
+
+
+class IdempotencyStore:
+    """Database-backed idempotency keys with an LRU of completed results"""
+
+    def __init__(self, ttl: int = None, cache_size: int = None):
+        self.ttl = ttl or IDEMPOTENCY_TTL_SECONDS
+        self.cache_size = cache_size or IDEMPOTENCY_CACHE_SIZE
+        self._cache: 'OrderedDict[Tuple[int, str], Tuple[datetime, str, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, cache_key: Tuple[int, str]) -> Optional[Tuple[datetime, str, Dict[str, Any]]]:
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is None:
+                return None
+            if entry[0] <= datetime.utcnow():
+                del self._cache[cache_key]
+                return None
+            self._cache.move_to_end(cache_key)
+            return entry
+
+    def _remember(self, cache_key: Tuple[int, str], entry: Tuple[datetime, str, Dict[str, Any]]):
+        with self._lock:
+            self._cache[cache_key] = entry
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def run(self, organization_id: int, key: str, fingerprint: str,
+            send: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Run a send request at most once per idempotency key
+
+        The key is reserved in its own transaction before `send` runs, so a
+        concurrent duplicate is refused instead of sending twice. Successful
+        results are stored; a failed send gives the key up so the client can
+        retry it. A reservation left by a request that died mid-send is taken
+        over once it is older than the in-progress timeout.
+
+        Returns:
+            The send result, a stored result marked 'idempotent_replay', or an
+            error result when the key is in use
+        """
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return {'success': False, 'error': f'Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters'}
+
+        key_hash = _digest(key)
+        cache_key = (organization_id, key_hash)
+        now = datetime.utcnow()
+
+        entry = self._cached(cache_key)
+        stale = None
+        if entry is None:
+            row = IdempotencyKey.query.filter_by(organization_id=organization_id, key_hash=key_hash).first()
+            if row is not None and row.expires_at <= now:
+                db.session.delete(row)
+                db.session.commit()
+                row = None
+            if row is not None:
+                if row.response is None:
+                    if row.request_hash != fingerprint:
+                        return _conflict(KEY_REUSED)
+                    reserved_at = row.reserved_at or row.created_at
+                    if reserved_at and reserved_at > now - timedelta(seconds=IDEMPOTENCY_IN_PROGRESS_SECONDS):
+                        return _conflict(KEY_IN_PROGRESS)
+                    stale = row
+                else:
+                    entry = (row.expires_at, row.request_hash, json.loads(row.response))
+                    self._remember(cache_key, entry)
+
+        if entry is not None:
+            if entry[1] != fingerprint:
+                return _conflict(KEY_REUSED)
+            return dict(entry[2], idempotent_replay=True)
+
+        if stale is not None:
+            # Take the crashed request's reservation over; of racing retries only one matches
+            taken = db.session.execute(
+                update(IdempotencyKey).where(
+                    IdempotencyKey.id == stale.id,
+                    IdempotencyKey.response.is_(None),
+                    IdempotencyKey.reserved_at.is_(None) if stale.reserved_at is None
+                    else IdempotencyKey.reserved_at == stale.reserved_at
+                ).values(reserved_at=now).execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if not taken:
+                return _conflict(KEY_IN_PROGRESS)
+        else:
+            # Reserve the key; the unique constraint turns a racing duplicate away
+            try:
+                db.session.add(IdempotencyKey(
+                    organization_id=organization_id,
+                    key_hash=key_hash,
+                    request_hash=fingerprint,
+                    reserved_at=now,
+                    expires_at=now + timedelta(seconds=self.ttl)
+                ))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return _conflict(KEY_IN_PROGRESS)
+
+        result = None
+        try:
+            result = send()
+        finally:
+            self._finish(cache_key, fingerprint, now, result)
+        return result
+
+    def _finish(self, cache_key: Tuple[int, str], fingerprint: str, reserved_at: datetime,
+                result: Optional[Dict[str, Any]]):
+        """Store a successful result under its key, or give the key up, unless the reservation was taken over"""
+        organization_id, key_hash = cache_key
+        try:
+            db.session.rollback()
+            row = IdempotencyKey.query.filter_by(
+                organization_id=organization_id, key_hash=key_hash, reserved_at=reserved_at
+            ).first()
+            if row is None:
+                return
+            if result and result.get('success'):
+                row.response = json.dumps(result, default=str)
+                db.session.commit()
+                self._remember(cache_key, (row.expires_at, fingerprint, json.loads(row.response)))
+            else:
+                db.session.delete(row)
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def purge_expired(self) -> int:
+        """Delete expired keys"""
+        deleted = IdempotencyKey.query.filter(
+            IdempotencyKey.expires_at <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
+idempotency_keys = IdempotencyStore()
@@ -0,0 +1,441 @@
+"""
+Message Outbox - Durable queue of outgoing messages on MessageDelivery
+Every message is written as a 'queued' delivery row in the same transaction
+as its campaign, then claimed by send workers in any process. PostgreSQL
+claims use SELECT ... FOR UPDATE SKIP LOCKED; other databases (SQLite in
+tests) claim with a single conditional UPDATE tagged with a claim token.
+"""
+
+import os
+import uuid
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, case, func, insert, or_, select, update
+
+from app import db
+from models import MessageCampaign, MessageDelivery
+
+# Priority lanes, most urgent first; each has its own send workers
+PRIORITY_LANES = ('transactional', 'normal', 'bulk')
+
+# Maximum waiting deliveries per lane, override with OUTBOX_<LANE>_QUEUE_LIMIT (0 = unlimited)
+DEFAULT_LANE_QUEUE_LIMITS = {
+    'transactional': 1000,
+    'normal': 0,
+    'bulk': 0
+}
+
+# Statuses after which a delivery is never sent again
+TERMINAL_STATUSES = ('sent', 'delivered', 'failed', 'bounced', 'suppressed')
+
+# A claim older than this is considered abandoned by a dead worker
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', '600'))
+
+# Total send attempts for transiently failing deliveries
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', '30'))
+
+
+def get_lane_queue_limit(priority: str) -> int:
+    """Get the configured queue depth limit of a priority lane"""
+    default = DEFAULT_LANE_QUEUE_LIMITS.get(priority, 0)
+    return int(os.environ.get(f'OUTBOX_{priority.upper()}_QUEUE_LIMIT', default))
+
+
+def lane_has_room(priority: str, count: int) -> bool:
+    """Check if a lane can take `count` more deliveries without exceeding its depth"""
+    limit = get_lane_queue_limit(priority)
+    if not limit:
+        return True
+    waiting = db.session.query(func.count(MessageDelivery.id)).filter(
+        MessageDelivery.status.in_(('scheduled', 'queued')),
+        MessageDelivery.priority == priority
+    ).scalar()
+    return waiting + count <= limit
+
+
+def enqueue_deliveries(campaign: MessageCampaign, recipients: Iterable[Dict[str, Any]],
+                       status: str = 'queued') -> int:
+    """
+    Bulk-insert queued deliveries for a campaign in the current transaction
+
+    Args:
+        campaign: Flushed campaign the deliveries belong to
+        recipients: Dicts with contact_id and recipient address, and
+            optionally the timezone bucket and next_attempt_at release time
+        status: 'queued', or 'scheduled' to hold them until the campaign starts
+
+    Returns:
+        Number of deliveries queued
+    """
+    channel = campaign.template.template_type
+    now = datetime.utcnow()
+    rows = [{
+        'campaign_id': campaign.id,
+        'contact_id': recipient['contact_id'],
+        'organization_id': campaign.organization_id,
+        'channel': channel,
+        'priority': campaign.priority or 'normal',
+        'recipient': recipient.get('recipient') or '',
+        'status': status,
+        'timezone': recipient.get('timezone'),
+        'next_attempt_at': recipient.get('next_attempt_at'),
+        'attempts': 0,
+        'created_at': now,
+        'updated_at': now
+    } for recipient in recipients]
+
+    if rows:
+        db.session.execute(insert(MessageDelivery), rows)
+    return len(rows)
+
+
+def _claimable(channel: str, priority: str, now: datetime):
+    """Filter for queued deliveries of a channel's priority lane that are due"""
+    return (
+        MessageDelivery.status == 'queued',
+        MessageDelivery.channel == channel,
+        MessageDelivery.priority == priority,
+        or_(MessageDelivery.next_attempt_at.is_(None), MessageDelivery.next_attempt_at <= now)
+    )
+
+
+def claim_batch(channel: str, priority: str, limit: int, worker_id: str,
+                organization_id: int = None) -> List[MessageDelivery]:
+    """
+    Atomically claim up to `limit` due deliveries of a lane for this worker,
+    optionally only those of one organization
+
+    Claimed rows move to 'sending' and are committed before any provider
+    call, so no other worker can pick them up. The returned rows are
+    detached from the session, so commits made while sending (lease
+    renewals) do not expire them; results are written with record_results.
+    """
+    now = datetime.utcnow()
+    token = f'{worker_id}:{uuid.uuid4().hex[:12]}'
+    due = select(MessageDelivery.id).where(*_claimable(channel, priority, now))
+    if organization_id is not None:
+        due = due.where(MessageDelivery.organization_id == organization_id)
+    due = due.order_by(MessageDelivery.id).limit(limit)
+
+    if db.engine.dialect.name == 'postgresql':
+        ids = list(db.session.execute(due.with_for_update(skip_locked=True)).scalars())
+        if not ids:
+            db.session.commit()
+            return []
+        condition = MessageDelivery.id.in_(ids)
+    else:
+        # The conditional UPDATE is atomic, so concurrent claimers never share rows
+        condition = MessageDelivery.id.in_(due.scalar_subquery()) & (MessageDelivery.status == 'queued')
+
+    db.session.execute(
+        update(MessageDelivery).where(condition).values(
+            status='sending',
+            claimed_by=token,
+            claimed_at=now,
+            attempts=MessageDelivery.attempts + 1
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    deliveries = MessageDelivery.query.filter_by(claimed_by=token, status='sending').order_by(MessageDelivery.id).all()
+    for delivery in deliveries:
+        db.session.expunge(delivery)
+    return deliveries
+
+
+def renew_claims(token: str, delivery_ids: Iterable[int], now: datetime = None) -> Set[int]:
+    """
+    Extend the lease of deliveries still claimed by `token`, in the current transaction
+
+    Returns:
+        Ids still owned by the claim; the others were requeued as stale and
+        may belong to another worker by now, so they must not be sent or recorded
+    """
+    delivery_ids = list(delivery_ids)
+    if not delivery_ids:
+        return set()
+    condition = (
+        MessageDelivery.id.in_(delivery_ids),
+        MessageDelivery.claimed_by == token,
+        MessageDelivery.status == 'sending'
+    )
+    statement = update(MessageDelivery).where(*condition).values(
+        claimed_at=now or datetime.utcnow()
+    ).execution_options(synchronize_session=False)
+    if db.engine.dialect.update_returning:
+        return set(db.session.execute(statement.returning(MessageDelivery.id)).scalars())
+    owned = set(db.session.execute(select(MessageDelivery.id).where(*condition)).scalars())
+    db.session.execute(statement)
+    return owned
+
+
+def _result_values(delivery: MessageDelivery, result: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """Columns of a claimed delivery after a send result"""
+    values = {
+        'status': 'sent',
+        'sent_at': delivery.sent_at,
+        'error_code': None,
+        'error_message': None,
+        'next_attempt_at': delivery.next_attempt_at,
+        'message_id': result.get('message_id') or result.get('message_sid') or delivery.message_id,
+        'claimed_by': None
+    }
+    if result['success']:
+        values['sent_at'] = now
+        return values
+
+    values['error_message'] = result.get('error', '')
+    if result.get('circuit_open'):
+        values['error_code'] = 'circuit_open'
+    elif result.get('retryable'):
+        values['error_code'] = 'retryable'
+    elif result.get('outcome_unknown'):
+        # The provider may have sent it; failing it is better than a duplicate
+        values['error_code'] = 'unknown'
+
+    if values['error_code'] in ('circuit_open', 'retryable') and (delivery.attempts or 0) < OUTBOX_MAX_ATTEMPTS:
+        delay = OUTBOX_RETRY_BASE_SECONDS * (2 ** ((delivery.attempts or 1) - 1))
+        values['status'] = 'queued'
+        values['next_attempt_at'] = now + timedelta(seconds=random.uniform(delay / 2, delay))
+    else:
+        values['status'] = 'failed'
+    return values
+
+
+def record_results(token: str, outcomes: Iterable[Tuple[MessageDelivery, Dict[str, Any]]],
+                   now: datetime = None) -> Dict[int, str]:
+    """
+    Apply send results to deliveries claimed by `token`, in the current transaction
+
+    Transient failures go back to the queue with backoff until the attempt
+    budget is spent. Rows are only written while the claim still owns them;
+    results of deliveries whose claim was lost are dropped.
+
+    Returns:
+        Delivery id -> new status, for the deliveries that were written
+    """
+    now = now or datetime.utcnow()
+    outcomes = list(outcomes)
+    # Renewing first also locks the owned rows until commit, so the reaper cannot take them in between
+    owned = renew_claims(token, [delivery.id for delivery, _ in outcomes], now)
+
+    statuses = {}
+    rows = []
+    for delivery, result in outcomes:
+        if delivery.id in owned:
+            values = _result_values(delivery, result, now)
+            statuses[delivery.id] = values['status']
+            rows.append(dict(values, delivery_id=delivery.id))
+
+    if rows:
+        table = MessageDelivery.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('delivery_id'), table.c.claimed_by == token),
+            rows
+        )
+    return statuses
+
+
+def hold_deliveries(token: str, deliveries: Iterable[MessageDelivery], status: str) -> int:
+    """
+    Give deliveries claimed by `token` back unsent, e.g. 'paused' or
+    'cancelled' by a campaign control, in the current transaction
+
+    Returns:
+        Number of deliveries moved; rows whose claim was lost are left alone
+    """
+    delivery_ids = [delivery.id for delivery in deliveries]
+    if not delivery_ids:
+        return 0
+    result = db.session.execute(
+        update(MessageDelivery).where(
+            MessageDelivery.id.in_(delivery_ids),
+            MessageDelivery.claimed_by == token,
+            MessageDelivery.status == 'sending'
+        ).values(
+            status=status,
+            claimed_by=None,
+            attempts=case((MessageDelivery.attempts > 0, MessageDelivery.attempts - 1), else_=0)
+        ).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def defer_deliveries(token: str, release_at: Dict[int, datetime]) -> int:
+    """
+    Give deliveries claimed by `token` back unsent as 'scheduled' until
+    their release time, e.g. when they reach a worker outside their send
+    window, in the current transaction
+
+    Args:
+        token: Claim token of the batch
+        release_at: Delivery id -> when the scheduler may queue it again
+
+    Returns:
+        Number of deliveries moved; rows whose claim was lost are left alone
+    """
+    if not release_at:
+        return 0
+    table = MessageDelivery.__table__
+    result = db.session.execute(
+        update(table).where(
+            table.c.id == bindparam('delivery_id'),
+            table.c.claimed_by == token,
+            table.c.status == 'sending'
+        ).values(
+            status='scheduled',
+            claimed_by=None,
+            next_attempt_at=bindparam('release_at'),
+            attempts=case((table.c.attempts > 0, table.c.attempts - 1), else_=0)
+        ),
+        [{'delivery_id': delivery_id, 'release_at': at} for delivery_id, at in release_at.items()]
+    )
+    return result.rowcount
+
+
+def release_scheduled(campaign_id: int) -> int:
+    """Move a starting campaign's due scheduled deliveries into the send queue"""
+    result = db.session.execute(
+        update(MessageDelivery).where(
+            MessageDelivery.campaign_id == campaign_id,
+            MessageDelivery.status == 'scheduled',
+            or_(MessageDelivery.next_attempt_at.is_(None),
+                MessageDelivery.next_attempt_at <= datetime.utcnow())
+        ).values(status='queued').execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def requeue_stranded_paused(campaign_id: int) -> int:
+    """
+    Queue 'paused' deliveries of a campaign that is sending again, in the
+    current transaction
+
+    A worker holding a batch on a stale cached 'paused' state can commit
+    its hold after the campaign was resumed, leaving rows no resume moves.
+    """
+    sending = select(MessageCampaign.id).where(MessageCampaign.id == campaign_id, MessageCampaign.status == 'sending')
+    result = db.session.execute(
+        update(MessageDelivery).where(
+            MessageDelivery.campaign_id.in_(sending),
+            MessageDelivery.status == 'paused'
+        ).values(status='queued').execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def release_due_slots(now: datetime = None) -> int:
+    """Queue send-window deliveries of running campaigns whose slot has come"""
+    running = select(MessageCampaign.id).where(MessageCampaign.status == 'sending')
+    result = db.session.execute(
+        update(MessageDelivery).where(
+            MessageDelivery.status == 'scheduled',
+            MessageDelivery.next_attempt_at <= (now or datetime.utcnow()),
+            MessageDelivery.campaign_id.in_(running)
+        ).values(status='queued').execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def next_release_at() -> Optional[datetime]:
+    """Earliest pending send-window slot of a running campaign"""
+    return db.session.query(func.min(MessageDelivery.next_attempt_at)).join(
+        MessageCampaign, MessageCampaign.id == MessageDelivery.campaign_id
+    ).filter(
+        MessageDelivery.status == 'scheduled',
+        MessageCampaign.status == 'sending'
+    ).scalar()
+
+
+def organizations_with_due_work(channel: str, priority: str) -> List[int]:
+    """Organizations that have due queued deliveries in a channel's priority lane"""
+    rows = db.session.query(MessageDelivery.organization_id).filter(
+        *_claimable(channel, priority, datetime.utcnow())
+    ).distinct().all()
+    return [row.organization_id for row in rows]
+
+
+def release_stale_claims(lease_seconds: int = None) -> int:
+    """Requeue deliveries whose worker died while they were claimed"""
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds or OUTBOX_LEASE_SECONDS)
+    result = db.session.execute(
+        update(MessageDelivery).where(
+            MessageDelivery.status == 'sending',
+            MessageDelivery.claimed_at < cutoff
+        ).values(status='queued', claimed_by=None).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def release_orphaned_claims(worker_id: str) -> int:
+    """
+    Requeue claims of earlier worker processes on this host that are gone
+
+    Lets a restarted worker resume an interrupted batch right away instead
+    of waiting for the claim lease to expire. Worker ids look like
+    host:pid:instance, claim tokens add a batch suffix.
+    """
+    host, pid = worker_id.split(':')[:2]
+    tokens = db.session.query(MessageDelivery.claimed_by).filter(
+        MessageDelivery.status == 'sending',
+        MessageDelivery.claimed_by.like(f'{host}:%')
+    ).distinct().all()
+
+    orphaned = []
+    for (token,) in tokens:
+        owner = token.rsplit(':', 1)[0]
+        owner_pid = owner.split(':')[1] if owner.count(':') >= 2 else ''
+        if owner == worker_id or not owner_pid.isdigit():
+            continue
+        # Same pid with another instance id means a previous run of this process slot
+        if owner_pid == pid or not _process_alive(int(owner_pid)):
+            orphaned.append(token)
+
+    if not orphaned:
+        return 0
+    result = db.session.execute(
+        update(MessageDelivery).where(
+            MessageDelivery.status == 'sending',
+            MessageDelivery.claimed_by.in_(orphaned)
+        ).values(status='queued', claimed_by=None).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def unfinished_contact_watermark(campaign_id: int):
+    """
+    Scalar subquery of the lowest contact id a campaign has not finished
+    sending to, NULL once every delivery is final
+
+    Every contact below it has a final outcome, so it is a safe point to
+    resume a campaign from.
+    """
+    return db.session.query(func.min(MessageDelivery.contact_id)).filter(
+        MessageDelivery.campaign_id == campaign_id,
+        MessageDelivery.status.in_(('scheduled', 'queued', 'paused', 'sending'))
+    ).scalar_subquery()
+
+
+def has_pending_deliveries(campaign_id: int) -> bool:
+    """Check if a campaign still has scheduled, queued or in-flight deliveries"""
+    return db.session.query(
+        MessageDelivery.query.filter(
+            MessageDelivery.campaign_id == campaign_id,
+            MessageDelivery.status.in_(('scheduled', 'queued', 'sending'))
+        ).exists()
+    ).scalar()
@@ -4,21 +4,45 @@ Supports custom SMTP settings and AWS SES for email delivery
 """
 
 import os
+import json
 import smtplib
 import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Tuple, Any
+from types import SimpleNamespace
+from concurrent.futures import Future
 import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
 from twilio.rest import Client as TwilioClient
 from twilio.base.exceptions import TwilioException
 
+from datetime import datetime, time
 from flask import current_app
-from models import Contact, Template, Organization, OrganizationConfig
-from messaging_clients import UnifiedMessagingClient
+from app import db
+from models import Contact, Template, Organization, OrganizationConfig, MessageCampaign
+from messaging_clients import (
+    UnifiedMessagingClient, get_ses_client, get_twilio_client,
+    get_messaging_client, is_channel_configured
+)
+from smtp_pool import smtp_pool, get_tls_mode
+from http_sessions import get_gateway_session, GATEWAY_TIMEOUT
+from template_engine import get_compiled_template
+from message_outbox import PRIORITY_LANES, enqueue_deliveries, lane_has_room
+from send_windows import SendWindowPlanner
+from contact_addresses import canonical_email, gateway_number, phone_key
+from rate_limiter import rate_limiter
+from retry_policy import send_with_retry
+from analytics_rollups import record_campaign_created
+from suppression_list import add_unsubscribe_link, unsubscribe_headers
+
+# Contacts resolved per query when queueing a campaign
+RECIPIENT_CHUNK_SIZE = int(os.environ.get('RECIPIENT_CHUNK_SIZE', '1000'))
+
+# Audiences larger than this go to the bulk lane unless a priority is given
+BULK_RECIPIENT_THRESHOLD = int(os.environ.get('BULK_RECIPIENT_THRESHOLD', '1000'))
 
 
 class MessagingService:
@@ -31,19 +55,34 @@ class MessagingService:
                     template_id: int, 
                     contact_ids: List[int], 
                     custom_variables: Dict[str, Any] = None,
-                    organization_id: int = None) -> Dict[str, Any]:
+                    organization_id: int = None,
+                    scheduled_at: datetime = None,
+                    send_window: Tuple[time, time] = None,
+                    priority: str = None) -> Dict[str, Any]:
         """
         Send message using template to multiple contacts
         
+        The campaign and one queued delivery per recipient are committed
+        to the outbox, so this returns a campaign handle before any message
+        goes out and the sends survive a restart.
+        
         Args:
             template_id: ID of the message template
             contact_ids: List of contact IDs to send to
             custom_variables: Additional variables for template personalization
             organization_id: Organization ID for scoping
+            scheduled_at: UTC time to start sending; the campaign scheduler
+                starts it then
+            send_window: (start, end) recipient-local times messages may go
+                out between; sends are spread across each recipient's window
+            priority: Send lane (transactional, normal, bulk); defaults to bulk
+                for audiences above BULK_RECIPIENT_THRESHOLD, else normal
             
         Returns:
-            Dict with success status and delivery results
+            Dict with success status and the queued campaign handle
         """
+        from messaging_dispatch import dispatcher
+        
         try:
             # Get template and validate
             template = Template.query.filter_by(
@@ -54,113 +93,281 @@ class MessagingService:
             if not template:
                 return {'success': False, 'error': 'Template not found'}
             
-            # Get contacts
-            contacts = Contact.query.filter(
-                Contact.id.in_(contact_ids),
-                Contact.organization_id == organization_id
-            ).all()
-            
-            if not contacts:
+            audience = len(set(contact_ids))
+            if priority is None:
+                priority = 'bulk' if audience > BULK_RECIPIENT_THRESHOLD else 'normal'
+            elif priority not in PRIORITY_LANES:
+                return {'success': False, 'error': f'Unknown priority: {priority}'}
+            if priority == 'transactional' and not lane_has_room(priority, audience):
+                self.logger.warning("Transactional lane full, queueing send in the normal lane")
+                priority = 'normal'
+            
+            now = datetime.utcnow()
+            scheduled = scheduled_at is not None and scheduled_at > now
+            campaign = MessageCampaign(
+                name=f"{template.name} - {(scheduled_at if scheduled else now).strftime('%Y-%m-%d %H:%M')}",
+                template_id=template.id,
+                organization_id=organization_id,
+                status='scheduled' if scheduled else 'sending',
+                priority=priority,
+                scheduled_at=scheduled_at if scheduled else None,
+                sent_at=None if scheduled else now,
+                recipient_count=0,
+                custom_variables=json.dumps(custom_variables) if custom_variables else None
+            )
+            if send_window:
+                campaign.send_window_start, campaign.send_window_end = send_window
+            db.session.add(campaign)
+            db.session.flush()
+            
+            # Deliveries are queued chunk by chunk in the same transaction as the campaign
+            channel = template.template_type
+            record_campaign_created(campaign, channel)
+            planner = None
+            if send_window:
+                planner = SendWindowPlanner(*send_window, scheduled_at if scheduled else now)
+            # Contacts sharing a normalized address get a single message
+            seen = set()
+            collapsed = 0
+            for chunk in self.iter_recipient_chunks(contact_ids, organization_id):
+                recipients = []
+                for row in chunk:
+                    address = self.get_normalized_recipient(row, channel)
+                    if address:
+                        if address in seen:
+                            collapsed += 1
+                            continue
+                        seen.add(address)
+                    recipient = {'contact_id': row.id, 'recipient': address or self.get_recipient(row, channel)}
+                    if planner:
+                        recipient['timezone'], recipient['next_attempt_at'] = planner.plan(
+                            row.country, row.state, row.postal_code
+                        )
+                    recipients.append(recipient)
+                campaign.recipient_count += enqueue_deliveries(
+                    campaign, recipients, status='scheduled' if scheduled or planner else 'queued'
+                )
+            
+            if not campaign.recipient_count:
+                db.session.rollback()
                 return {'success': False, 'error': 'No valid contacts found'}
             
-            results = {
-                'success': True,
-                'sent': 0,
-                'failed': 0,
-                'details': []
-            }
-            
-            for contact in contacts:
-                try:
-                    # Personalize template content
-                    personalized_content = self._personalize_template(
-                        template, contact, custom_variables
-                    )
-                    
-                    # Send based on channel type
-                    if template.channel == 'email':
-                        result = self._send_email(contact, template, personalized_content)
-                    elif template.channel == 'sms':
-                        result = self._send_sms(contact, template, personalized_content)
-                    elif template.channel == 'whatsapp':
-                        result = self._send_whatsapp(contact, template, personalized_content)
-                    else:
-                        result = {'success': False, 'error': f'Unsupported channel: {template.channel}'}
-                    
-                    if result['success']:
-                        results['sent'] += 1
-                    else:
-                        results['failed'] += 1
-                    
-                    results['details'].append({
-                        'contact_id': contact.id,
-                        'contact_name': f"{contact.first_name} {contact.last_name}",
-                        'channel': template.channel,
-                        'success': result['success'],
-                        'message': result.get('message', ''),
-                        'error': result.get('error', '')
-                    })
-                    
-                except Exception as e:
-                    self.logger.error(f"Error sending to contact {contact.id}: {str(e)}")
-                    results['failed'] += 1
-                    results['details'].append({
-                        'contact_id': contact.id,
-                        'contact_name': f"{contact.first_name} {contact.last_name}",
-                        'channel': template.channel,
-                        'success': False,
-                        'error': str(e)
-                    })
+            db.session.commit()
             
+            if scheduled:
+                results = {
+                    'success': True,
+                    'campaign_id': campaign.id,
+                    'status': campaign.status,
+                    'scheduled_at': campaign.scheduled_at,
+                    'queued': campaign.recipient_count
+                }
+            else:
+                results = dispatcher.dispatch(campaign)
+            results.update({'sent': 0, 'failed': 0, 'collapsed': collapsed, 'details': []})
+            if collapsed:
+                self.logger.info(f"Campaign {campaign.id}: collapsed {collapsed} duplicate recipients")
             return results
             
         except Exception as e:
+            db.session.rollback()
             self.logger.error(f"Error in send_message: {str(e)}")
             return {'success': False, 'error': str(e)}
     
-    def _personalize_template(self, template: Template, contact: Contact, 
-                             custom_variables: Dict[str, Any] = None) -> Dict[str, str]:
-        """Personalize template content with contact data and custom variables"""
+    def send_system_email(self, to_email: str, subject: str, content: str,
+                          content_type: str = 'plain') -> Future:
+        """
+        Send a one-off transactional email (password reset, invitation)
         
-        # Build variable dictionary
-        variables = {
-            'first_name': contact.first_name or '',
-            'last_name': contact.last_name or '',
-            'full_name': f"{contact.first_name or ''} {contact.last_name or ''}".strip(),
-            'email': contact.email or '',
-            'phone': contact.phone or '',
-            'mobile': contact.mobile or '',
-            'company': contact.company or '',
-            'job_title': contact.job_title or '',
-            'department': contact.department or '',
-            'industry': contact.industry or '',
-            'website': contact.website or '',
-            'address': contact.address or '',
-            'city': contact.city or '',
-            'state': contact.state or '',
-            'country': contact.country or '',
-            'postal_code': contact.postal_code or ''
-        }
+        Goes out on the dispatcher's transactional senders through the
+        environment-configured email provider, ahead of campaign traffic.
         
-        # Add custom variables if provided
-        if custom_variables:
-            variables.update(custom_variables)
+        Returns:
+            Future resolving to the send result
+        """
+        from messaging_dispatch import dispatcher
         
-        # Personalize subject and content
-        subject = template.subject or ''
-        content = template.content or ''
+        recipient = SimpleNamespace(id=None, email=to_email, organization_id=None)
+        message = SimpleNamespace(content_type=content_type)
+        return dispatcher.send_system_message(lambda: send_with_retry(
+            self._get_provider_key('email'),
+            lambda: self._send_email(recipient, message, {'subject': subject, 'content': content})
+        ))
+    
+    def iter_recipient_chunks(self, contact_ids: List[int], organization_id: int,
+                              chunk_size: int = None) -> Iterator[List[Any]]:
+        """
+        Yield the organization's contacts among `contact_ids` in id order, in chunks
         
+        Only the id, address and location columns are loaded, and each query covers
+        one bounded slice of the sorted ids, so memory stays flat however
+        large the audience is.
+        """
+        chunk_size = chunk_size or RECIPIENT_CHUNK_SIZE
+        ids = sorted(set(contact_ids))
+        for start in range(0, len(ids), chunk_size):
+            window = ids[start:start + chunk_size]
+            rows = db.session.query(
+                Contact.id, Contact.email, Contact.phone, Contact.mobile,
+                Contact.email_canonical, Contact.phone_e164, Contact.mobile_e164, Contact.country, Contact.state, Contact.postal_code
+            ).filter(
+                Contact.organization_id == organization_id,
+                Contact.id.between(window[0], window[-1]),
+                Contact.id.in_(window)
+            ).order_by(Contact.id).all()
+            if rows:
+                yield rows
+    
+    def deliver_to_contact(self, template: Template, contact: Contact,
+                           custom_variables: Dict[str, Any] = None,
+                           unsubscribe_url: str = None) -> Dict[str, Any]:
+        """Personalize and send a template to a single contact, emails with an unsubscribe link"""
         try:
-            # Replace variables in format {variable_name}
-            for key, value in variables.items():
-                placeholder = f"{{{key}}}"
-                subject = subject.replace(placeholder, str(value))
-                content = content.replace(placeholder, str(value))
+            personalized_content = self._personalize_template(
+                template, contact, custom_variables
+            )
             
-            return {
-                'subject': subject,
-                'content': content
-            }
+            channel = template.template_type
+            if channel == 'email' and unsubscribe_url:
+                personalized_content['content'] = add_unsubscribe_link(personalized_content['content'], unsubscribe_url)
+                personalized_content['unsubscribe_url'] = unsubscribe_url
+            if channel == 'email':
+                send = self._send_email
+            elif channel == 'sms':
+                send = self._send_sms
+            elif channel == 'whatsapp':
+                send = self._send_whatsapp
+            else:
+                return {'success': False, 'error': f'Unsupported channel: {channel}'}
+            
+            # Transient provider failures are retried, a failing provider is short-circuited
+            return send_with_retry(
+                self._get_provider_key(channel),
+                lambda: send(contact, template, personalized_content)
+            )
+                
+        except Exception as e:
+            self.logger.error(f"Error sending to contact {contact.id}: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
+    def _get_provider_key(self, channel: str) -> str:
+        """Circuit breaker key for the environment-configured provider of a channel"""
+        if channel == 'email':
+            if self._is_aws_ses_configured():
+                return 'aws_ses'
+            return f"smtp:{os.environ.get('SMTP_HOST')}"
+        elif channel == 'sms':
+            if self._is_custom_sms_configured():
+                gateway_type = os.environ.get('SMS_GATEWAY_TYPE', 'generic').lower()
+                provider = gateway_type if gateway_type in ('textlocal', 'msg91', 'clickatell') else 'custom'
+                return f"{provider}:{os.environ.get('SMS_GATEWAY_URL')}"
+            return 'twilio'
+        return 'twilio_whatsapp'
+    
+    def get_recipient(self, contact: Contact, channel: str) -> Optional[str]:
+        """Get the address a contact is reached at on a channel, phones in E.164 form when known"""
+        if channel == 'email':
+            return contact.email
+        if contact.phone:
+            return contact.phone_e164 or contact.phone
+        return contact.mobile_e164 or contact.mobile
+    
+    def get_normalized_recipient(self, contact: Contact, channel: str) -> Optional[str]:
+        """Canonical address of a contact on a channel: lowercased email or E.164 phone"""
+        if channel == 'email':
+            return contact.email_canonical or canonical_email(contact.email)
+        if contact.phone:
+            return contact.phone_e164 or phone_key(contact.phone, contact.country)
+        return contact.mobile_e164 or phone_key(contact.mobile, contact.country)
+    
+    def deliver_batch(self, template: Template, contacts: List[Contact],
+                      custom_variables: Dict[str, Any] = None,
+                      config: OrganizationConfig = None,
+                      unsubscribe_urls: List[Optional[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Personalize and send a template to a batch of contacts
+        
+        When the organization has its own provider settings for the channel,
+        recipients are grouped into provider bulk API calls: identical SMS
+        or email content is sent once per group, and email providers with
+        server-side templating get per-recipient variables.
+        
+        Args:
+            unsubscribe_urls: Per-contact unsubscribe links added to emails
+        
+        Returns:
+            One result per contact, in the same order
+        """
+        channel = template.template_type
+        unsubscribe_urls = unsubscribe_urls if channel == 'email' and unsubscribe_urls else [None] * len(contacts)
+        
+        if not is_channel_configured(config, channel) or channel not in ('sms', 'email'):
+            return [self.deliver_to_contact(template, contact, custom_variables, url)
+                    for contact, url in zip(contacts, unsubscribe_urls)]
+        
+        client = get_messaging_client(config)
+        compiled = get_compiled_template(template)
+        results = [None] * len(contacts)
+        
+        addressed = []
+        for index, contact in enumerate(contacts):
+            recipient = self.get_recipient(contact, channel)
+            if recipient:
+                addressed.append((index, recipient))
+            elif channel == 'email':
+                results[index] = {'success': False, 'error': 'Contact has no email address'}
+            else:
+                results[index] = {'success': False, 'error': 'Contact has no phone number'}
+        
+        if channel == 'email' and client.email_client.supports_templated_batch:
+            # Provider-side templating: one bulk call carries everyone's variables
+            variables = compiled.resolvable_variables(custom_variables)
+            subject_template = compiled.subject.to_handlebars(variables)
+            content_template = compiled.content.to_handlebars(variables)
+            
+            if subject_template is not None and content_template is not None:
+                destinations = [
+                    (recipient, compiled.resolve_variables(contacts[index], custom_variables))
+                    for index, recipient in addressed
+                ]
+                if any(unsubscribe_urls):
+                    # The link is one more per-recipient variable, so the bulk call is kept
+                    content_template = add_unsubscribe_link(content_template, '{{unsubscribe_url}}')
+                    for (index, _), (_, values) in zip(addressed, destinations):
+                        values['unsubscribe_url'] = unsubscribe_urls[index] or ''
+
+                batch_results = client.send_templated_email_batch(subject_template, content_template, destinations)
+                for (index, _), result in zip(addressed, batch_results):
+                    results[index] = result
+                return results
+        
+        # Group recipients that receive identical content; emails with an
+        # unsubscribe link are personal and go one per group
+        groups = {}
+        for index, recipient in addressed:
+            rendered = compiled.render(contacts[index], custom_variables)
+            url = unsubscribe_urls[index]
+            content = add_unsubscribe_link(rendered['content'], url)
+            groups.setdefault((rendered['subject'], content, url), []).append((index, recipient))
+        
+        for (subject, content, url), members in groups.items():
+            recipients = [recipient for _, recipient in members]
+            if channel == 'email':
+                batch_results = client.send_email_batch(recipients, subject, content,
+                                                        headers=unsubscribe_headers(url))
+            else:
+                batch_results = client.send_sms_batch(recipients, content)
+            for (index, _), result in zip(members, batch_results):
+                results[index] = result
+        
+        return results
+    
+    def _personalize_template(self, template: Template, contact: Contact, 
+                             custom_variables: Dict[str, Any] = None) -> Dict[str, str]:
+        """Personalize template content with contact data and custom variables"""
+        try:
+            # Compiled once per template version, rendered in a single pass
+            return get_compiled_template(template).render(contact, custom_variables)
         except Exception as e:
             self.logger.error(f"Error personalizing template: {str(e)}")
             return {
@@ -195,12 +402,11 @@ class MessagingService:
                            personalized_content: Dict[str, str]) -> Dict[str, Any]:
         """Send email using AWS SES"""
         try:
-            # Initialize SES client
-            ses_client = boto3.client(
-                'ses',
-                aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
-                region_name=os.environ.get('AWS_REGION', 'us-east-1')
+            # Shared SES client
+            ses_client = get_ses_client(
+                os.environ.get('AWS_ACCESS_KEY_ID'),
+                os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                os.environ.get('AWS_REGION', 'us-east-1')
             )
             
             # Prepare email
@@ -209,6 +415,7 @@ class MessagingService:
             content = personalized_content['content']
             
             # Send email
+            rate_limiter.acquire('aws_ses', 'email', getattr(contact, 'organization_id', None))
             response = ses_client.send_email(
                 Source=from_email,
                 Destination={
@@ -270,6 +477,8 @@ class MessagingService:
             msg['To'] = contact.email
             msg['Subject'] = personalized_content['subject']
             msg['Message-ID'] = f"<{hash(str(contact.email) + str(personalized_content['subject']))}@contacthub>"
+            for header, value in unsubscribe_headers(personalized_content.get('unsubscribe_url')).items():
+                msg[header] = value
             
             # Add both plain text and HTML versions if HTML template
             content = personalized_content['content']
@@ -285,22 +494,13 @@ class MessagingService:
             else:
                 msg.attach(MIMEText(content, 'plain', 'utf-8'))
             
-            # Connect with proper SSL/TLS handling
-            if smtp_use_ssl:
-                server = smtplib.SMTP_SSL(smtp_host, smtp_port)
-            else:
-                server = smtplib.SMTP(smtp_host, smtp_port)
-                if smtp_use_tls:
-                    server.starttls()
-            
-            # Authentication with error handling
-            if smtp_username and smtp_password:
-                server.login(smtp_username, smtp_password)
-            
-            # Send email
-            text = msg.as_string()
-            server.sendmail(from_email, contact.email, text)
-            server.quit()
+            # Send over a pooled, already authenticated session
+            rate_limiter.acquire('smtp', 'email', getattr(contact, 'organization_id', None), scope=smtp_host)
+            smtp_pool.send(
+                smtp_host, smtp_port, smtp_username, smtp_password,
+                get_tls_mode(smtp_use_tls, smtp_use_ssl),
+                from_email, contact.email, msg.as_string()
+            )
             
             self.logger.info(f"Email sent via SMTP ({smtp_host}:{smtp_port}) to {contact.email}")
             
@@ -330,7 +530,7 @@ class MessagingService:
                  personalized_content: Dict[str, str]) -> Dict[str, Any]:
         """Send SMS using configured gateway (Twilio or Custom)"""
         
-        phone_number = contact.phone or contact.mobile
+        phone_number = self.get_recipient(contact, 'sms')
         if not phone_number:
             return {'success': False, 'error': 'Contact has no phone number'}
         
@@ -348,9 +548,7 @@ class MessagingService:
     def _send_sms_custom_gateway(self, contact: Contact, template: Template,
                                 personalized_content: Dict[str, str]) -> Dict[str, Any]:
         """Send SMS using custom HTTP gateway"""
-        import requests
-        
-        phone_number = contact.phone or contact.mobile
+        phone_number = self.get_recipient(contact, 'sms')
         
         try:
             # Custom SMS Gateway Configuration
@@ -362,16 +560,19 @@ class MessagingService:
             
             # Prepare request based on gateway type
             gateway_type = os.environ.get('SMS_GATEWAY_TYPE', 'generic').lower()
+            session = get_gateway_session(f'gateway_{gateway_type}')
+            provider = gateway_type if gateway_type in ('textlocal', 'msg91', 'clickatell') else 'custom'
+            rate_limiter.acquire(provider, 'sms', getattr(contact, 'organization_id', None), scope=gateway_url)
             
             if gateway_type == 'textlocal':
                 # TextLocal API format
                 payload = {
                     'apikey': gateway_api_key,
-                    'numbers': phone_number,
+                    'numbers': gateway_number(phone_number),
                     'message': personalized_content['content'],
                     'sender': gateway_sender_id
                 }
-                response = requests.post(gateway_url, data=payload)
+                response = session.post(gateway_url, data=payload, timeout=GATEWAY_TIMEOUT)
                 
             elif gateway_type == 'msg91':
                 # MSG91 API format
@@ -382,21 +583,21 @@ class MessagingService:
                     'country': '91',
                     'sms': [{
                         'message': personalized_content['content'],
-                        'to': [phone_number]
+                        'to': [gateway_number(phone_number)]
                     }]
                 }
-                response = requests.post(gateway_url, json=payload, headers=headers)
+                response = session.post(gateway_url, json=payload, headers=headers, timeout=GATEWAY_TIMEOUT)
                 
             elif gateway_type == 'clickatell':
                 # Clickatell API format
                 headers = {'Authorization': f'Bearer {gateway_api_key}', 'Content-Type': 'application/json'}
                 payload = {
                     'messages': [{
-                        'to': [phone_number],
+                        'to': [gateway_number(phone_number)],
                         'content': personalized_content['content']
                     }]
                 }
-                response = requests.post(gateway_url, json=payload, headers=headers)
+                response = session.post(gateway_url, json=payload, headers=headers, timeout=GATEWAY_TIMEOUT)
                 
             else:
                 # Generic HTTP gateway
@@ -409,7 +610,7 @@ class MessagingService:
                     'from': gateway_sender_id
                 }
                 
-                response = requests.post(gateway_url, data=payload, auth=auth, headers=headers)
+                response = session.post(gateway_url, data=payload, auth=auth, headers=headers, timeout=GATEWAY_TIMEOUT)
             
             if response.status_code == 200:
                 self.logger.info(f"SMS sent via custom gateway to {phone_number}")
@@ -432,17 +633,18 @@ class MessagingService:
                         personalized_content: Dict[str, str]) -> Dict[str, Any]:
         """Send SMS using Twilio"""
         
-        phone_number = contact.phone or contact.mobile
+        phone_number = self.get_recipient(contact, 'sms')
         
         try:
-            # Initialize Twilio client
+            # Shared Twilio client
             account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
             auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
             from_number = os.environ.get('TWILIO_PHONE_NUMBER')
             
-            client = TwilioClient(account_sid, auth_token)
+            client = get_twilio_client(account_sid, auth_token)
             
             # Send SMS
+            rate_limiter.acquire('twilio', 'sms', getattr(contact, 'organization_id', None), scope=from_number)
             message = client.messages.create(
                 body=personalized_content['content'],
                 from_=from_number,
@@ -469,12 +671,12 @@ class MessagingService:
                       personalized_content: Dict[str, str]) -> Dict[str, Any]:
         """Send WhatsApp message using Twilio WhatsApp API"""
         
-        phone_number = contact.phone or contact.mobile
+        phone_number = self.get_recipient(contact, 'sms')
         if not phone_number:
             return {'success': False, 'error': 'Contact has no phone number'}
         
         try:
-            # Initialize Twilio client
+            # Shared Twilio client
             account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
             auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
             from_whatsapp = os.environ.get('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886')  # Twilio Sandbox
@@ -482,12 +684,14 @@ class MessagingService:
             if not all([account_sid, auth_token]):
                 return {'success': False, 'error': 'Twilio credentials not configured'}
             
-            client = TwilioClient(account_sid, auth_token)
+            client = get_twilio_client(account_sid, auth_token)
             
             # Format WhatsApp number
             to_whatsapp = f"whatsapp:{phone_number}"
             
             # Send WhatsApp message
+            rate_limiter.acquire('twilio_whatsapp', 'whatsapp', getattr(contact, 'organization_id', None),
+                                 scope=from_whatsapp)
             message = client.messages.create(
                 body=personalized_content['content'],
                 from_=from_whatsapp,
@@ -3,15 +3,57 @@
 Messaging Analytics and Tracking System
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from datetime import datetime, timedelta
-from models import MessageCampaign, MessageDelivery, Template, Contact, Group
+from models import MessageCampaign, MessageDelivery, Template, Contact, Group, DailyChannelRollup
 from utils import login_required, organization_required, get_current_organization
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from app import db
+from tracking_buffer import parse_delivery_id, tracking_buffer
+from suppression_list import delivery_for_unsubscribe_token, record_unsubscribe
 import json
 
 analytics_bp = Blueprint('analytics', __name__)
 
+# Deliveries listed per page of a campaign's details
+CAMPAIGN_DELIVERIES_PAGE_SIZE = 100
+
+# Tracking pixel, built once; hits are answered without touching the database
+TRACKING_PIXEL = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00\x21\xF9\x04\x01\x00\x00\x00\x00\x2C\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x04\x01\x00\x3B'
+TRACKING_PIXEL_RESPONSE = (TRACKING_PIXEL, 200, {
+    'Content-Type': 'image/gif',
+    'Content-Length': str(len(TRACKING_PIXEL)),
+    'Cache-Control': 'no-store, no-cache, must-revalidate, max-age=0'
+})
+
+def _channel_metrics(organization_id, start_date):
+    """
+    Activity of an organization since start_date, summed per channel from
+    the daily rollups
+    
+    Returns:
+        (totals, per-channel stats) with campaigns, sent, delivered, opened,
+        clicked and failed counts
+    """
+    rows = db.session.query(
+        DailyChannelRollup.channel,
+        func.sum(DailyChannelRollup.campaigns).label('campaigns'),
+        func.sum(DailyChannelRollup.messages_sent).label('sent'),
+        func.sum(DailyChannelRollup.messages_delivered).label('delivered'),
+        func.sum(DailyChannelRollup.messages_opened).label('opened'),
+        func.sum(DailyChannelRollup.messages_clicked).label('clicked'),
+        func.sum(DailyChannelRollup.messages_failed).label('failed')
+    ).filter(
+        DailyChannelRollup.organization_id == organization_id,
+        DailyChannelRollup.day >= start_date.date()
+    ).group_by(DailyChannelRollup.channel).all()
+    
+    fields = ('campaigns', 'sent', 'delivered', 'opened', 'clicked', 'failed')
+    channel_stats = {row.channel: {field: int(getattr(row, field) or 0) for field in fields} for row in rows}
+    totals = {field: sum(stats[field] for stats in channel_stats.values()) for field in fields}
+    return totals, channel_stats
+
 @analytics_bp.route('/dashboard')
 @login_required
 @organization_required
@@ -31,45 +73,36 @@ def analytics_dashboard():
     else:
         start_date = datetime.utcnow() - timedelta(days=365)
     
-    # Get campaigns in the time period
-    campaigns = MessageCampaign.query.filter(
-        MessageCampaign.organization_id == organization.id,
-        MessageCampaign.created_at >= start_date
-    ).order_by(MessageCampaign.created_at.desc()).all()
-    
-    # Calculate overall metrics
-    total_sent = sum(c.messages_sent for c in campaigns)
-    total_delivered = sum(c.messages_delivered for c in campaigns)
-    total_opened = sum(c.messages_opened for c in campaigns)
-    total_clicked = sum(c.messages_clicked for c in campaigns)
-    total_failed = sum(c.messages_failed for c in campaigns)
+    # Totals and channel breakdown in one aggregate query
+    totals, channel_stats = _channel_metrics(organization.id, start_date)
+    total_sent = totals['sent']
+    total_delivered = totals['delivered']
+    total_opened = totals['opened']
+    total_clicked = totals['clicked']
+    total_failed = totals['failed']
     
     # Calculate rates
     delivery_rate = round((total_delivered / total_sent * 100) if total_sent > 0 else 0, 2)
     open_rate = round((total_opened / total_delivered * 100) if total_delivered > 0 else 0, 2)
     click_rate = round((total_clicked / total_delivered * 100) if total_delivered > 0 else 0, 2)
     
-    # Channel breakdown
-    channel_stats = {}
-    for campaign in campaigns:
-        channel = campaign.template.template_type
-        if channel not in channel_stats:
-            channel_stats[channel] = {
-                'sent': 0, 'delivered': 0, 'opened': 0, 'clicked': 0
-            }
-        channel_stats[channel]['sent'] += campaign.messages_sent
-        channel_stats[channel]['delivered'] += campaign.messages_delivered
-        channel_stats[channel]['opened'] += campaign.messages_opened
-        channel_stats[channel]['clicked'] += campaign.messages_clicked
+    # Latest campaigns, with their templates loaded in the same query
+    campaigns = MessageCampaign.query.options(joinedload(MessageCampaign.template)).filter(
+        MessageCampaign.organization_id == organization.id,
+        MessageCampaign.created_at >= start_date
+    ).order_by(MessageCampaign.created_at.desc()).limit(10).all()
     
     # Recent deliveries with issues
-    failed_deliveries = MessageDelivery.query.filter(
-        MessageDelivery.campaign_id.in_([c.id for c in campaigns]),
+    failed_deliveries = MessageDelivery.query.join(
+        MessageCampaign, MessageCampaign.id == MessageDelivery.campaign_id
+    ).filter(
+        MessageCampaign.organization_id == organization.id,
+        MessageCampaign.created_at >= start_date,
         MessageDelivery.status.in_(['failed', 'bounced'])
     ).order_by(MessageDelivery.updated_at.desc()).limit(10).all()
     
     return render_template('analytics/dashboard.html',
-                         campaigns=campaigns[:10],  # Latest 10 campaigns
+                         campaigns=campaigns,  # Latest 10 campaigns
                          total_sent=total_sent,
                          total_delivered=total_delivered,
                          total_opened=total_opened,
@@ -94,67 +127,87 @@ def campaign_details(campaign_id):
         organization_id=organization.id
     ).first_or_404()
     
-    # Get delivery details
-    deliveries = MessageDelivery.query.filter_by(
-        campaign_id=campaign.id
-    ).order_by(MessageDelivery.created_at.desc()).all()
-    
-    # Group deliveries by status
-    status_counts = {}
-    for delivery in deliveries:
-        status = delivery.status
-        if status not in status_counts:
-            status_counts[status] = 0
-        status_counts[status] += 1
-    
-    # Timeline data (daily breakdown)
-    timeline_data = {}
-    for delivery in deliveries:
-        if delivery.sent_at:
-            date_key = delivery.sent_at.strftime('%Y-%m-%d')
-            if date_key not in timeline_data:
-                timeline_data[date_key] = {'sent': 0, 'delivered': 0, 'opened': 0}
-            timeline_data[date_key]['sent'] += 1
-            if delivery.delivered_at:
-                timeline_data[date_key]['delivered'] += 1
-            if delivery.opened_at:
-                timeline_data[date_key]['opened'] += 1
+    # Status counts and the daily timeline are aggregated by the database
+    status_counts = dict(db.session.query(
+        MessageDelivery.status, func.count(MessageDelivery.id)
+    ).filter(
+        MessageDelivery.campaign_id == campaign.id
+    ).group_by(MessageDelivery.status).all())
+    
+    sent_day = func.date(MessageDelivery.sent_at)
+    timeline_rows = db.session.query(
+        sent_day.label('day'),
+        func.count(MessageDelivery.id).label('sent'),
+        func.count(MessageDelivery.delivered_at).label('delivered'),
+        func.count(MessageDelivery.opened_at).label('opened')
+    ).filter(
+        MessageDelivery.campaign_id == campaign.id,
+        MessageDelivery.sent_at.isnot(None)
+    ).group_by(sent_day).order_by(sent_day).all()
+    timeline_data = {
+        str(row.day): {'sent': row.sent, 'delivered': row.delivered, 'opened': row.opened}
+        for row in timeline_rows
+    }
+    
+    # Newest deliveries first, one page at a time; ?before=<id> continues after a page
+    before = request.args.get('before', type=int)
+    query = MessageDelivery.query.filter(MessageDelivery.campaign_id == campaign.id)
+    if before:
+        query = query.filter(MessageDelivery.id < before)
+    deliveries = query.order_by(MessageDelivery.id.desc()).limit(CAMPAIGN_DELIVERIES_PAGE_SIZE + 1).all()
+    next_before = None
+    if len(deliveries) > CAMPAIGN_DELIVERIES_PAGE_SIZE:
+        deliveries = deliveries[:CAMPAIGN_DELIVERIES_PAGE_SIZE]
+        next_before = deliveries[-1].id
     
     return render_template('analytics/campaign_details.html',
                          campaign=campaign,
-                         deliveries=deliveries[:100],  # Show first 100
+                         deliveries=deliveries,
                          status_counts=status_counts,
-                         timeline_data=timeline_data)
+                         timeline_data=timeline_data,
+                         before=before,
+                         next_before=next_before)
 
 @analytics_bp.route('/track/open/<delivery_id>')
 def track_open(delivery_id):
     """Track email open (pixel tracking)"""
-    delivery = MessageDelivery.query.get_or_404(delivery_id)
-    
-    if not delivery.opened_at:
-        delivery.opened_at = datetime.utcnow()
-        delivery.campaign.messages_opened += 1
-        db.session.commit()
+    delivery_id = parse_delivery_id(delivery_id)
+    if delivery_id is not None:
+        tracking_buffer.start(current_app._get_current_object())
+        tracking_buffer.record('open', delivery_id)
     
     # Return a 1x1 transparent pixel
-    from flask import Response
-    pixel = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00\x21\xF9\x04\x01\x00\x00\x00\x00\x2C\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x04\x01\x00\x3B'
-    return Response(pixel, mimetype='image/gif')
+    return TRACKING_PIXEL_RESPONSE
 
 @analytics_bp.route('/track/click/<delivery_id>')
 def track_click(delivery_id):
     """Track link clicks"""
-    delivery = MessageDelivery.query.get_or_404(delivery_id)
-    
-    if not delivery.clicked_at:
-        delivery.clicked_at = datetime.utcnow()
-        delivery.campaign.messages_clicked += 1
-        db.session.commit()
+    delivery_id = parse_delivery_id(delivery_id)
+    if delivery_id is not None:
+        tracking_buffer.start(current_app._get_current_object())
+        tracking_buffer.record('click', delivery_id)
     
     # Redirect to the actual URL (should be passed as parameter)
     target_url = request.args.get('url', 'https://example.com')
     return redirect(target_url)
 
+@analytics_bp.route('/unsubscribe/<token>', methods=['GET', 'POST'])
+def unsubscribe(token):
+    """
+    Unsubscribe the recipient of a message from the sending organization
+    
+    Opening the link only asks for confirmation, so link scanners cannot
+    unsubscribe anyone; the POST (also sent by one-click mail clients) does.
+    """
+    delivery = delivery_for_unsubscribe_token(token)
+    if delivery is None:
+        return render_template('analytics/unsubscribe.html', state='invalid'), 404
+    
+    if request.method == 'POST':
+        record_unsubscribe(delivery)
+        return render_template('analytics/unsubscribe.html', state='done', recipient=delivery.recipient)
+    return render_template('analytics/unsubscribe.html', state='confirm', recipient=delivery.recipient)
+
 @analytics_bp.route('/api/metrics')
 @login_required
 @organization_required
@@ -165,32 +218,16 @@ def api_metrics():
     # Get last 30 days of data
     start_date = datetime.utcnow() - timedelta(days=30)
     
-    campaigns = MessageCampaign.query.filter(
-        MessageCampaign.organization_id == organization.id,
-        MessageCampaign.created_at >= start_date
-    ).all()
-    
+    totals, channels = _channel_metrics(organization.id, start_date)
     metrics = {
-        'total_campaigns': len(campaigns),
-        'total_sent': sum(c.messages_sent for c in campaigns),
-        'total_delivered': sum(c.messages_delivered for c in campaigns),
-        'total_opened': sum(c.messages_opened for c in campaigns),
-        'total_clicked': sum(c.messages_clicked for c in campaigns),
-        'channels': {}
+        'total_campaigns': totals['campaigns'],
+        'total_sent': totals['sent'],
+        'total_delivered': totals['delivered'],
+        'total_opened': totals['opened'],
+        'total_clicked': totals['clicked'],
+        'channels': channels
     }
     
-    # Channel breakdown
-    for campaign in campaigns:
-        channel = campaign.template.template_type
-        if channel not in metrics['channels']:
-            metrics['channels'][channel] = {
-                'sent': 0, 'delivered': 0, 'opened': 0, 'clicked': 0
-            }
-        metrics['channels'][channel]['sent'] += campaign.messages_sent
-        metrics['channels'][channel]['delivered'] += campaign.messages_delivered
-        metrics['channels'][channel]['opened'] += campaign.messages_opened
-        metrics['channels'][channel]['clicked'] += campaign.messages_clicked
-    
     return jsonify(metrics)
 
 def create_demo_campaign():
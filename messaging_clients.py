@@ -4,16 +4,152 @@ Comprehensive client implementations for all supported messaging providers
 """
 
 import os
+import json
+import hashlib
 import logging
+import threading
 import requests
 import boto3
 import smtplib
+from collections import OrderedDict
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Any, Tuple
 from botocore.exceptions import ClientError, NoCredentialsError
+from types import SimpleNamespace
 from models import OrganizationConfig
+from smtp_pool import smtp_pool, get_tls_mode
+from http_sessions import get_gateway_session, GATEWAY_TIMEOUT
+from rate_limiter import rate_limiter
+from retry_policy import send_with_retry, send_batch_with_retry
+from contact_addresses import gateway_number
+
+_provider_lock = threading.Lock()
+_ses_clients = {}
+_twilio_clients = {}
+
+# SES template names a client remembers as created, to skip CreateTemplate calls
+SES_TEMPLATE_CACHE_SIZE = int(os.environ.get('SES_TEMPLATE_CACHE_SIZE', '20'))
+
+# Bulk-send SES templates are named SES_TEMPLATE_PREFIX + content hash + UTC day
+# and deleted by reap_ses_templates once this old, never from the send path
+SES_TEMPLATE_PREFIX = 'contacthub-'
+SES_TEMPLATE_RETENTION_HOURS = float(os.environ.get('SES_TEMPLATE_RETENTION_HOURS', '48'))
+
+def get_ses_client(access_key: str, secret_key: str, region: str):
+    """Get a shared boto3 SES client for a set of credentials"""
+    key = (access_key, secret_key, region)
+    client = _ses_clients.get(key)
+    if client is None:
+        # boto3 client construction is not thread-safe on the default session
+        with _provider_lock:
+            client = _ses_clients.get(key)
+            if client is None:
+                client = boto3.client(
+                    'ses',
+                    aws_access_key_id=access_key,
+                    aws_secret_access_key=secret_key,
+                    region_name=region
+                )
+                _ses_clients[key] = client
+    return client
+
+def reap_ses_templates() -> int:
+    """
+    Delete bulk-send SES templates that no send can still be using
+
+    A send only uses the template named for the current UTC day, and SES
+    renders accepted bulk sends long before the retention is over, so a
+    template created more than SES_TEMPLATE_RETENTION_HOURS ago is unused.
+    Templates live in the SES account, shared by every process, which is
+    why they are only deleted here by age. Needs an app context.
+
+    Returns:
+        Number of templates deleted
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=SES_TEMPLATE_RETENTION_HOURS)
+    accounts = {
+        (config.aws_access_key_id, config.aws_secret_access_key, config.aws_region or 'us-east-1')
+        for config in OrganizationConfig.query.filter(
+            OrganizationConfig.email_provider == 'aws_ses',
+            OrganizationConfig.aws_access_key_id.isnot(None),
+            OrganizationConfig.aws_access_key_id != ''
+        )
+        if config.aws_secret_access_key
+    }
+
+    deleted = 0
+    for access_key, secret_key, region in accounts:
+        client = get_ses_client(access_key, secret_key, region)
+        try:
+            expired = []
+            kwargs = {'MaxItems': 100}
+            while True:
+                response = client.list_templates(**kwargs)
+                expired.extend(
+                    template['Name'] for template in response.get('TemplatesMetadata', [])
+                    if template['Name'].startswith(SES_TEMPLATE_PREFIX) and template['CreatedTimestamp'] < cutoff
+                )
+                if not response.get('NextToken'):
+                    break
+                kwargs['NextToken'] = response['NextToken']
+            for name in expired:
+                client.delete_template(TemplateName=name)
+                deleted += 1
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Error deleting old SES templates in {region}: {e}")
+    return deleted
+
+def get_twilio_client(account_sid: str, auth_token: str):
+    """Get a shared Twilio REST client for a set of credentials"""
+    key = (account_sid, auth_token)
+    client = _twilio_clients.get(key)
+    if client is None:
+        from twilio.rest import Client
+        with _provider_lock:
+            client = _twilio_clients.get(key)
+            if client is None:
+                client = Client(account_sid, auth_token)
+                _twilio_clients[key] = client
+    return client
+
+def batch_failure(count: int, error: str, provider: str = None, not_sent: bool = False) -> List[Dict[str, Any]]:
+    """
+    Build one failure result per recipient of a batch
+
+    `not_sent` marks failures known to have happened before the provider
+    accepted anything (missing settings, an explicit refusal), which are
+    the only ones safe to send again through a fallback provider.
+    """
+    result = {'success': False, 'error': error}
+    if provider:
+        result['provider'] = provider
+    if not_sent:
+        result['not_sent'] = True
+    return [dict(result) for _ in range(count)]
+
+def gateway_json(response) -> Optional[Dict[str, Any]]:
+    """Parsed JSON body of a gateway response, or None when it is not JSON"""
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+def sent_without_id(count: int, provider: str) -> List[Dict[str, Any]]:
+    """
+    Results for messages a gateway accepted without a readable message id
+
+    Counted as sent, since sending them again could deliver twice.
+    """
+    return [{'success': True, 'message_id': None, 'provider': provider, 'batch': True} for _ in range(count)]
+
+def snapshot_config(config: OrganizationConfig) -> SimpleNamespace:
+    """Copy config columns into a plain object that is safe to share across sessions and threads"""
+    return SimpleNamespace(**{
+        column.name: getattr(config, column.name)
+        for column in OrganizationConfig.__table__.columns
+    })
 
 class SMSClientFactory:
     """Factory for creating SMS clients based on provider"""
@@ -43,9 +179,16 @@ class BaseSMSClient:
         self.config = config
         self.logger = logging.getLogger(__name__)
     
+    # Maximum recipients per provider API call
+    max_batch_size = 1
+    
     def send_sms(self, to_number: str, message: str, sender_id: str = None) -> Dict[str, Any]:
         """Send SMS message - to be implemented by subclasses"""
         raise NotImplementedError("Subclasses must implement send_sms method")
+    
+    def send_sms_batch(self, to_numbers: List[str], message: str, sender_id: str = None) -> List[Dict[str, Any]]:
+        """Send the same SMS to several numbers, returning one result per number in order"""
+        return [self.send_sms(to_number, message, sender_id) for to_number in to_numbers]
 
 class TwilioSMSClient(BaseSMSClient):
     """Twilio SMS client implementation"""
@@ -60,8 +203,7 @@ class TwilioSMSClient(BaseSMSClient):
             if not all([account_sid, auth_token, from_number]):
                 return {'success': False, 'error': 'Twilio credentials not configured'}
             
-            from twilio.rest import Client
-            client = Client(account_sid, auth_token)
+            client = get_twilio_client(account_sid, auth_token)
             
             message_obj = client.messages.create(
                 body=message,
@@ -83,6 +225,56 @@ class TwilioSMSClient(BaseSMSClient):
 class TextLocalSMSClient(BaseSMSClient):
     """TextLocal SMS client implementation"""
     
+    max_batch_size = 1000
+    
+    def send_sms_batch(self, to_numbers: List[str], message: str, sender_id: str = None) -> List[Dict[str, Any]]:
+        """Send one SMS to many numbers using a comma-separated numbers list"""
+        try:
+            api_key = self.config.sms_api_key
+            sender = sender_id or self.config.sms_sender_id or 'TextLocal'
+            
+            if not api_key:
+                return batch_failure(len(to_numbers), 'TextLocal API key not configured', not_sent=True)
+            
+            numbers = [gateway_number(n) for n in to_numbers]
+            
+            data = {
+                'apikey': api_key,
+                'numbers': ','.join(numbers),
+                'message': message,
+                'sender': sender
+            }
+            
+            if self.config.sms_username:
+                data['username'] = self.config.sms_username
+            
+            response = get_gateway_session('textlocal').post(
+                'https://api.textlocal.in/send/', data=data, timeout=GATEWAY_TIMEOUT
+            )
+            result = gateway_json(response)
+            
+            if result is None:
+                if response.ok:
+                    return sent_without_id(len(numbers), 'textlocal')
+                return batch_failure(len(numbers), f'HTTP {response.status_code}', 'textlocal',
+                                     not_sent=response.status_code < 500)
+            
+            if result.get('status') != 'success':
+                error = (result.get('errors') or [{}])[0].get('message', 'Unknown error')
+                return batch_failure(len(numbers), error, 'textlocal', not_sent=True)
+            
+            # TextLocal accepted the whole request; numbers it reports in
+            # another format than ours only lose their message id
+            message_ids = {str(m.get('recipient')): m.get('id') for m in result.get('messages', [])}
+            return [
+                {'success': True, 'message_id': message_ids.get(number), 'provider': 'textlocal', 'batch': True}
+                for number in numbers
+            ]
+            
+        except Exception as e:
+            self.logger.error(f"TextLocal batch SMS error: {e}")
+            return batch_failure(len(to_numbers), str(e), 'textlocal')
+    
     def send_sms(self, to_number: str, message: str, sender_id: str = None) -> Dict[str, Any]:
         try:
             api_key = self.config.sms_api_key
@@ -90,10 +282,10 @@ class TextLocalSMSClient(BaseSMSClient):
             sender = sender_id or self.config.sms_sender_id or 'TextLocal'
             
             if not api_key:
-                return {'success': False, 'error': 'TextLocal API key not configured'}
+                return {'success': False, 'error': 'TextLocal API key not configured', 'not_sent': True}
             
             # Clean phone number
-            to_number = to_number.replace('+', '').replace(' ', '')
+            to_number = gateway_number(to_number)
             
             data = {
                 'apikey': api_key,
@@ -105,21 +297,30 @@ class TextLocalSMSClient(BaseSMSClient):
             if username:
                 data['username'] = username
             
-            response = requests.post('https://api.textlocal.in/send/', data=data)
-            result = response.json()
+            response = get_gateway_session('textlocal').post(
+                'https://api.textlocal.in/send/', data=data, timeout=GATEWAY_TIMEOUT
+            )
+            result = gateway_json(response)
+            
+            if result is None:
+                if response.ok:
+                    return sent_without_id(1, 'textlocal')[0]
+                return batch_failure(1, f'HTTP {response.status_code}', 'textlocal',
+                                     not_sent=response.status_code < 500)[0]
             
             if result.get('status') == 'success':
                 return {
                     'success': True,
-                    'message_id': result.get('messages', [{}])[0].get('id'),
+                    'message_id': (result.get('messages') or [{}])[0].get('id'),
                     'provider': 'textlocal',
                     'credits_used': result.get('cost')
                 }
             else:
                 return {
                     'success': False,
-                    'error': result.get('errors', [{}])[0].get('message', 'Unknown error'),
-                    'provider': 'textlocal'
+                    'error': (result.get('errors') or [{}])[0].get('message', 'Unknown error'),
+                    'provider': 'textlocal',
+                    'not_sent': True
                 }
                 
         except Exception as e:
@@ -129,16 +330,60 @@ class TextLocalSMSClient(BaseSMSClient):
 class MSG91SMSClient(BaseSMSClient):
     """MSG91 SMS client implementation"""
     
+    max_batch_size = 1000
+    
+    def send_sms_batch(self, to_numbers: List[str], message: str, sender_id: str = None) -> List[Dict[str, Any]]:
+        """Send one SMS to many numbers in a single request"""
+        try:
+            api_key = self.config.sms_api_key
+            sender = sender_id or self.config.sms_sender_id or 'MSG91'
+            
+            if not api_key:
+                return batch_failure(len(to_numbers), 'MSG91 API key not configured', not_sent=True)
+            
+            data = {
+                'sender': sender,
+                'route': '4',
+                'country': '91',
+                'sms': [{
+                    'message': message,
+                    'to': [gateway_number(n) for n in to_numbers]
+                }]
+            }
+            
+            url = f'https://api.msg91.com/api/v5/flow/?apikey={api_key}'
+            response = get_gateway_session('msg91').post(
+                url, json=data, headers={'Content-Type': 'application/json'}, timeout=GATEWAY_TIMEOUT
+            )
+            result = gateway_json(response)
+            
+            if result is None:
+                if response.ok:
+                    return sent_without_id(len(to_numbers), 'msg91')
+                return batch_failure(len(to_numbers), f'HTTP {response.status_code}', 'msg91',
+                                     not_sent=response.status_code < 500)
+            
+            if response.status_code == 200 and result.get('type') == 'success':
+                outcome = {'success': True, 'message_id': result.get('request_id'), 'provider': 'msg91', 'batch': True}
+            else:
+                outcome = {'success': False, 'error': result.get('message', 'Unknown error'), 'provider': 'msg91',
+                           'not_sent': response.status_code < 500}
+            return [dict(outcome) for _ in to_numbers]
+            
+        except Exception as e:
+            self.logger.error(f"MSG91 batch SMS error: {e}")
+            return batch_failure(len(to_numbers), str(e), 'msg91')
+    
     def send_sms(self, to_number: str, message: str, sender_id: str = None) -> Dict[str, Any]:
         try:
             api_key = self.config.sms_api_key
             sender = sender_id or self.config.sms_sender_id or 'MSG91'
             
             if not api_key:
-                return {'success': False, 'error': 'MSG91 API key not configured'}
+                return {'success': False, 'error': 'MSG91 API key not configured', 'not_sent': True}
             
             # Clean phone number
-            to_number = to_number.replace('+', '').replace(' ', '')
+            to_number = gateway_number(to_number)
             
             headers = {'Content-Type': 'application/json'}
             
@@ -153,8 +398,14 @@ class MSG91SMSClient(BaseSMSClient):
             }
             
             url = f'https://api.msg91.com/api/v5/flow/?apikey={api_key}'
-            response = requests.post(url, json=data, headers=headers)
-            result = response.json()
+            response = get_gateway_session('msg91').post(url, json=data, headers=headers, timeout=GATEWAY_TIMEOUT)
+            result = gateway_json(response)
+            
+            if result is None:
+                if response.ok:
+                    return sent_without_id(1, 'msg91')[0]
+                return batch_failure(1, f'HTTP {response.status_code}', 'msg91',
+                                     not_sent=response.status_code < 500)[0]
             
             if response.status_code == 200 and result.get('type') == 'success':
                 return {
@@ -166,7 +417,8 @@ class MSG91SMSClient(BaseSMSClient):
                 return {
                     'success': False,
                     'error': result.get('message', 'Unknown error'),
-                    'provider': 'msg91'
+                    'provider': 'msg91',
+                    'not_sent': response.status_code < 500
                 }
                 
         except Exception as e:
@@ -176,12 +428,63 @@ class MSG91SMSClient(BaseSMSClient):
 class ClickatellSMSClient(BaseSMSClient):
     """Clickatell SMS client implementation"""
     
+    max_batch_size = 600
+    
+    def send_sms_batch(self, to_numbers: List[str], message: str, sender_id: str = None) -> List[Dict[str, Any]]:
+        """Send one SMS to many numbers in a single request"""
+        try:
+            api_key = self.config.sms_api_key
+            
+            if not api_key:
+                return batch_failure(len(to_numbers), 'Clickatell API key not configured', not_sent=True)
+            
+            headers = {
+                'Authorization': api_key,
+                'Content-Type': 'application/json'
+            }
+            
+            data = {
+                'text': message,
+                'to': list(to_numbers)
+            }
+            
+            if sender_id or self.config.sms_sender_id:
+                data['from'] = sender_id or self.config.sms_sender_id
+            
+            response = get_gateway_session('clickatell').post(
+                'https://platform.clickatell.com/messages',
+                json=data,
+                headers=headers,
+                timeout=GATEWAY_TIMEOUT
+            )
+            
+            if response.status_code != 202:
+                error = f'HTTP {response.status_code}: {response.text}'
+                return batch_failure(len(to_numbers), error, 'clickatell', not_sent=response.status_code < 500)
+            
+            # Clickatell reports acceptance per destination, in request order;
+            # destinations it accepted without a readable status count as sent
+            results = []
+            for item in (gateway_json(response) or {}).get('messages', []):
+                if item.get('accepted'):
+                    results.append({'success': True, 'message_id': item.get('apiMessageId'),
+                                    'provider': 'clickatell', 'batch': True})
+                else:
+                    results.append({'success': False, 'provider': 'clickatell', 'not_sent': True,
+                                    'error': item.get('errorDescription') or item.get('error') or 'Rejected'})
+            results.extend(sent_without_id(len(to_numbers) - len(results), 'clickatell'))
+            return results
+            
+        except Exception as e:
+            self.logger.error(f"Clickatell batch SMS error: {e}")
+            return batch_failure(len(to_numbers), str(e), 'clickatell')
+    
     def send_sms(self, to_number: str, message: str, sender_id: str = None) -> Dict[str, Any]:
         try:
             api_key = self.config.sms_api_key
             
             if not api_key:
-                return {'success': False, 'error': 'Clickatell API key not configured'}
+                return {'success': False, 'error': 'Clickatell API key not configured', 'not_sent': True}
             
             headers = {
                 'Authorization': api_key,
@@ -196,24 +499,26 @@ class ClickatellSMSClient(BaseSMSClient):
             if sender_id or self.config.sms_sender_id:
                 data['from'] = sender_id or self.config.sms_sender_id
             
-            response = requests.post(
+            response = get_gateway_session('clickatell').post(
                 'https://platform.clickatell.com/messages',
                 json=data,
-                headers=headers
+                headers=headers,
+                timeout=GATEWAY_TIMEOUT
             )
             
             if response.status_code == 202:
-                result = response.json()
+                result = gateway_json(response) or {}
                 return {
                     'success': True,
-                    'message_id': result.get('messages', [{}])[0].get('apiMessageId'),
+                    'message_id': (result.get('messages') or [{}])[0].get('apiMessageId'),
                     'provider': 'clickatell'
                 }
             else:
                 return {
                     'success': False,
                     'error': f'HTTP {response.status_code}: {response.text}',
-                    'provider': 'clickatell'
+                    'provider': 'clickatell',
+                    'not_sent': response.status_code < 500
                 }
                 
         except Exception as e:
@@ -229,7 +534,7 @@ class CustomSMSClient(BaseSMSClient):
             api_key = self.config.sms_api_key
             
             if not all([api_url, api_key]):
-                return {'success': False, 'error': 'Custom SMS API URL or key not configured'}
+                return {'success': False, 'error': 'Custom SMS API URL or key not configured', 'not_sent': True}
             
             headers = {
                 'Authorization': f'Bearer {api_key}',
@@ -242,10 +547,10 @@ class CustomSMSClient(BaseSMSClient):
                 'from': sender_id or self.config.sms_sender_id
             }
             
-            response = requests.post(api_url, json=data, headers=headers)
+            response = get_gateway_session('custom').post(api_url, json=data, headers=headers, timeout=GATEWAY_TIMEOUT)
             
             if response.status_code in [200, 201, 202]:
-                result = response.json()
+                result = gateway_json(response) or {}
                 return {
                     'success': True,
                     'message_id': result.get('id') or result.get('messageId') or result.get('message_id'),
@@ -255,7 +560,8 @@ class CustomSMSClient(BaseSMSClient):
                 return {
                     'success': False,
                     'error': f'HTTP {response.status_code}: {response.text}',
-                    'provider': 'custom'
+                    'provider': 'custom',
+                    'not_sent': response.status_code < 500
                 }
                 
         except Exception as e:
@@ -284,16 +590,36 @@ class BaseEmailClient:
         self.config = config
         self.logger = logging.getLogger(__name__)
     
+    # Maximum recipients per provider API call
+    max_batch_size = 1
+    
+    # Whether the provider can personalize per recipient server-side
+    supports_templated_batch = False
+    
     def send_email(self, to_email: str, subject: str, content: str, 
-                   from_email: str = None, from_name: str = None) -> Dict[str, Any]:
+                   from_email: str = None, from_name: str = None,
+                   headers: Dict[str, str] = None) -> Dict[str, Any]:
         """Send email - to be implemented by subclasses"""
         raise NotImplementedError("Subclasses must implement send_email method")
+    
+    def send_email_batch(self, to_emails: List[str], subject: str, content: str,
+                         from_email: str = None, from_name: str = None,
+                         headers: Dict[str, str] = None) -> List[Dict[str, Any]]:
+        """Send the same email to several addresses, returning one result per address in order"""
+        return [self.send_email(to_email, subject, content, from_email, from_name, headers) for to_email in to_emails]
+    
+    def send_templated_batch(self, subject_template: str, content_template: str,
+                             destinations: List[Tuple[str, Dict[str, str]]],
+                             from_email: str = None, from_name: str = None) -> List[Dict[str, Any]]:
+        """Send a provider-side template with per-recipient variables - implemented by providers that support it"""
+        raise NotImplementedError("Provider does not support templated batch sends")
 
 class SMTPEmailClient(BaseEmailClient):
     """SMTP email client implementation"""
     
     def send_email(self, to_email: str, subject: str, content: str, 
-                   from_email: str = None, from_name: str = None) -> Dict[str, Any]:
+                   from_email: str = None, from_name: str = None,
+                   headers: Dict[str, str] = None) -> Dict[str, Any]:
         try:
             smtp_host = self.config.smtp_host
             smtp_port = self.config.smtp_port or 587
@@ -312,19 +638,17 @@ class SMTPEmailClient(BaseEmailClient):
             msg['From'] = f"{from_name} <{from_email}>" if from_name else from_email
             msg['To'] = to_email
             msg['Subject'] = subject
+            for header, value in (headers or {}).items():
+                msg[header] = value
             
             # Add body
             msg.attach(MIMEText(content, 'html' if '<' in content else 'plain'))
             
-            # Send email
-            server = smtplib.SMTP(smtp_host, smtp_port)
-            if use_tls:
-                server.starttls()
-            server.login(smtp_username, smtp_password)
-            
-            text = msg.as_string()
-            server.sendmail(from_email, to_email, text)
-            server.quit()
+            # Send email over a pooled session
+            smtp_pool.send(
+                smtp_host, smtp_port, smtp_username, smtp_password,
+                get_tls_mode(use_tls), from_email, to_email, msg.as_string()
+            )
             
             return {
                 'success': True,
@@ -340,8 +664,134 @@ class SMTPEmailClient(BaseEmailClient):
 class AWSSESEmailClient(BaseEmailClient):
     """Amazon SES email client implementation"""
     
+    # SES accepts up to 50 destinations per SendBulkTemplatedEmail call
+    max_batch_size = 50
+    supports_templated_batch = True
+    
+    def __init__(self, config: OrganizationConfig):
+        super().__init__(config)
+        self._known_templates: 'OrderedDict[str, None]' = OrderedDict()
+        self._templates_lock = threading.Lock()
+    
+    def send_email_batch(self, to_emails: List[str], subject: str, content: str,
+                         from_email: str = None, from_name: str = None,
+                         headers: Dict[str, str] = None) -> List[Dict[str, Any]]:
+        """
+        Send the same email to several addresses through one bulk call
+
+        SES simple and templated sends cannot carry custom headers, so
+        `headers` is ignored; unsubscribe links travel in the body.
+        """
+        if '{{' in subject or '{{' in content:
+            # Would be interpreted as template tags by SES
+            return super().send_email_batch(to_emails, subject, content, from_email, from_name)
+        return self.send_templated_batch(subject, content, [(to_email, {}) for to_email in to_emails],
+                                         from_email, from_name)
+    
+    def send_templated_batch(self, subject_template: str, content_template: str,
+                             destinations: List[Tuple[str, Dict[str, str]]],
+                             from_email: str = None, from_name: str = None) -> List[Dict[str, Any]]:
+        """Send an SES template with per-recipient replacement data, up to 50 destinations"""
+        try:
+            access_key = self.config.aws_access_key_id
+            secret_key = self.config.aws_secret_access_key
+            region = self.config.aws_region or 'us-east-1'
+            
+            if not all([access_key, secret_key]):
+                return batch_failure(len(destinations), 'AWS SES credentials not configured')
+            
+            from_email = from_email or self.config.aws_sender_email
+            from_name = from_name or self.config.default_sender_name
+            
+            if not from_email:
+                return batch_failure(len(destinations), 'Sender email not configured')
+            
+            client = get_ses_client(access_key, secret_key, region)
+            
+            def send(template_name):
+                return client.send_bulk_templated_email(
+                    Source=f"{from_name} <{from_email}>" if from_name else from_email,
+                    Template=template_name,
+                    DefaultTemplateData='{}',
+                    Destinations=[{
+                        'Destination': {'ToAddresses': [to_email]},
+                        'ReplacementTemplateData': json.dumps(variables)
+                    } for to_email, variables in destinations]
+                )
+            
+            template_name = self._ensure_template(client, subject_template, content_template)
+            try:
+                response = send(template_name)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TemplateDoesNotExist':
+                    raise
+                # Deleted in the meantime; SES rejected the whole call, so resend it
+                self._forget_template(template_name)
+                response = send(self._ensure_template(client, subject_template, content_template))
+            
+            results = []
+            for (to_email, _), status in zip(destinations, response.get('Status', [])):
+                if status.get('Status') == 'Success':
+                    results.append({'success': True, 'message_id': status.get('MessageId'),
+                                    'provider': 'aws_ses', 'to_email': to_email, 'batch': True})
+                else:
+                    results.append({'success': False, 'provider': 'aws_ses',
+                                    'error': f"{status.get('Status')}: {status.get('Error', '')}"})
+            missing = len(destinations) - len(results)
+            results.extend(batch_failure(missing, 'No status returned', 'aws_ses'))
+            return results
+            
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            error_message = e.response['Error']['Message']
+            self.logger.error(f"AWS SES bulk error {error_code}: {error_message}")
+            return batch_failure(len(destinations), f'{error_code}: {error_message}', 'aws_ses')
+        except Exception as e:
+            self.logger.error(f"AWS SES bulk error: {e}")
+            return batch_failure(len(destinations), str(e), 'aws_ses')
+    
+    def _ensure_template(self, client, subject_template: str, content_template: str) -> str:
+        """
+        Create the SES template for this content if it does not exist yet
+
+        Templates are named after their content and the UTC day, so every
+        process shares them and reap_ses_templates can delete old ones by
+        age; this client only remembers the names it recently created.
+        """
+        digest = hashlib.sha1(f'{subject_template}\x00{content_template}'.encode('utf-8')).hexdigest()
+        template_name = f'{SES_TEMPLATE_PREFIX}{digest[:32]}-{datetime.utcnow():%Y%m%d}'
+        
+        with self._templates_lock:
+            if template_name in self._known_templates:
+                self._known_templates.move_to_end(template_name)
+                return template_name
+        
+        body_key = 'HtmlPart' if '<' in content_template else 'TextPart'
+        try:
+            client.create_template(Template={
+                'TemplateName': template_name,
+                'SubjectPart': subject_template,
+                body_key: content_template
+            })
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'AlreadyExists':
+                raise
+        
+        with self._templates_lock:
+            self._known_templates[template_name] = None
+            self._known_templates.move_to_end(template_name)
+            while len(self._known_templates) > SES_TEMPLATE_CACHE_SIZE:
+                self._known_templates.popitem(last=False)
+        
+        return template_name
+    
+    def _forget_template(self, template_name: str):
+        with self._templates_lock:
+            self._known_templates.pop(template_name, None)
+    
     def send_email(self, to_email: str, subject: str, content: str, 
-                   from_email: str = None, from_name: str = None) -> Dict[str, Any]:
+                   from_email: str = None, from_name: str = None,
+                   headers: Dict[str, str] = None) -> Dict[str, Any]:
         try:
             access_key = self.config.aws_access_key_id
             secret_key = self.config.aws_secret_access_key
@@ -356,13 +806,8 @@ class AWSSESEmailClient(BaseEmailClient):
             if not from_email:
                 return {'success': False, 'error': 'Sender email not configured'}
             
-            # Create SES client
-            client = boto3.client(
-                'ses',
-                aws_access_key_id=access_key,
-                aws_secret_access_key=secret_key,
-                region_name=region
-            )
+            # Shared SES client
+            client = get_ses_client(access_key, secret_key, region)
             
             # Determine content type
             body_key = 'Html' if '<' in content else 'Text'
@@ -424,8 +869,8 @@ class WhatsAppClient:
                 'Content-Type': 'application/json'
             }
             
-            # Clean phone number (remove + and spaces)
-            to_number = to_number.replace('+', '').replace(' ', '')
+            # Clean phone number
+            to_number = gateway_number(to_number)
             
             data = {
                 'messaging_product': 'whatsapp',
@@ -436,7 +881,7 @@ class WhatsAppClient:
                 }
             }
             
-            response = requests.post(api_url, json=data, headers=headers)
+            response = get_gateway_session('whatsapp', 'whatsapp').post(api_url, json=data, headers=headers, timeout=GATEWAY_TIMEOUT)
             
             if response.status_code in [200, 201]:
                 result = response.json()
@@ -476,7 +921,7 @@ class WhatsAppClient:
             }
             
             # Clean phone number
-            to_number = to_number.replace('+', '').replace(' ', '')
+            to_number = gateway_number(to_number)
             
             data = {
                 'messaging_product': 'whatsapp',
@@ -497,7 +942,7 @@ class WhatsAppClient:
                     'parameters': [{'type': 'text', 'text': var} for var in template_variables]
                 }]
             
-            response = requests.post(api_url, json=data, headers=headers)
+            response = get_gateway_session('whatsapp', 'whatsapp').post(api_url, json=data, headers=headers, timeout=GATEWAY_TIMEOUT)
             
             if response.status_code in [200, 201]:
                 result = response.json()
@@ -528,42 +973,114 @@ class UnifiedMessagingClient:
     def __init__(self, config: OrganizationConfig):
         self.config = config
         self.logger = logging.getLogger(__name__)
+        self._sms_client = None
+        self._email_client = None
+        self._whatsapp_client = None
+        self._fallback_sms_client = None
+    
+    @property
+    def sms_client(self):
+        """SMS client for the configured provider, built on first use"""
+        if self._sms_client is None:
+            self._sms_client = SMSClientFactory.create_client(self.config)
+        return self._sms_client
+    
+    @property
+    def email_client(self):
+        """Email client for the configured provider, built on first use"""
+        if self._email_client is None:
+            self._email_client = EmailClientFactory.create_client(self.config)
+        return self._email_client
+    
+    @property
+    def whatsapp_client(self):
+        """WhatsApp client, built on first use"""
+        if self._whatsapp_client is None:
+            self._whatsapp_client = WhatsAppClient(self.config)
+        return self._whatsapp_client
     
     def send_sms(self, to_number: str, message: str, sender_id: str = None) -> Dict[str, Any]:
-        """Send SMS with configured provider and Twilio fallback"""
+        """Send SMS with configured provider, retries and Twilio fallback"""
         try:
+            provider = self.config.sms_provider.lower()
+            scope = sender_id or self.config.sms_sender_id
+            
+            def send():
+                self._throttle(provider, 'sms', scope=scope)
+                return self.sms_client.send_sms(to_number, message, sender_id)
+            
             # Try configured SMS provider first
-            sms_client = SMSClientFactory.create_client(self.config)
-            result = sms_client.send_sms(to_number, message, sender_id)
+            result = send_with_retry(self._breaker_key('sms'), send)
             
-            if result['success']:
+            if result['success'] or not result.get('not_sent'):
                 return result
             
-            # Fallback to Twilio if available and different from primary
-            if self.config.sms_provider.lower() != 'twilio':
-                if os.environ.get('TWILIO_ACCOUNT_SID'):
-                    self.logger.info(f"Primary SMS provider failed, trying Twilio fallback")
-                    fallback_config = OrganizationConfig(sms_provider='twilio')
-                    twilio_client = TwilioSMSClient(fallback_config)
-                    fallback_result = twilio_client.send_sms(to_number, message, sender_id)
-                    
-                    if fallback_result['success']:
-                        fallback_result['fallback'] = True
-                        return fallback_result
-            
-            return result
+            return self._send_sms_fallback(to_number, message, sender_id) or result
             
         except Exception as e:
             self.logger.error(f"Unified SMS error: {e}")
             return {'success': False, 'error': str(e)}
     
+    def send_sms_batch(self, to_numbers: List[str], message: str, sender_id: str = None) -> List[Dict[str, Any]]:
+        """Send the same SMS to many numbers using the provider's bulk API where available"""
+        try:
+            provider = self.config.sms_provider.lower()
+            scope = sender_id or self.config.sms_sender_id
+            
+            def send(chunk):
+                self._throttle(provider, 'sms', len(chunk), scope=scope)
+                return self.sms_client.send_sms_batch(chunk, message, sender_id)
+            
+            size = self.sms_client.max_batch_size
+            results = []
+            for i in range(0, len(to_numbers), size):
+                results.extend(send_batch_with_retry(self._breaker_key('sms'), send, to_numbers[i:i + size]))
+            
+            # Per-number Twilio fallback, only for recipients the primary provider
+            # surely did not send to; timeouts and unreadable replies may have gone out
+            for index, result in enumerate(results):
+                if not result['success'] and result.get('not_sent'):
+                    results[index] = self._send_sms_fallback(to_numbers[index], message, sender_id) or result
+            return results
+            
+        except Exception as e:
+            self.logger.error(f"Unified batch SMS error: {e}")
+            return batch_failure(len(to_numbers), str(e))
+    
+    def _send_sms_fallback(self, to_number: str, message: str, sender_id: str = None) -> Optional[Dict[str, Any]]:
+        """Retry an SMS through Twilio when it is available and not the primary provider"""
+        # Fallback to Twilio if available and different from primary
+        if self.config.sms_provider.lower() != 'twilio':
+            if os.environ.get('TWILIO_ACCOUNT_SID'):
+                self.logger.info(f"Primary SMS provider failed, trying Twilio fallback")
+                if self._fallback_sms_client is None:
+                    self._fallback_sms_client = TwilioSMSClient(SimpleNamespace(
+                        sms_provider='twilio', sms_username=None,
+                        sms_api_key=None, sms_sender_id=None
+                    ))
+                
+                def send():
+                    self._throttle('twilio', 'sms', scope=os.environ.get('TWILIO_PHONE_NUMBER'))
+                    return self._fallback_sms_client.send_sms(to_number, message, sender_id)
+                
+                fallback_result = send_with_retry('twilio', send)
+                
+                if fallback_result['success']:
+                    fallback_result['fallback'] = True
+                    return fallback_result
+        
+        return None
+    
     def send_email(self, to_email: str, subject: str, content: str, 
                    from_email: str = None, from_name: str = None) -> Dict[str, Any]:
-        """Send email with configured provider and fallback"""
+        """Send email with configured provider and retries"""
         try:
+            def send():
+                self._throttle(self.config.email_provider.lower(), 'email')
+                return self.email_client.send_email(to_email, subject, content, from_email, from_name)
+            
             # Try configured email provider first
-            email_client = EmailClientFactory.create_client(self.config)
-            result = email_client.send_email(to_email, subject, content, from_email, from_name)
+            result = send_with_retry(self._breaker_key('email'), send)
             
             if result['success']:
                 return result
@@ -575,12 +1092,126 @@ class UnifiedMessagingClient:
             self.logger.error(f"Unified email error: {e}")
             return {'success': False, 'error': str(e)}
     
+    def send_email_batch(self, to_emails: List[str], subject: str, content: str,
+                         from_email: str = None, from_name: str = None,
+                         headers: Dict[str, str] = None) -> List[Dict[str, Any]]:
+        """Send the same email to many addresses using the provider's bulk API where available"""
+        try:
+            def send(chunk):
+                self._throttle(self.config.email_provider.lower(), 'email', len(chunk))
+                return self.email_client.send_email_batch(chunk, subject, content, from_email, from_name, headers)
+            
+            size = self.email_client.max_batch_size
+            results = []
+            for i in range(0, len(to_emails), size):
+                results.extend(send_batch_with_retry(self._breaker_key('email'), send, to_emails[i:i + size]))
+            return results
+            
+        except Exception as e:
+            self.logger.error(f"Unified batch email error: {e}")
+            return batch_failure(len(to_emails), str(e))
+    
+    def send_templated_email_batch(self, subject_template: str, content_template: str,
+                                   destinations: List[Tuple[str, Dict[str, str]]],
+                                   from_email: str = None, from_name: str = None) -> List[Dict[str, Any]]:
+        """Send a provider-side template with per-recipient variables in bulk calls"""
+        try:
+            def send(chunk):
+                self._throttle(self.config.email_provider.lower(), 'email', len(chunk))
+                return self.email_client.send_templated_batch(
+                    subject_template, content_template, chunk, from_email, from_name
+                )
+            
+            size = self.email_client.max_batch_size
+            results = []
+            for i in range(0, len(destinations), size):
+                results.extend(send_batch_with_retry(self._breaker_key('email'), send, destinations[i:i + size]))
+            return results
+            
+        except Exception as e:
+            self.logger.error(f"Unified templated email error: {e}")
+            return batch_failure(len(destinations), str(e))
+    
     def send_whatsapp(self, to_number: str, message: str) -> Dict[str, Any]:
-        """Send WhatsApp message"""
+        """Send WhatsApp message with retries"""
         try:
-            whatsapp_client = WhatsAppClient(self.config)
-            return whatsapp_client.send_message(to_number, message)
+            def send():
+                self._throttle('whatsapp', 'whatsapp', scope=self.config.whatsapp_phone_number)
+                return self.whatsapp_client.send_message(to_number, message)
+            
+            return send_with_retry(self._breaker_key('whatsapp'), send)
             
         except Exception as e:
             self.logger.error(f"WhatsApp error: {e}")
-            return {'success': False, 'error': str(e)}
\ No newline at end of file
+            return {'success': False, 'error': str(e)}
+    
+    def _throttle(self, provider: str, channel: str, messages: int = 1, scope: str = None):
+        """Wait for the provider and organization rate limits to allow a send"""
+        rate_limiter.acquire(provider, channel, getattr(self.config, 'organization_id', None),
+                             messages, scope)
+    
+    def _breaker_key(self, channel: str) -> str:
+        """Circuit breaker key for the endpoint this client sends a channel through"""
+        if channel == 'sms':
+            provider = self.config.sms_provider.lower()
+            return f'custom:{self.config.sms_api_url}' if provider == 'custom' else provider
+        elif channel == 'email':
+            provider = self.config.email_provider.lower()
+            return f'smtp:{self.config.smtp_host}' if provider == 'smtp' else provider
+        return f'whatsapp:{self.config.whatsapp_api_url}'
+
+class ProviderClientCache:
+    """Process-wide cache of ready messaging clients per organization
+    
+    Entries are keyed by the OrganizationConfig.updated_at stamp, so saving
+    new settings makes the next lookup rebuild the clients in every process.
+    """
+    
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+    
+    def get(self, config: OrganizationConfig) -> UnifiedMessagingClient:
+        """Get the cached client for an organization config, rebuilding it if the config changed"""
+        stamp = config.updated_at
+        
+        with self._lock:
+            entry = self._clients.get(config.organization_id)
+            if entry and entry[0] == stamp:
+                return entry[1]
+        
+        client = UnifiedMessagingClient(snapshot_config(config))
+        
+        with self._lock:
+            self._clients[config.organization_id] = (stamp, client)
+        return client
+    
+    def invalidate(self, organization_id: int = None):
+        """Drop cached clients for one organization, or all of them"""
+        with self._lock:
+            if organization_id is None:
+                self._clients = {}
+            else:
+                self._clients.pop(organization_id, None)
+
+def is_channel_configured(config: OrganizationConfig, channel: str) -> bool:
+    """Check if an organization config has provider settings for a channel"""
+    if config is None or config.is_active is False:
+        return False
+    
+    if channel == 'sms':
+        return bool(config.sms_provider and config.sms_api_key)
+    elif channel == 'email':
+        if (config.email_provider or 'smtp').lower() == 'aws_ses':
+            return bool(config.aws_access_key_id and config.aws_secret_access_key)
+        return bool(config.smtp_host and config.smtp_username and config.smtp_password)
+    elif channel == 'whatsapp':
+        return bool(config.whatsapp_api_url and config.whatsapp_api_key)
+    return False
+
+# Process-wide cache shared by all send workers
+provider_clients = ProviderClientCache()
+
+def get_messaging_client(config: OrganizationConfig) -> UnifiedMessagingClient:
+    """Get a ready messaging client for an organization config"""
+    return provider_clients.get(config)
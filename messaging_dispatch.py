@@ -0,0 +1,521 @@
+"""
+Campaign Dispatch Engine - Background send workers for the message outbox
+Campaign recipients are queued as MessageDelivery rows (see message_outbox);
+per-channel workers claim them in batches, taking organizations in
+fair-share order, and run the blocking provider calls, so sends survive
+restarts and can be spread over several processes.
+Run this module directly to start a standalone worker process.
+"""
+
+import os
+import json
+import uuid
+import socket
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from flask import current_app
+from sqlalchemy.orm import load_only
+from app import db
+from models import Contact, MessageCampaign, MessageDelivery, OrganizationConfig
+from rate_limiter import process_share, rate_limiter
+from template_engine import CONTACT_COLUMNS
+from fair_share import FairShareQueue
+from message_outbox import (
+    OUTBOX_LEASE_SECONDS, PRIORITY_LANES, claim_batch, record_results, renew_claims,
+    release_stale_claims, release_orphaned_claims, has_pending_deliveries, hold_deliveries,
+    defer_deliveries, requeue_stranded_paused, unfinished_contact_watermark
+)
+from campaign_controls import campaign_states
+from campaign_metrics import CAMPAIGN_COUNTER_SHARDS, fold_counter_shards, increment_campaign_counters
+from idempotency import idempotency_keys
+from suppression_list import suppression_list, unsubscribe_url
+from send_windows import in_window, next_window_slot
+from http_sessions import set_channel_pool_size
+
+# Default worker counts per channel, override with DISPATCH_<CHANNEL>_WORKERS
+DEFAULT_CHANNEL_CONCURRENCY = {
+    'email': 8,
+    'sms': 8,
+    'whatsapp': 4
+}
+
+# Default workers of the transactional lane per channel; normal gets half the
+# channel's workers and bulk all of them, override with DISPATCH_<CHANNEL>_<LANE>_WORKERS
+TRANSACTIONAL_LANE_WORKERS = 2
+
+# Number of deliveries claimed by one worker at a time
+DISPATCH_BATCH_SIZE = int(os.environ.get('DISPATCH_BATCH_SIZE', '100'))
+TRANSACTIONAL_BATCH_SIZE = int(os.environ.get('DISPATCH_TRANSACTIONAL_BATCH_SIZE', '10'))
+
+# Seconds an idle worker waits before polling the outbox again
+DISPATCH_POLL_SECONDS = float(os.environ.get('DISPATCH_POLL_SECONDS', '5'))
+TRANSACTIONAL_POLL_SECONDS = float(os.environ.get('DISPATCH_TRANSACTIONAL_POLL_SECONDS', '1'))
+
+# Longest a worker keeps sending one claimed batch before returning the rest
+# to the queue; well inside the claim lease, which is renewed between slices
+DISPATCH_MAX_BATCH_SECONDS = float(os.environ.get('DISPATCH_MAX_BATCH_SECONDS', OUTBOX_LEASE_SECONDS / 2))
+
+# Attempts at writing a sent batch's results before leaving it to the reaper
+DISPATCH_RECORD_ATTEMPTS = 3
+
+# Seconds between sweeps for old bulk-send SES templates
+SES_TEMPLATE_REAP_SECONDS = float(os.environ.get('SES_TEMPLATE_REAP_SECONDS', '3600'))
+
+# Run send workers inside web processes; disable when running standalone workers
+DISPATCH_IN_PROCESS = os.environ.get('DISPATCH_IN_PROCESS', 'true').lower() == 'true'
+
+
+def get_channel_concurrency(channel: str) -> int:
+    """Get the configured number of send workers for a channel"""
+    default = DEFAULT_CHANNEL_CONCURRENCY.get(channel, 4)
+    return max(1, int(os.environ.get(f'DISPATCH_{channel.upper()}_WORKERS', default)))
+
+
+def get_lane_concurrency(channel: str, priority: str) -> int:
+    """Get the configured number of send workers for a channel's priority lane"""
+    if priority == 'transactional':
+        default = TRANSACTIONAL_LANE_WORKERS
+    elif priority == 'normal':
+        default = max(1, get_channel_concurrency(channel) // 2)
+    else:
+        default = get_channel_concurrency(channel)
+    return max(1, int(os.environ.get(f'DISPATCH_{channel.upper()}_{priority.upper()}_WORKERS', default)))
+
+
+def get_channel_workers(channel: str) -> int:
+    """Total send threads of a channel across all lanes, plus the system senders"""
+    return sum(get_lane_concurrency(channel, priority) for priority in PRIORITY_LANES) + TRANSACTIONAL_LANE_WORKERS
+
+
+def get_dispatch_thread_count() -> int:
+    """Send threads of all channels and lanes plus the system senders, i.e. database connections they may hold"""
+    lanes = sum(get_lane_concurrency(channel, priority)
+                for channel in DEFAULT_CHANNEL_CONCURRENCY for priority in PRIORITY_LANES)
+    return lanes + TRANSACTIONAL_LANE_WORKERS
+
+
+class CampaignDispatcher:
+    """Runs worker threads per channel and priority lane that drain the message outbox"""
+
+    def __init__(self, concurrency: Dict[str, int] = None, batch_size: int = None,
+                 poll_seconds: float = None):
+        self.concurrency = concurrency or {}
+        self.batch_size = batch_size or DISPATCH_BATCH_SIZE
+        self.poll_seconds = poll_seconds or DISPATCH_POLL_SECONDS
+        self.worker_id = f'{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.logger = logging.getLogger(__name__)
+        self._threads: Dict[Tuple[str, str], List[threading.Thread]] = {}
+        self._wakeups: Dict[Tuple[str, str], threading.Event] = {}
+        self._fair_shares: Dict[Tuple[str, str], FairShareQueue] = {}
+        self._system_senders = None
+        self._recovered = False
+        self._stopping = threading.Event()
+        self._last_reap = 0.0
+        self._last_template_reap = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, app, channels: List[str] = None, priorities: List[str] = None):
+        """Start (once) the worker threads for the given channels and lanes"""
+        with self._lock:
+            if not self._recovered:
+                self._recovered = True
+                threading.Thread(target=self._recover, args=(app,), name='dispatch-recovery', daemon=True).start()
+            for channel in channels or DEFAULT_CHANNEL_CONCURRENCY:
+                set_channel_pool_size(channel, get_channel_workers(channel))
+                for priority in priorities or PRIORITY_LANES:
+                    lane = (channel, priority)
+                    if lane in self._threads:
+                        continue
+                    self._wakeups[lane] = threading.Event()
+                    workers = self.concurrency.get(lane) or get_lane_concurrency(channel, priority)
+                    threads = []
+                    for index in range(workers):
+                        thread = threading.Thread(target=self._worker_loop, args=(app, channel, priority),
+                                                  name=f'dispatch-{channel}-{priority}-{index}', daemon=True)
+                        thread.start()
+                        threads.append(thread)
+                    self._threads[lane] = threads
+
+    def notify(self, channel: str, priority: str = None):
+        """Wake idle workers of a channel (or one of its lanes) after deliveries were queued"""
+        for lane, wakeup in list(self._wakeups.items()):
+            if lane[0] == channel and priority in (None, lane[1]):
+                wakeup.set()
+
+    def send_system_message(self, send: Callable[[], Dict[str, Any]]) -> Future:
+        """
+        Run a one-off transactional send (password reset, invitation) right away
+
+        These go to dedicated sender threads with transactional rate-limit
+        priority, so they never wait behind campaign batches.
+        """
+        with self._lock:
+            if self._system_senders is None:
+                self._system_senders = ThreadPoolExecutor(max_workers=TRANSACTIONAL_LANE_WORKERS,
+                                                          thread_name_prefix='dispatch-system')
+        return self._system_senders.submit(self._run_system_message, send)
+
+    def _run_system_message(self, send: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        with rate_limiter.lane('transactional'):
+            try:
+                result = send()
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+        if not result.get('success'):
+            self.logger.error(f"System message failed: {result.get('error')}")
+        return result
+
+    def dispatch(self, campaign: MessageCampaign) -> Dict[str, Any]:
+        """
+        Hand a committed campaign to the send workers and return immediately
+
+        Args:
+            campaign: Committed campaign whose deliveries are queued in the outbox
+
+        Returns:
+            Campaign handle with the number of queued recipients
+        """
+        channel = campaign.template.template_type
+        priority = campaign.priority or 'normal'
+        if DISPATCH_IN_PROCESS:
+            self.start(current_app._get_current_object(), [channel], [priority])
+            self.notify(channel, priority)
+
+        self.logger.info(f"Campaign {campaign.id} queued: {campaign.recipient_count} "
+                         f"recipients on '{channel}' {priority} workers")
+
+        return {
+            'success': True,
+            'campaign_id': campaign.id,
+            'status': campaign.status,
+            'queued': campaign.recipient_count
+        }
+
+    def is_active(self, campaign_id: int) -> bool:
+        """Check if a campaign still has deliveries waiting or in flight"""
+        return has_pending_deliveries(campaign_id)
+
+    def _worker_loop(self, app, channel: str, priority: str):
+        """Claim and send outbox batches of one lane until the dispatcher stops"""
+        wakeup = self._wakeups[(channel, priority)]
+        poll_seconds = TRANSACTIONAL_POLL_SECONDS if priority == 'transactional' else self.poll_seconds
+        while not self._stopping.is_set():
+            with app.app_context(), rate_limiter.lane(priority):
+                try:
+                    self._reap_stale_claims()
+                    processed = self.process_batch(channel, priority)
+                except Exception as e:
+                    db.session.rollback()
+                    processed = 0
+                    self.logger.error(f"Dispatch worker error on '{channel}' {priority}: {str(e)}")
+                finally:
+                    db.session.remove()
+
+            if not processed:
+                wakeup.wait(poll_seconds)
+                wakeup.clear()
+
+    def _recover(self, app):
+        """Resume batches interrupted by a crash or restart of this host's workers"""
+        with app.app_context():
+            try:
+                released = release_orphaned_claims(self.worker_id)
+                if released:
+                    self.logger.warning(f"Resuming {released} deliveries interrupted by a worker restart")
+                    for channel in DEFAULT_CHANNEL_CONCURRENCY:
+                        self.notify(channel)
+            except Exception as e:
+                db.session.rollback()
+                self.logger.error(f"Error resuming interrupted deliveries: {str(e)}")
+            finally:
+                db.session.remove()
+
+    def _reap_stale_claims(self):
+        """
+        Requeue deliveries left 'sending' by dead workers and purge expired
+        idempotency keys, at most every half lease, and old SES templates
+        every SES_TEMPLATE_REAP_SECONDS
+        """
+        from messaging_clients import reap_ses_templates
+
+        with self._lock:
+            if time.monotonic() - self._last_reap < OUTBOX_LEASE_SECONDS / 2:
+                return
+            self._last_reap = time.monotonic()
+            reap_templates = time.monotonic() - self._last_template_reap >= SES_TEMPLATE_REAP_SECONDS
+            if reap_templates:
+                self._last_template_reap = time.monotonic()
+        released = release_stale_claims()
+        if released:
+            self.logger.warning(f"Requeued {released} deliveries with expired claims")
+        idempotency_keys.purge_expired()
+        if reap_templates:
+            deleted = reap_ses_templates()
+            if deleted:
+                self.logger.info(f"Deleted {deleted} old SES templates")
+
+    def process_batch(self, channel: str, priority: str = 'normal') -> int:
+        """
+        Claim one batch of due deliveries from a channel lane and send it
+
+        The organization served is chosen by the lane's fair-share queue.
+        Must run inside an app context.
+
+        Returns:
+            Number of deliveries claimed
+        """
+        batch_size = TRANSACTIONAL_BATCH_SIZE if priority == 'transactional' else self.batch_size
+        fair_share = self.get_fair_share(channel, priority)
+        turn = fair_share.acquire(batch_size)
+        if turn is None:
+            return 0
+
+        organization_id, limit = turn
+        deliveries = []
+        try:
+            deliveries = claim_batch(channel, priority, limit, self.worker_id, organization_id)
+            self._send_claimed(deliveries)
+        finally:
+            fair_share.release(organization_id, limit, len(deliveries))
+        return len(deliveries)
+
+    def get_fair_share(self, channel: str, priority: str = 'normal') -> FairShareQueue:
+        """Get (or create) the fair-share queue of a channel lane"""
+        with self._lock:
+            queue = self._fair_shares.get((channel, priority))
+            if queue is None:
+                quantum = TRANSACTIONAL_BATCH_SIZE if priority == 'transactional' else self.batch_size
+                queue = FairShareQueue(channel, priority, quantum)
+                self._fair_shares[(channel, priority)] = queue
+            return queue
+
+    def _send_claimed(self, deliveries: List[MessageDelivery]):
+        """Send a claimed batch campaign by campaign"""
+
+        by_campaign = defaultdict(list)
+        for delivery in deliveries:
+            by_campaign[delivery.campaign_id].append(delivery)
+
+        for campaign_id, campaign_deliveries in by_campaign.items():
+            try:
+                self._send_deliveries(campaign_id, campaign_deliveries)
+            except Exception as e:
+                # Leave the claims in place; they are requeued after the lease expires
+                db.session.rollback()
+                self.logger.error(f"Dispatch batch error for campaign {campaign_id}: {str(e)}")
+                continue
+            self.finish_campaign(campaign_id)
+
+    def _send_deliveries(self, campaign_id: int, deliveries: List[MessageDelivery]):
+        """Send claimed deliveries of one campaign and record the outcomes"""
+        from messaging import MessagingService
+
+        token = deliveries[0].claimed_by
+        campaign = db.session.get(MessageCampaign, campaign_id)
+        template = campaign.template
+        custom_variables = json.loads(campaign.custom_variables) if campaign.custom_variables else None
+        service = MessagingService()
+
+        # Only the columns personalization and addressing read are loaded
+        contacts = {contact.id: contact for contact in Contact.query.options(
+            load_only(*[getattr(Contact, column) for column in CONTACT_COLUMNS], Contact.organization_id,
+                      Contact.phone_e164, Contact.mobile_e164)
+        ).filter(
+            Contact.id.in_([delivery.contact_id for delivery in deliveries]),
+            Contact.organization_id == campaign.organization_id
+        )}
+        sendable = [delivery for delivery in deliveries if delivery.contact_id in contacts]
+
+        # Suppressed recipients are skipped; the Bloom filter keeps most batches off the table
+        suppressed = suppression_list.suppressed_addresses(
+            campaign.organization_id, [delivery.recipient for delivery in sendable]
+        )
+        if suppressed:
+            skipped = [delivery for delivery in deliveries if delivery.recipient in suppressed]
+            hold_deliveries(token, skipped, 'suppressed')
+            sendable = [delivery for delivery in sendable if delivery.recipient not in suppressed]
+            deliveries = [delivery for delivery in deliveries if delivery.recipient not in suppressed]
+
+        config = OrganizationConfig.query.filter_by(
+            organization_id=campaign.organization_id
+        ).first()
+        rate_limiter.configure_organization(config)
+
+        # Every email carries a link that unsubscribes its recipient
+        unsubscribe_urls = {}
+        if template.template_type == 'email':
+            unsubscribe_urls = {delivery.id: unsubscribe_url(delivery.id) for delivery in sendable}
+
+        # Loaded rows are detached, so the commits below neither expire them
+        # nor keep a connection checked out during provider calls
+        for instance in [campaign, template, config, *contacts.values()]:
+            if instance is not None:
+                db.session.expunge(instance)
+        db.session.commit()
+
+        # Campaign controls are checked between slices; a throttled campaign
+        # sends slices of about one second of its rate. The campaign rate is
+        # waited for first, at most until the lease is half gone, then the
+        # lease of the whole batch is renewed right before the provider call,
+        # so the reaper never requeues rows that are still being sent or are
+        # sent but not yet recorded, and rows whose claim was lost are skipped.
+        outcomes = {}
+        held = []
+        held_status = None
+        deferred = {}
+        window = (campaign.send_window_start, campaign.send_window_end) if campaign.send_window_start else None
+        claimed = {delivery.id for delivery in deliveries}
+        started = renewed = time.monotonic()
+        state = campaign_states.get(campaign_id)
+        # process_share ignores a stored rate that is not a positive finite number
+        rate = process_share(state.send_rate)
+        step = max(1, int(rate)) if rate else max(1, len(sendable))
+        for start in range(0, len(sendable), step):
+            state = campaign_states.get(campaign_id)
+            if state.status in ('paused', 'cancelled'):
+                # The cache may predate a resume; only the database decides to hold
+                campaign_states.invalidate(campaign_id)
+                state = campaign_states.get(campaign_id)
+            if state.status in ('paused', 'cancelled'):
+                held, held_status = sendable[start:], state.status
+                break
+            if start and time.monotonic() - started > DISPATCH_MAX_BATCH_SECONDS:
+                held, held_status = sendable[start:], 'queued'
+                break
+            chunk = [delivery for delivery in sendable[start:start + step] if delivery.id in claimed]
+            if window:
+                # Retries and resumed deliveries can come due in quiet hours; they wait for the next window
+                now = datetime.utcnow()
+                for delivery in chunk:
+                    if not in_window(delivery.timezone, *window, now):
+                        deferred[delivery.id] = next_window_slot(delivery.timezone, *window, now, delivery.id)
+                chunk = [delivery for delivery in chunk if delivery.id not in deferred]
+            if not chunk:
+                continue
+            lease_left = OUTBOX_LEASE_SECONDS / 2 - (time.monotonic() - renewed)
+            if not rate_limiter.acquire_campaign(campaign_id, state.send_rate, len(chunk), max(0.0, lease_left)):
+                # Too far behind the campaign rate to send within the lease; another pass picks the rest up
+                held = [delivery for delivery in sendable[start:] if delivery.id not in deferred]
+                held_status = 'queued'
+                break
+            claimed = renew_claims(token, claimed)
+            db.session.commit()
+            renewed = time.monotonic()
+            chunk = [delivery for delivery in chunk if delivery.id in claimed]
+            if not chunk:
+                continue
+            results = service.deliver_batch(
+                template, [contacts[delivery.contact_id] for delivery in chunk], custom_variables, config,
+                [unsubscribe_urls.get(delivery.id) for delivery in chunk]
+            )
+            outcomes.update((delivery.id, result) for delivery, result in zip(chunk, results))
+
+        held_ids = {delivery.id for delivery in held}
+        results = [
+            (delivery, outcomes.get(delivery.id, {'success': False, 'error': 'Contact not found'}))
+            for delivery in deliveries
+            if delivery.id in claimed and delivery.id not in held_ids and delivery.id not in deferred
+        ]
+        lost = len(deliveries) - len(held) - len(deferred) - len(results)
+        if lost:
+            self.logger.warning(f"Campaign {campaign_id}: claim lost on {lost} deliveries, left to their new owner")
+
+        # Provider calls are done; failing to record them now would send them
+        # again once the lease expires, so the write is retried
+        for attempt in range(1, DISPATCH_RECORD_ATTEMPTS + 1):
+            try:
+                self._record_outcomes(campaign_id, token, results, held, held_status, deferred)
+                return
+            except Exception as e:
+                db.session.rollback()
+                if attempt == DISPATCH_RECORD_ATTEMPTS:
+                    raise
+                self.logger.warning(f"Retrying results of campaign {campaign_id}: {str(e)}")
+                time.sleep(attempt)
+
+    def _record_outcomes(self, campaign_id: int, token: str, results: List[Tuple[MessageDelivery, Dict[str, Any]]],
+                         held: List[MessageDelivery], held_status: str, deferred: Dict[int, datetime]):
+        """Write a batch's send results, held and deferred deliveries and counters in one transaction"""
+        if held:
+            returned = hold_deliveries(token, held, held_status)
+            self.logger.info(f"Campaign {campaign_id} {held_status}: returned {returned} claimed deliveries")
+        if deferred:
+            returned = defer_deliveries(token, deferred)
+            self.logger.info(f"Campaign {campaign_id}: {returned} deliveries outside their send window rescheduled")
+
+        now = datetime.utcnow()
+        statuses = record_results(token, results, now)
+        sent = sum(1 for status in statuses.values() if status == 'sent')
+        failed = sum(1 for status in statuses.values() if status == 'failed')
+
+        # Counters and checkpoint commit together with the delivery outcomes
+        increment_campaign_counters(
+            campaign_id, {'messages_sent': sent, 'messages_failed': failed},
+            checkpoint_at=now, checkpoint_contact_id=unfinished_contact_watermark(campaign_id)
+        )
+        db.session.commit()
+
+    def finish_campaign(self, campaign_id: int):
+        """Complete a campaign once none of its deliveries are left to send"""
+        try:
+            requeued = requeue_stranded_paused(campaign_id)
+            if requeued:
+                db.session.commit()
+                self.logger.warning(f"Campaign {campaign_id}: requeued {requeued} deliveries held after it resumed")
+                return
+            if has_pending_deliveries(campaign_id):
+                return
+            updated = MessageCampaign.query.filter_by(id=campaign_id, status='sending').update({
+                MessageCampaign.status: 'completed',
+                MessageCampaign.completed_at: datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+            if updated:
+                self.logger.info(f"Campaign {campaign_id} completed")
+                if CAMPAIGN_COUNTER_SHARDS:
+                    fold_counter_shards(campaign_id)
+        except Exception as e:
+            db.session.rollback()
+            self.logger.error(f"Error completing campaign {campaign_id}: {str(e)}")
+
+    def shutdown(self, wait: bool = True):
+        """Stop all worker threads; claimed batches finish first when waiting"""
+        self._stopping.set()
+        with self._lock:
+            threads = [thread for group in self._threads.values() for thread in group]
+            wakeups = list(self._wakeups.values())
+            system_senders = self._system_senders
+            self._threads = {}
+            self._wakeups = {}
+            self._system_senders = None
+        if system_senders is not None:
+            system_senders.shutdown(wait=wait)
+        for wakeup in wakeups:
+            wakeup.set()
+        if wait:
+            for thread in threads:
+                thread.join()
+            self._stopping.clear()
+
+
+# Process-wide dispatcher shared by all requests
+dispatcher = CampaignDispatcher()
+
+
+if __name__ == "__main__":
+    import main  # noqa: F401 - registers routes before the app is used
+    from app import app
+
+    logging.info(f"Starting outbox workers as {dispatcher.worker_id}")
+    dispatcher.start(app)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        dispatcher.shutdown()
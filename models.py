@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
 from app import db
+from contact_addresses import canonical_email, normalize_phone
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
 import string
@@ -168,6 +169,15 @@ class OrganizationConfig(db.Model):
     whatsapp_phone_number = db.Column(db.String(50))
     whatsapp_webhook_url = db.Column(db.String(255))
     
+    # Send rate limits (messages per second, empty = provider default)
+    sms_rate_limit = db.Column(db.Float)
+    email_rate_limit = db.Column(db.Float)
+    whatsapp_rate_limit = db.Column(db.Float)
+    
+    # Send worker fair share (relative weight, max concurrent batches; empty = default / no cap)
+    send_weight = db.Column(db.Integer, default=1)
+    send_concurrency_limit = db.Column(db.Integer)
+    
     # General Settings
     default_sender_name = db.Column(db.String(100))
     is_active = db.Column(db.Boolean, default=True)
@@ -216,6 +226,11 @@ class Contact(db.Model):
     fax = db.Column(db.String(20))
     website = db.Column(db.String(200))
     
+    # Normalized addresses, kept in sync on every write (see normalize_addresses)
+    email_canonical = db.Column(db.String(120))
+    phone_e164 = db.Column(db.String(16))
+    mobile_e164 = db.Column(db.String(16))
+    
     # Professional Information
     company = db.Column(db.String(100))
     job_title = db.Column(db.String(100))
@@ -266,13 +281,30 @@ class Contact(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_contact_org_email_canonical', 'organization_id', 'email_canonical'),
+        db.Index('ix_contact_org_phone_e164', 'organization_id', 'phone_e164'),
+        db.Index('ix_contact_org_mobile_e164', 'organization_id', 'mobile_e164'),
+    )
+    
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
     
+    def normalize_addresses(self):
+        """Recompute the canonical email and E.164 phone columns from the raw fields"""
+        self.email_canonical = canonical_email(self.email)
+        self.phone_e164 = normalize_phone(self.phone, self.country)
+        self.mobile_e164 = normalize_phone(self.mobile, self.country)
+    
     def __repr__(self):
         return f'<Contact {self.full_name}>'
 
+@db.event.listens_for(Contact, 'before_insert')
+@db.event.listens_for(Contact, 'before_update')
+def _normalize_contact_addresses(mapper, connection, contact):
+    contact.normalize_addresses()
+
 class Template(db.Model):
     """Template model for message templates"""
     id = db.Column(db.Integer, primary_key=True)
@@ -345,16 +377,23 @@ class MessageCampaign(db.Model):
     description = db.Column(db.Text)
     template_id = db.Column(db.Integer, db.ForeignKey('template.id'), nullable=False)
     organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), nullable=False)
-    status = db.Column(db.String(20), default='draft')  # draft, scheduled, sending, completed, cancelled
+    status = db.Column(db.String(20), default='draft')  # draft, scheduled, sending, paused, completed, cancelled
+    priority = db.Column(db.String(20), default='normal')  # transactional, normal, bulk
+    send_rate = db.Column(db.Float)  # Max messages per second for this campaign, empty = no campaign limit
     
     # Scheduling
     scheduled_at = db.Column(db.DateTime)
     sent_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
     
+    # Recipient-local send window, no sends outside it (empty = any time)
+    send_window_start = db.Column(db.Time)
+    send_window_end = db.Column(db.Time)
+    
     # Target audience
     target_group_id = db.Column(db.Integer, db.ForeignKey('group.id'))
     recipient_count = db.Column(db.Integer, default=0)
+    custom_variables = db.Column(db.Text)  # JSON object of extra personalization variables
     
     # Tracking metrics
     messages_sent = db.Column(db.Integer, default=0)
@@ -365,9 +404,17 @@ class MessageCampaign(db.Model):
     messages_bounced = db.Column(db.Integer, default=0)
     unsubscribes = db.Column(db.Integer, default=0)
     
+    # Send progress checkpoint, advanced with every committed batch
+    checkpoint_contact_id = db.Column(db.Integer)  # Lowest contact id not yet sent to; all below are final
+    checkpoint_at = db.Column(db.DateTime)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_message_campaigns_status_scheduled', 'status', 'scheduled_at'),
+    )
+    
     # Relationships
     template = db.relationship('Template', backref='campaigns')
     organization = db.relationship('Organization', backref='message_campaigns')
@@ -394,6 +441,71 @@ class MessageCampaign(db.Model):
             return 0
         return round((self.messages_clicked / self.messages_delivered) * 100, 2)
 
+class CampaignCounterShard(db.Model):
+    """Slice of a campaign's tracking metrics, summed with the campaign row on read"""
+    __tablename__ = 'campaign_counter_shards'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('message_campaigns.id'), nullable=False)
+    shard = db.Column(db.Integer, nullable=False)
+    
+    messages_sent = db.Column(db.Integer, default=0, nullable=False)
+    messages_delivered = db.Column(db.Integer, default=0, nullable=False)
+    messages_failed = db.Column(db.Integer, default=0, nullable=False)
+    messages_opened = db.Column(db.Integer, default=0, nullable=False)
+    messages_clicked = db.Column(db.Integer, default=0, nullable=False)
+    messages_bounced = db.Column(db.Integer, default=0, nullable=False)
+    unsubscribes = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'shard', name='uq_campaign_counter_shards_campaign_shard'),
+    )
+
+class DailyChannelRollup(db.Model):
+    """Messaging activity of an organization on one channel during one day (UTC), split over shard rows"""
+    __tablename__ = 'daily_channel_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), nullable=False)
+    channel = db.Column(db.String(20), nullable=False)  # sms, email, whatsapp
+    day = db.Column(db.Date, nullable=False)
+    shard = db.Column(db.Integer, default=0, nullable=False)
+
+    campaigns = db.Column(db.Integer, default=0, nullable=False)  # Campaigns created
+    messages_sent = db.Column(db.Integer, default=0, nullable=False)
+    messages_delivered = db.Column(db.Integer, default=0, nullable=False)
+    messages_failed = db.Column(db.Integer, default=0, nullable=False)
+    messages_opened = db.Column(db.Integer, default=0, nullable=False)
+    messages_clicked = db.Column(db.Integer, default=0, nullable=False)
+    messages_bounced = db.Column(db.Integer, default=0, nullable=False)
+    unsubscribes = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('organization_id', 'channel', 'day', 'shard', name='uq_daily_channel_rollups_org_channel_day_shard'),
+        db.Index('ix_daily_channel_rollups_org_day', 'organization_id', 'day'),
+    )
+
+class CampaignHourlyRollup(db.Model):
+    """Messaging activity of a campaign during one hour (UTC), split over shard rows"""
+    __tablename__ = 'campaign_hourly_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('message_campaigns.id'), nullable=False)
+    hour = db.Column(db.DateTime, nullable=False)  # Start of the hour
+    shard = db.Column(db.Integer, default=0, nullable=False)
+
+    messages_sent = db.Column(db.Integer, default=0, nullable=False)
+    messages_delivered = db.Column(db.Integer, default=0, nullable=False)
+    messages_failed = db.Column(db.Integer, default=0, nullable=False)
+    messages_opened = db.Column(db.Integer, default=0, nullable=False)
+    messages_clicked = db.Column(db.Integer, default=0, nullable=False)
+    messages_bounced = db.Column(db.Integer, default=0, nullable=False)
+    unsubscribes = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'hour', 'shard', name='uq_campaign_hourly_rollups_campaign_hour_shard'),
+    )
+
 class MessageDelivery(db.Model):
     """Individual message delivery tracking"""
     __tablename__ = 'message_deliveries'
@@ -401,14 +513,16 @@ class MessageDelivery(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     campaign_id = db.Column(db.Integer, db.ForeignKey('message_campaigns.id'), nullable=False)
     contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'))
     
     # Message details
     message_id = db.Column(db.String(100))  # External provider message ID
     channel = db.Column(db.String(20), nullable=False)  # sms, email, whatsapp
+    priority = db.Column(db.String(20), default='normal')  # transactional, normal, bulk
     recipient = db.Column(db.String(200), nullable=False)  # phone/email address
     
     # Status tracking
-    status = db.Column(db.String(20), default='queued')  # queued, sent, delivered, failed, bounced
+    status = db.Column(db.String(20), default='queued')  # scheduled, queued, paused, sending, sent, delivered, failed, bounced, suppressed, cancelled
     sent_at = db.Column(db.DateTime)
     delivered_at = db.Column(db.DateTime)
     opened_at = db.Column(db.DateTime)
@@ -418,9 +532,25 @@ class MessageDelivery(db.Model):
     error_code = db.Column(db.String(50))
     error_message = db.Column(db.Text)
     
+    # Recipient timezone bucket for send windows
+    timezone = db.Column(db.String(50))
+    
+    # Outbox claim tracking
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    claimed_by = db.Column(db.String(100))
+    claimed_at = db.Column(db.DateTime)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_message_deliveries_outbox', 'status', 'channel', 'priority', 'organization_id', 'id'),
+        db.Index('ix_message_deliveries_campaign_status', 'campaign_id', 'status', 'contact_id'),
+        db.Index('ix_message_deliveries_campaign_id', 'campaign_id', 'id'),
+        db.Index('ix_message_deliveries_release', 'status', 'next_attempt_at'),
+    )
+    
     # Relationships
     campaign = db.relationship('MessageCampaign', backref='deliveries')
     contact = db.relationship('Contact', backref='message_deliveries')
@@ -456,3 +586,43 @@ class MessageLog(db.Model):
     
     def __repr__(self):
         return f'<MessageLog {self.message_type} to {self.recipient}>'
+
+class IdempotencyKey(db.Model):
+    """Stored outcome of a send request made with an Idempotency-Key"""
+    __tablename__ = 'idempotency_keys'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), nullable=False)
+    key_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the client's key
+    request_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the request payload
+    response = db.Column(db.Text)  # JSON result, empty while the first request is in progress
+    reserved_at = db.Column(db.DateTime)  # When the running request took the key
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('organization_id', 'key_hash', name='uq_idempotency_keys_org_key'),
+        db.Index('ix_idempotency_keys_expires', 'expires_at'),
+    )
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key_hash[:12]}>'
+
+class Suppression(db.Model):
+    """Address an organization must not message again"""
+    __tablename__ = 'suppressions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), nullable=False)
+    address = db.Column(db.String(200), nullable=False)  # Canonical email or E.164 phone
+    reason = db.Column(db.String(20), nullable=False)  # unsubscribe, bounce, complaint, manual
+    campaign_id = db.Column(db.Integer, db.ForeignKey('message_campaigns.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('organization_id', 'address', name='uq_suppressions_org_address'),
+        db.Index('ix_suppressions_org_created', 'organization_id', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<Suppression {self.address} ({self.reason})>'
@@ -3,7 +3,12 @@ from app import db
 from models import Organization, User, UserRole, OrganizationInvitation, Contact, Group, Template, OrganizationConfig
 from forms import FormValidator
 from utils import login_required, get_current_user
+from messaging_clients import provider_clients
+from messaging import MessagingService
+from rate_limiter import ORGANIZATION_RATE_COLUMNS
+from fair_share import FAIR_SHARE_MAX_WEIGHT
 import logging
+import math
 
 organizations_bp = Blueprint('organizations', __name__)
 
@@ -146,6 +151,7 @@ def save_all_messaging_config(org_id):
     config.whatsapp_webhook_url = request.form.get('whatsapp_webhook_url', '')
     
     db.session.commit()
+    provider_clients.invalidate(org_id)
     
     flash('All messaging settings saved successfully!', 'success')
     return redirect(url_for('organizations.settings', org_id=org_id))
@@ -346,6 +352,34 @@ def organization_settings(org_id):
         db.session.commit()
     
     if request.method == 'POST':
+        # Send rate limits must be positive; empty keeps the provider's default
+        rate_limits = {}
+        for column in ORGANIZATION_RATE_COLUMNS.values():
+            rate = request.form.get(column, type=float)
+            if request.form.get(column, '').strip() and (rate is None or not math.isfinite(rate) or rate <= 0):
+                flash('Send rate limits must be positive numbers, or empty for the provider default.', 'danger')
+                return render_template('organizations/organization_settings.html',
+                                     organization=organization,
+                                     config=config,
+                                     max_send_weight=FAIR_SHARE_MAX_WEIGHT,
+                                     can_set_send_share=user.is_admin)
+            rate_limits[column] = rate
+        
+        # Send worker share is set by platform admins, within the scheduler's range
+        weight = request.form.get('send_weight', type=int)
+        concurrency_limit = request.form.get('send_concurrency_limit', type=int)
+        invalid_weight = request.form.get('send_weight', '').strip() and (
+            weight is None or not 1 <= weight <= FAIR_SHARE_MAX_WEIGHT)
+        invalid_limit = request.form.get('send_concurrency_limit', '').strip() and (
+            concurrency_limit is None or concurrency_limit < 1)
+        if user.is_admin and (invalid_weight or invalid_limit):
+            flash(f'Send weight must be between 1 and {FAIR_SHARE_MAX_WEIGHT}, and the batch limit at least 1 or empty.', 'danger')
+            return render_template('organizations/organization_settings.html',
+                                 organization=organization,
+                                 config=config,
+                                 max_send_weight=FAIR_SHARE_MAX_WEIGHT,
+                                 can_set_send_share=user.is_admin)
+        
         try:
             # Update SMS settings
             config.sms_provider = request.form.get('sms_provider', 'twilio')
@@ -374,11 +408,21 @@ def organization_settings(org_id):
             config.whatsapp_phone_number = request.form.get('whatsapp_phone_number', '')
             config.whatsapp_webhook_url = request.form.get('whatsapp_webhook_url', '')
             
+            # Send rate limits
+            for column, rate in rate_limits.items():
+                setattr(config, column, rate)
+            
+            # Send worker fair share
+            if user.is_admin:
+                config.send_weight = weight or 1
+                config.send_concurrency_limit = concurrency_limit
+            
             # General settings
             config.default_sender_name = request.form.get('default_sender_name', organization.name)
             config.is_active = 'is_active' in request.form
             
             db.session.commit()
+            provider_clients.invalidate(org_id)
             flash('Settings updated successfully!', 'success')
             return redirect(url_for('organizations.organization_settings', org_id=org_id))
         
@@ -389,7 +433,9 @@ def organization_settings(org_id):
     
     return render_template('organizations/organization_settings.html',
                          organization=organization,
-                         config=config)
+                         config=config,
+                         max_send_weight=FAIR_SHARE_MAX_WEIGHT,
+                         can_set_send_share=user.is_admin)
 
 @organizations_bp.route('/<int:org_id>/invite', methods=['GET', 'POST'])
 @login_required
@@ -536,7 +582,14 @@ def invite_user(org_id):
                 db.session.add(invitation)
                 db.session.commit()
                 
-                # In a real application, you would send an email here
+                # Invitations go out on the transactional lane, ahead of campaigns
+                invite_url = url_for('organizations.accept_invitation', token=invitation.token, _external=True)
+                MessagingService().send_system_email(
+                    form.email,
+                    f'You are invited to join {invitation.organization.name} on ContactHub',
+                    f"Hello,\n\n{user.first_name} invited you to join {invitation.organization.name} "
+                    f"as {form.role}.\n\nAccept the invitation here:\n{invite_url}"
+                )
                 logging.info(f"Invitation created for {form.email} to join organization {org_id}")
                 flash(f'Invitation sent to {form.email}!', 'success')
                 return redirect(url_for('organizations.organization_detail', org_id=org_id))
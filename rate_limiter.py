@@ -0,0 +1,223 @@
+"""
+Send Rate Limiter - Token buckets per provider and per organization
+Keeps sends at each provider's sustainable rate instead of bursting into
+throttling errors. Buckets are shared by every send worker in the process;
+with several processes sending, each takes an equal share of every rate
+(RATE_LIMIT_PROCESSES), so together they stay within the configured limits.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Default sustainable rate per provider: (units per second, what a unit is)
+# 'messages' providers count recipients, 'requests' providers count API calls
+DEFAULT_PROVIDER_LIMITS: Dict[str, Tuple[float, str]] = {
+    'aws_ses': (14.0, 'messages'),
+    'smtp': (20.0, 'messages'),
+    'twilio': (10.0, 'messages'),
+    'twilio_whatsapp': (10.0, 'messages'),
+    'whatsapp': (80.0, 'messages'),
+    'textlocal': (10.0, 'requests'),
+    'msg91': (20.0, 'requests'),
+    'clickatell': (20.0, 'requests'),
+    'custom': (20.0, 'requests')
+}
+
+# OrganizationConfig column holding the per-organization limit of a channel
+ORGANIZATION_RATE_COLUMNS = {
+    'sms': 'sms_rate_limit',
+    'email': 'email_rate_limit',
+    'whatsapp': 'whatsapp_rate_limit'
+}
+
+# Seconds of traffic a bucket may burst above its steady rate
+RATE_LIMIT_BURST_SECONDS = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', '1'))
+
+# Processes running send workers (web processes with in-process dispatch
+# plus standalone workers); every rate is divided among them
+RATE_LIMIT_PROCESSES = max(1, int(os.environ.get('RATE_LIMIT_PROCESSES', '1')))
+
+
+def process_share(rate: Optional[float]) -> Optional[float]:
+    """This process's share of a rate limit; None for no limit"""
+    if not rate or not math.isfinite(rate) or rate <= 0:
+        return None
+    return rate / RATE_LIMIT_PROCESSES
+
+
+def get_provider_limit(provider: str) -> Tuple[Optional[float], str]:
+    """Get the configured rate and unit for a provider, RATE_LIMIT_<PROVIDER> overrides the default"""
+    rate, unit = DEFAULT_PROVIDER_LIMITS.get(provider, (None, 'messages'))
+    override = os.environ.get(f'RATE_LIMIT_{provider.upper()}')
+    if override:
+        rate = float(override)
+    return rate, unit
+
+
+class TokenBucket:
+    """Thread-safe token bucket that lets callers reserve tokens and wait for them"""
+
+    def __init__(self, rate: float, burst_seconds: float = None):
+        self.rate = rate
+        self.capacity = max(1.0, rate * (burst_seconds or RATE_LIMIT_BURST_SECONDS))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float):
+        """Change the refill rate, keeping the tokens already earned"""
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.capacity = max(1.0, rate * RATE_LIMIT_BURST_SECONDS)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def reserve(self, count: float = 1, priority: bool = False, max_wait: float = None) -> Optional[float]:
+        """
+        Take tokens, going into debt if needed
+
+        A priority reservation only waits for its own tokens, not for the
+        debt of earlier callers; those pay it back by waiting longer.
+
+        Returns:
+            Seconds the caller must wait before using the tokens, or None
+            (and no tokens taken) when that is longer than max_wait
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= count
+            if self.tokens >= 0:
+                return 0.0
+            if priority:
+                wait = min(-self.tokens, count) / self.rate
+            else:
+                wait = -self.tokens / self.rate
+            if max_wait is not None and wait > max_wait:
+                self.tokens += count
+                return None
+            return wait
+
+    def drain(self):
+        """Empty the bucket, e.g. after the provider signalled throttling"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """Registry of provider and organization buckets"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._buckets: Dict[tuple, TokenBucket] = {}
+        self._organization_rates: Dict[Tuple[int, str], Optional[float]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lane(self, priority: str):
+        """Mark sends made by this thread as belonging to a priority lane"""
+        previous = getattr(self._local, 'priority', None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def configure_organization(self, config):
+        """Apply the per-channel limits stored on an OrganizationConfig"""
+        if config is None:
+            return
+        for channel, column in ORGANIZATION_RATE_COLUMNS.items():
+            rate = process_share(getattr(config, column, None))
+            key = (config.organization_id, channel)
+            with self._lock:
+                if self._organization_rates.get(key) == rate:
+                    continue
+                self._organization_rates[key] = rate
+                bucket = self._buckets.get(('organization',) + key)
+            if bucket is not None and rate:
+                bucket.set_rate(rate)
+
+    def acquire(self, provider: str, channel: str, organization_id: int = None,
+                messages: int = 1, scope: str = None):
+        """
+        Block until a send of `messages` recipients is allowed
+
+        Args:
+            provider: Provider name, e.g. 'aws_ses', 'twilio', 'textlocal'
+            channel: Channel of the send (sms, email, whatsapp)
+            organization_id: Organization the send is made for
+            messages: Recipients in this provider call
+            scope: Finer provider limit key, e.g. the Twilio sender number
+        """
+        waits = []
+        priority = getattr(self._local, 'priority', None) == 'transactional'
+
+        rate, unit = get_provider_limit(provider)
+        rate = process_share(rate)
+        if rate:
+            bucket = self._get_bucket(('provider', provider, scope), rate)
+            waits.append(bucket.reserve(messages if unit == 'messages' else 1, priority))
+
+        if organization_id is not None:
+            org_rate = self._organization_rates.get((organization_id, channel))
+            if org_rate:
+                bucket = self._get_bucket(('organization', organization_id, channel), org_rate)
+                waits.append(bucket.reserve(messages, priority))
+
+        wait = max(waits, default=0.0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def acquire_campaign(self, campaign_id: int, rate: Optional[float], messages: int = 1,
+                         max_wait: float = None) -> bool:
+        """
+        Block until a campaign with its own send rate may send `messages` more
+
+        Returns:
+            False without waiting when the wait would be longer than max_wait
+        """
+        rate = process_share(rate)
+        if not rate:
+            return True
+        bucket = self._get_bucket(('campaign', campaign_id), rate)
+        if bucket.rate != rate:
+            bucket.set_rate(rate)
+        wait = bucket.reserve(messages, max_wait=max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def throttled(self, provider: str, scope: str = None):
+        """Record a provider throttling response so the next sends slow down"""
+        for key, bucket in list(self._buckets.items()):
+            if key[:2] == ('provider', provider) and (scope is None or key[2] == scope):
+                bucket.drain()
+        self.logger.info(f"Provider {provider} throttled, draining rate buckets")
+
+    def _get_bucket(self, key: tuple, rate: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(rate)
+                    self._buckets[key] = bucket
+        return bucket
+
+
+# Process-wide limiter shared by all send workers
+rate_limiter = RateLimiter()
@@ -0,0 +1,234 @@
+"""
+Send Retry Policy - Error classification, jittered backoff and circuit breakers
+Failures known to happen before the provider accepted the message are
+retried, failures that may have happened after it (read timeouts, dropped
+connections, server errors) are never sent again, permanent ones fail fast,
+and a provider that keeps failing is short-circuited until it recovers
+"""
+
+import os
+import re
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Sequence
+
+from rate_limiter import rate_limiter
+
+# Error classes
+RETRYABLE = 'retryable'
+THROTTLED = 'throttled'
+UNKNOWN = 'unknown'
+PERMANENT = 'permanent'
+
+THROTTLE_PATTERN = re.compile(
+    r'\b429\b|\b20429\b|throttl|too many requests|rate limit|rate exceeded|maximum sending rate',
+    re.IGNORECASE
+)
+# The provider refused or was never reached: sending again cannot duplicate
+RETRYABLE_PATTERN = re.compile(
+    r'HTTP 503|Gateway error: 503|\b503\b|temporarily unavailable|service unavailable|ServiceUnavailable'
+    r'|connect timeout|ConnectTimeout|connection refused|Failed to establish a new connection'
+    r'|Failed to resolve|Name or service not known|Temporary failure in name resolution'
+    r'|Could not connect to the endpoint URL|SMTP Connection failed|\b42[01]\b|\b45[0-2]\b',
+    re.IGNORECASE
+)
+# The request may have reached the provider: it may have been sent already
+UNKNOWN_PATTERN = re.compile(
+    r'HTTP 5\d\d|Gateway error: 5\d\d|\b50[024]\b|timed? ?out|timeout|connection (?:error|reset|aborted)'
+    r'|max retries exceeded|InternalFailure|server disconnected|Connection unexpectedly closed|RemoteDisconnected',
+    re.IGNORECASE
+)
+
+# Retry and circuit breaker tuning
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', '3'))
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', '0.5'))
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', '30'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RECOVERY_SECONDS = float(os.environ.get('CIRCUIT_RECOVERY_SECONDS', '30'))
+
+
+def classify_error(result: Dict[str, Any]) -> str:
+    """Classify a failed send result as throttled, retryable, unknown or permanent"""
+    error = str(result.get('error', ''))
+    if THROTTLE_PATTERN.search(error):
+        return THROTTLED
+    if RETRYABLE_PATTERN.search(error):
+        return RETRYABLE
+    if UNKNOWN_PATTERN.search(error):
+        return UNKNOWN
+    return PERMANENT
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter"""
+
+    def __init__(self, max_attempts: int = None, base_delay: float = None, max_delay: float = None):
+        self.max_attempts = max_attempts or RETRY_MAX_ATTEMPTS
+        self.base_delay = base_delay if base_delay is not None else RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else RETRY_MAX_DELAY
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retry number `attempt` (0-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one provider endpoint"""
+
+    def __init__(self, failure_threshold: int = None, recovery_seconds: float = None):
+        self.failure_threshold = failure_threshold or CIRCUIT_FAILURE_THRESHOLD
+        self.recovery_seconds = recovery_seconds or CIRCUIT_RECOVERY_SECONDS
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.recovery_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Check if a call may go through; lets a single probe through when half-open"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class CircuitBreakerRegistry:
+    """Process-wide circuit breakers keyed by provider endpoint"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker())
+        return breaker
+
+    def states(self) -> Dict[str, str]:
+        """Current state of every known breaker"""
+        return {key: breaker.state for key, breaker in list(self._breakers.items())}
+
+
+circuit_breakers = CircuitBreakerRegistry()
+default_policy = RetryPolicy()
+logger = logging.getLogger(__name__)
+
+
+def circuit_open_result(provider: str) -> Dict[str, Any]:
+    """Failure result for a send skipped because the provider circuit is open"""
+    return {'success': False, 'error': f'Provider {provider} unavailable (circuit open)',
+            'retryable': True, 'circuit_open': True, 'not_sent': True}
+
+
+def send_with_retry(provider: str, send: Callable[[], Dict[str, Any]],
+                    policy: RetryPolicy = None) -> Dict[str, Any]:
+    """
+    Run a single send with retries and the provider's circuit breaker
+
+    Args:
+        provider: Breaker key, e.g. 'aws_ses' or 'custom:<url>'
+        send: Callable performing one provider call and returning a result dict
+
+    Returns:
+        The final result; failures are tagged with 'retryable' (and
+        'not_sent') when sending again is safe, or 'outcome_unknown' when
+        the message may have gone out
+    """
+    return send_batch_with_retry(provider, lambda items: [send()], [None], policy)[0]
+
+
+def send_batch_with_retry(provider: str, send: Callable[[List[Any]], List[Dict[str, Any]]],
+                          items: Sequence[Any], policy: RetryPolicy = None) -> List[Dict[str, Any]]:
+    """
+    Run a batch send, retrying only the items that failed transiently
+
+    Args:
+        provider: Breaker key for the provider endpoint
+        send: Callable sending a list of items and returning one result per item
+        items: Items to send (numbers, addresses, destinations, ...)
+
+    Returns:
+        One result per item, in order
+    """
+    policy = policy or default_policy
+    breaker = circuit_breakers.get(provider)
+    results: List[Dict[str, Any]] = [None] * len(items)
+    pending = list(range(len(items)))
+
+    for attempt in range(policy.max_attempts):
+        if not breaker.allow():
+            for index in pending:
+                results[index] = circuit_open_result(provider)
+            return results
+
+        try:
+            batch_results = send([items[index] for index in pending])
+        except Exception as e:
+            batch_results = [{'success': False, 'error': str(e)} for _ in pending]
+
+        retry = []
+        unknown = 0
+        throttled = False
+        for index, result in zip(pending, batch_results):
+            results[index] = result
+            if result['success']:
+                continue
+            kind = classify_error(result)
+            if kind == PERMANENT:
+                continue
+            if kind == UNKNOWN:
+                result['outcome_unknown'] = True
+                unknown += 1
+                continue
+            result['retryable'] = True
+            result['not_sent'] = True
+            throttled = throttled or kind == THROTTLED
+            retry.append(index)
+
+        # Only a call where everything failed transiently counts against the provider
+        if (retry or unknown) and len(retry) + unknown == len(pending):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        if throttled:
+            rate_limiter.throttled(provider.split(':', 1)[0])
+
+        pending = retry
+        if not pending:
+            break
+        if attempt + 1 < policy.max_attempts:
+            delay = policy.delay(attempt)
+            logger.info(f"Retrying {len(pending)} sends to {provider} in {delay:.2f}s "
+                        f"(attempt {attempt + 2}/{policy.max_attempts})")
+            time.sleep(delay)
+
+    return results
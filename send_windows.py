@@ -0,0 +1,296 @@
+"""
+Recipient-Local Send Windows - Quiet hours for campaign deliveries
+Recipients are bucketed by a timezone derived from their country, state and
+postal code, and each bucket's deliveries are given release slots spread
+evenly across the next allowed local window. The campaign scheduler releases
+the slots as they come due, and send workers check the window again before
+sending, so retries and resumed deliveries never go out in quiet hours.
+"""
+
+import os
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Timezone used when none can be derived from the contact's address
+DEFAULT_RECIPIENT_TIMEZONE = os.environ.get('DEFAULT_RECIPIENT_TIMEZONE', 'UTC')
+
+# Width of one release slot of the scheduler's time wheel
+SEND_WINDOW_SLOT_SECONDS = int(os.environ.get('SEND_WINDOW_SLOT_SECONDS', '60'))
+
+# A window closing sooner than this is skipped in favour of the next one
+SEND_WINDOW_MIN_SPREAD_SECONDS = int(os.environ.get('SEND_WINDOW_MIN_SPREAD_SECONDS', '3600'))
+
+# Fraction of the golden ratio, spreads any number of sends evenly over a window
+GOLDEN_RATIO_FRACTION = 0.6180339887498949
+
+# Country (ISO code or name, lowercase) to its main timezone
+COUNTRY_TIMEZONES = {
+    'us': 'America/New_York', 'usa': 'America/New_York', 'united states': 'America/New_York',
+    'united states of america': 'America/New_York',
+    'ca': 'America/Toronto', 'canada': 'America/Toronto',
+    'mx': 'America/Mexico_City', 'mexico': 'America/Mexico_City',
+    'br': 'America/Sao_Paulo', 'brazil': 'America/Sao_Paulo',
+    'ar': 'America/Argentina/Buenos_Aires', 'argentina': 'America/Argentina/Buenos_Aires',
+    'cl': 'America/Santiago', 'chile': 'America/Santiago',
+    'co': 'America/Bogota', 'colombia': 'America/Bogota',
+    'pe': 'America/Lima', 'peru': 'America/Lima',
+    'gb': 'Europe/London', 'uk': 'Europe/London', 'united kingdom': 'Europe/London',
+    'great britain': 'Europe/London', 'england': 'Europe/London', 'scotland': 'Europe/London',
+    'ie': 'Europe/Dublin', 'ireland': 'Europe/Dublin',
+    'pt': 'Europe/Lisbon', 'portugal': 'Europe/Lisbon',
+    'es': 'Europe/Madrid', 'spain': 'Europe/Madrid',
+    'fr': 'Europe/Paris', 'france': 'Europe/Paris',
+    'be': 'Europe/Brussels', 'belgium': 'Europe/Brussels',
+    'nl': 'Europe/Amsterdam', 'netherlands': 'Europe/Amsterdam',
+    'de': 'Europe/Berlin', 'germany': 'Europe/Berlin',
+    'ch': 'Europe/Zurich', 'switzerland': 'Europe/Zurich',
+    'at': 'Europe/Vienna', 'austria': 'Europe/Vienna',
+    'it': 'Europe/Rome', 'italy': 'Europe/Rome',
+    'dk': 'Europe/Copenhagen', 'denmark': 'Europe/Copenhagen',
+    'se': 'Europe/Stockholm', 'sweden': 'Europe/Stockholm',
+    'no': 'Europe/Oslo', 'norway': 'Europe/Oslo',
+    'fi': 'Europe/Helsinki', 'finland': 'Europe/Helsinki',
+    'pl': 'Europe/Warsaw', 'poland': 'Europe/Warsaw',
+    'cz': 'Europe/Prague', 'czech republic': 'Europe/Prague', 'czechia': 'Europe/Prague',
+    'gr': 'Europe/Athens', 'greece': 'Europe/Athens',
+    'ro': 'Europe/Bucharest', 'romania': 'Europe/Bucharest',
+    'ua': 'Europe/Kyiv', 'ukraine': 'Europe/Kyiv',
+    'tr': 'Europe/Istanbul', 'turkey': 'Europe/Istanbul',
+    'ru': 'Europe/Moscow', 'russia': 'Europe/Moscow',
+    'il': 'Asia/Jerusalem', 'israel': 'Asia/Jerusalem',
+    'eg': 'Africa/Cairo', 'egypt': 'Africa/Cairo',
+    'za': 'Africa/Johannesburg', 'south africa': 'Africa/Johannesburg',
+    'ng': 'Africa/Lagos', 'nigeria': 'Africa/Lagos',
+    'ke': 'Africa/Nairobi', 'kenya': 'Africa/Nairobi',
+    'sa': 'Asia/Riyadh', 'saudi arabia': 'Asia/Riyadh',
+    'ae': 'Asia/Dubai', 'uae': 'Asia/Dubai', 'united arab emirates': 'Asia/Dubai',
+    'qa': 'Asia/Qatar', 'qatar': 'Asia/Qatar',
+    'pk': 'Asia/Karachi', 'pakistan': 'Asia/Karachi',
+    'in': 'Asia/Kolkata', 'india': 'Asia/Kolkata',
+    'lk': 'Asia/Colombo', 'sri lanka': 'Asia/Colombo',
+    'np': 'Asia/Kathmandu', 'nepal': 'Asia/Kathmandu',
+    'bd': 'Asia/Dhaka', 'bangladesh': 'Asia/Dhaka',
+    'th': 'Asia/Bangkok', 'thailand': 'Asia/Bangkok',
+    'vn': 'Asia/Ho_Chi_Minh', 'vietnam': 'Asia/Ho_Chi_Minh',
+    'my': 'Asia/Kuala_Lumpur', 'malaysia': 'Asia/Kuala_Lumpur',
+    'sg': 'Asia/Singapore', 'singapore': 'Asia/Singapore',
+    'id': 'Asia/Jakarta', 'indonesia': 'Asia/Jakarta',
+    'ph': 'Asia/Manila', 'philippines': 'Asia/Manila',
+    'cn': 'Asia/Shanghai', 'china': 'Asia/Shanghai',
+    'hk': 'Asia/Hong_Kong', 'hong kong': 'Asia/Hong_Kong',
+    'tw': 'Asia/Taipei', 'taiwan': 'Asia/Taipei',
+    'kr': 'Asia/Seoul', 'south korea': 'Asia/Seoul', 'korea': 'Asia/Seoul',
+    'jp': 'Asia/Tokyo', 'japan': 'Asia/Tokyo',
+    'au': 'Australia/Sydney', 'australia': 'Australia/Sydney',
+    'nz': 'Pacific/Auckland', 'new zealand': 'Pacific/Auckland'
+}
+
+# Regions (state or province code or name) of countries spanning several timezones
+REGION_TIMEZONES = {
+    'America/New_York': {
+        'ct': 'America/New_York', 'connecticut': 'America/New_York', 'de': 'America/New_York',
+        'delaware': 'America/New_York', 'dc': 'America/New_York', 'fl': 'America/New_York',
+        'florida': 'America/New_York', 'ga': 'America/New_York', 'georgia': 'America/New_York',
+        'in': 'America/Indiana/Indianapolis', 'indiana': 'America/Indiana/Indianapolis',
+        'ky': 'America/New_York', 'kentucky': 'America/New_York', 'me': 'America/New_York',
+        'maine': 'America/New_York', 'md': 'America/New_York', 'maryland': 'America/New_York',
+        'ma': 'America/New_York', 'massachusetts': 'America/New_York', 'mi': 'America/Detroit',
+        'michigan': 'America/Detroit', 'nh': 'America/New_York', 'new hampshire': 'America/New_York',
+        'nj': 'America/New_York', 'new jersey': 'America/New_York', 'ny': 'America/New_York',
+        'new york': 'America/New_York', 'nc': 'America/New_York', 'north carolina': 'America/New_York',
+        'oh': 'America/New_York', 'ohio': 'America/New_York', 'pa': 'America/New_York',
+        'pennsylvania': 'America/New_York', 'ri': 'America/New_York', 'rhode island': 'America/New_York',
+        'sc': 'America/New_York', 'south carolina': 'America/New_York', 'vt': 'America/New_York',
+        'vermont': 'America/New_York', 'va': 'America/New_York', 'virginia': 'America/New_York',
+        'wv': 'America/New_York', 'west virginia': 'America/New_York',
+        'al': 'America/Chicago', 'alabama': 'America/Chicago', 'ar': 'America/Chicago',
+        'arkansas': 'America/Chicago', 'il': 'America/Chicago', 'illinois': 'America/Chicago',
+        'ia': 'America/Chicago', 'iowa': 'America/Chicago', 'ks': 'America/Chicago',
+        'kansas': 'America/Chicago', 'la': 'America/Chicago', 'louisiana': 'America/Chicago',
+        'mn': 'America/Chicago', 'minnesota': 'America/Chicago', 'ms': 'America/Chicago',
+        'mississippi': 'America/Chicago', 'mo': 'America/Chicago', 'missouri': 'America/Chicago',
+        'ne': 'America/Chicago', 'nebraska': 'America/Chicago', 'nd': 'America/Chicago',
+        'north dakota': 'America/Chicago', 'ok': 'America/Chicago', 'oklahoma': 'America/Chicago',
+        'sd': 'America/Chicago', 'south dakota': 'America/Chicago', 'tn': 'America/Chicago',
+        'tennessee': 'America/Chicago', 'tx': 'America/Chicago', 'texas': 'America/Chicago',
+        'wi': 'America/Chicago', 'wisconsin': 'America/Chicago',
+        'az': 'America/Phoenix', 'arizona': 'America/Phoenix', 'co': 'America/Denver',
+        'colorado': 'America/Denver', 'id': 'America/Boise', 'idaho': 'America/Boise',
+        'mt': 'America/Denver', 'montana': 'America/Denver', 'nm': 'America/Denver',
+        'new mexico': 'America/Denver', 'ut': 'America/Denver', 'utah': 'America/Denver',
+        'wy': 'America/Denver', 'wyoming': 'America/Denver',
+        'ca': 'America/Los_Angeles', 'california': 'America/Los_Angeles', 'nv': 'America/Los_Angeles',
+        'nevada': 'America/Los_Angeles', 'or': 'America/Los_Angeles', 'oregon': 'America/Los_Angeles',
+        'wa': 'America/Los_Angeles', 'washington': 'America/Los_Angeles',
+        'ak': 'America/Anchorage', 'alaska': 'America/Anchorage', 'hi': 'Pacific/Honolulu',
+        'hawaii': 'Pacific/Honolulu', 'pr': 'America/Puerto_Rico', 'puerto rico': 'America/Puerto_Rico'
+    },
+    'America/Toronto': {
+        'bc': 'America/Vancouver', 'british columbia': 'America/Vancouver',
+        'ab': 'America/Edmonton', 'alberta': 'America/Edmonton',
+        'sk': 'America/Regina', 'saskatchewan': 'America/Regina',
+        'mb': 'America/Winnipeg', 'manitoba': 'America/Winnipeg',
+        'on': 'America/Toronto', 'ontario': 'America/Toronto',
+        'qc': 'America/Toronto', 'quebec': 'America/Toronto',
+        'nb': 'America/Halifax', 'new brunswick': 'America/Halifax',
+        'ns': 'America/Halifax', 'nova scotia': 'America/Halifax',
+        'pe': 'America/Halifax', 'prince edward island': 'America/Halifax',
+        'nl': 'America/St_Johns', 'newfoundland and labrador': 'America/St_Johns',
+        'yt': 'America/Whitehorse', 'yukon': 'America/Whitehorse',
+        'nt': 'America/Yellowknife', 'northwest territories': 'America/Yellowknife'
+    },
+    'Australia/Sydney': {
+        'nsw': 'Australia/Sydney', 'new south wales': 'Australia/Sydney',
+        'act': 'Australia/Sydney', 'vic': 'Australia/Melbourne', 'victoria': 'Australia/Melbourne',
+        'qld': 'Australia/Brisbane', 'queensland': 'Australia/Brisbane',
+        'sa': 'Australia/Adelaide', 'south australia': 'Australia/Adelaide',
+        'wa': 'Australia/Perth', 'western australia': 'Australia/Perth',
+        'tas': 'Australia/Hobart', 'tasmania': 'Australia/Hobart',
+        'nt': 'Australia/Darwin', 'northern territory': 'Australia/Darwin'
+    },
+    'America/Sao_Paulo': {
+        'am': 'America/Manaus', 'amazonas': 'America/Manaus',
+        'mt': 'America/Cuiaba', 'mato grosso': 'America/Cuiaba',
+        'ba': 'America/Bahia', 'bahia': 'America/Bahia',
+        'pe': 'America/Recife', 'pernambuco': 'America/Recife'
+    }
+}
+
+# US ZIP code prefix ranges (first three digits) to timezone, for contacts without a state
+US_ZIP_TIMEZONES = (
+    (995, 999, 'America/Anchorage'),
+    (967, 968, 'Pacific/Honolulu'),
+    (900, 994, 'America/Los_Angeles'),
+    (889, 898, 'America/Los_Angeles'),
+    (850, 865, 'America/Phoenix'),
+    (800, 884, 'America/Denver'),
+    (500, 799, 'America/Chicago'),
+    (0, 499, 'America/New_York')
+)
+
+
+def derive_timezone(country: Optional[str], state: Optional[str] = None,
+                    postal_code: Optional[str] = None) -> str:
+    """Best-effort IANA timezone of a contact from their address"""
+    return _derive_timezone(
+        (country or '').strip().lower(),
+        (state or '').strip().lower(),
+        (postal_code or '').strip()
+    )
+
+
+@lru_cache(maxsize=4096)
+def _derive_timezone(country: str, state: str, postal_code: str) -> str:
+    country_tz = COUNTRY_TIMEZONES.get(country)
+    if country_tz is None:
+        return DEFAULT_RECIPIENT_TIMEZONE
+
+    regions = REGION_TIMEZONES.get(country_tz)
+    if regions and state in regions:
+        return regions[state]
+
+    if country_tz == 'America/New_York' and postal_code[:3].isdigit():
+        prefix = int(postal_code[:3])
+        for low, high, zone in US_ZIP_TIMEZONES:
+            if low <= prefix <= high:
+                return zone
+
+    return country_tz
+
+
+@lru_cache(maxsize=512)
+def _zone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo('UTC')
+
+
+def next_window(zone_name: str, start: time, end: time, after: datetime) -> Tuple[datetime, datetime]:
+    """
+    Next local send window of a timezone, as naive UTC datetimes
+
+    Windows ending before `after` plus the minimum spread are skipped;
+    windows with start later than end run over midnight.
+
+    Returns:
+        (opening, closing) with opening no earlier than `after`
+    """
+    zone = _zone(zone_name)
+    utc = ZoneInfo('UTC')
+    local_after = after.replace(tzinfo=utc).astimezone(zone)
+    min_spread = timedelta(seconds=SEND_WINDOW_MIN_SPREAD_SECONDS)
+
+    for day_offset in (-1, 0, 1, 2):
+        day = local_after.date() + timedelta(days=day_offset)
+        opening = datetime.combine(day, start, tzinfo=zone)
+        closing = datetime.combine(day if end > start else day + timedelta(days=1), end, tzinfo=zone)
+        opening_utc = opening.astimezone(utc).replace(tzinfo=None)
+        closing_utc = closing.astimezone(utc).replace(tzinfo=None)
+        begin = max(opening_utc, after)
+        if closing_utc - begin >= min(min_spread, closing_utc - opening_utc):
+            return begin, closing_utc
+
+    return after, after
+
+
+def in_window(zone_name: Optional[str], start: time, end: time, at: datetime) -> bool:
+    """Check if naive UTC `at` falls inside a timezone's local send window"""
+    local = at.replace(tzinfo=ZoneInfo('UTC')).astimezone(_zone(zone_name or DEFAULT_RECIPIENT_TIMEZONE)).time()
+    if start < end:
+        return start <= local < end
+    return local >= start or local < end
+
+
+def _slot(opening: datetime, closing: datetime, index: int) -> datetime:
+    """
+    Release time of the index-th send of a window
+
+    Successive indexes are placed at golden-ratio offsets, which keeps any
+    number of them evenly spread over the window without knowing how many
+    there are in advance.
+    """
+    span = (closing - opening).total_seconds()
+    offset = (index * GOLDEN_RATIO_FRACTION) % 1.0 * span
+    release_at = opening + timedelta(seconds=offset)
+
+    # Round down to the time wheel slot, staying inside the window
+    slot = SEND_WINDOW_SLOT_SECONDS
+    epoch_seconds = int((release_at - datetime(1970, 1, 1)).total_seconds())
+    return max(opening, datetime(1970, 1, 1) + timedelta(seconds=epoch_seconds - epoch_seconds % slot))
+
+
+def next_window_slot(zone_name: Optional[str], start: time, end: time, after: datetime, index: int) -> datetime:
+    """Release slot in the next local window for a delivery that reached a worker outside it"""
+    opening, closing = next_window(zone_name or DEFAULT_RECIPIENT_TIMEZONE, start, end, after)
+    return _slot(opening, closing, index)
+
+
+class SendWindowPlanner:
+    """Assigns each recipient a release slot inside their next local window"""
+
+    def __init__(self, start: time, end: time, not_before: datetime):
+        self.start = start
+        self.end = end
+        self.not_before = not_before
+        self._windows: Dict[str, Tuple[datetime, datetime]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def plan(self, country: Optional[str], state: Optional[str] = None,
+             postal_code: Optional[str] = None) -> Tuple[str, datetime]:
+        """
+        Timezone bucket and release time of the next recipient, spread with
+        the other recipients of the bucket over its window
+        """
+        zone_name = derive_timezone(country, state, postal_code)
+        window = self._windows.get(zone_name)
+        if window is None:
+            window = next_window(zone_name, self.start, self.end, self.not_before)
+            self._windows[zone_name] = window
+
+        index = self._counts.get(zone_name, 0)
+        self._counts[zone_name] = index + 1
+
+        return zone_name, _slot(*window, index)
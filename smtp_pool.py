@@ -0,0 +1,181 @@
+"""
+SMTP Connection Pool - Reusable authenticated SMTP sessions for bulk email
+Sessions are keyed by (host, port, username, TLS mode) and recycled after a
+number of messages or a period of idleness
+"""
+
+import os
+import time
+import atexit
+import smtplib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+# Pool tuning, overridable through the environment
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', '8'))
+SMTP_POOL_MAX_MESSAGES = int(os.environ.get('SMTP_POOL_MAX_MESSAGES', '100'))
+SMTP_POOL_IDLE_SECONDS = float(os.environ.get('SMTP_POOL_IDLE_SECONDS', '60'))
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))
+
+
+def get_tls_mode(use_tls: bool = True, use_ssl: bool = False) -> str:
+    """Map SMTP security flags to a pool TLS mode"""
+    if use_ssl:
+        return 'ssl'
+    return 'starttls' if use_tls else 'plain'
+
+
+class SMTPConnectionFailed(smtplib.SMTPException):
+    """Opening a session failed before any message was sent"""
+
+
+class PooledSMTPConnection:
+    """An authenticated SMTP session with usage bookkeeping"""
+
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.message_count = 0
+        self.last_used = time.monotonic()
+
+    def is_expired(self, max_messages: int, idle_seconds: float) -> bool:
+        """Check if the session should be recycled instead of reused"""
+        return (self.message_count >= max_messages or
+                time.monotonic() - self.last_used > idle_seconds)
+
+    def is_alive(self) -> bool:
+        """Check with NOOP that the server has not dropped the session"""
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self):
+        """Close the session, ignoring errors from dead connections"""
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """Thread-safe pool of SMTP sessions shared by all send workers"""
+
+    def __init__(self, max_size: int = None, max_messages: int = None,
+                 idle_seconds: float = None, timeout: float = None):
+        self.max_size = max_size or SMTP_POOL_SIZE
+        self.max_messages = max_messages or SMTP_POOL_MAX_MESSAGES
+        self.idle_seconds = idle_seconds or SMTP_POOL_IDLE_SECONDS
+        self.timeout = timeout or SMTP_TIMEOUT
+        self.logger = logging.getLogger(__name__)
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def send(self, host: str, port: int, username: Optional[str], password: Optional[str],
+             tls_mode: str, from_addr: str, to_addrs: Union[str, List[str]],
+             msg: str) -> Dict[str, Tuple[int, bytes]]:
+        """
+        Send a message over a pooled session
+
+        A reused session is checked with NOOP first and replaced if the
+        server dropped it while it was idle; errors during the send itself
+        are raised to the caller, as the message may already be accepted.
+
+        Returns:
+            The refused-recipients dict from smtplib.SMTP.sendmail
+        """
+        key = (host, int(port), username or '', tls_mode)
+
+        with self._get_slot(key):
+            conn = self._acquire(key, password)
+            try:
+                refused = conn.server.sendmail(from_addr, to_addrs, msg)
+            except smtplib.SMTPRecipientsRefused:
+                # The session is still healthy, only the address was rejected
+                conn.last_used = time.monotonic()
+                self._release(key, conn)
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+            conn.message_count += 1
+            conn.last_used = time.monotonic()
+            self._release(key, conn)
+            return refused
+
+    def close_all(self):
+        """Close every idle session"""
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle = {}
+        for conn in idle:
+            conn.close()
+
+    def _get_slot(self, key) -> threading.BoundedSemaphore:
+        """Get the semaphore that caps open sessions for a key"""
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_size)
+                self._slots[key] = slot
+            return slot
+
+    def _acquire(self, key, password: Optional[str]) -> PooledSMTPConnection:
+        """Reuse an idle session for the key or open a new one"""
+        while True:
+            with self._lock:
+                conns = self._idle.get(key)
+                conn = conns.pop() if conns else None
+            if conn is None:
+                return self._connect(key, password)
+            if conn.is_expired(self.max_messages, self.idle_seconds) or not conn.is_alive():
+                conn.close()
+                continue
+            return conn
+
+    def _release(self, key, conn: PooledSMTPConnection):
+        """Return a session to the pool, or recycle it once it is used up"""
+        if conn.message_count >= self.max_messages:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def _connect(self, key, password: Optional[str]) -> PooledSMTPConnection:
+        """Open and authenticate a new SMTP session"""
+        host, port, username, tls_mode = key
+
+        server = None
+        try:
+            if tls_mode == 'ssl':
+                server = smtplib.SMTP_SSL(host, port, timeout=self.timeout)
+            else:
+                server = smtplib.SMTP(host, port, timeout=self.timeout)
+                if tls_mode == 'starttls':
+                    server.starttls()
+        except (smtplib.SMTPException, OSError) as e:
+            if server is not None:
+                server.close()
+            # Nothing was sent yet, so the retry policy may try again
+            raise SMTPConnectionFailed(f'SMTP Connection failed: {e}') from e
+
+        try:
+            if username and password:
+                server.login(username, password)
+        except Exception:
+            server.close()
+            raise
+
+        return PooledSMTPConnection(server)
+
+
+# Process-wide pool shared by MessagingService and SMTPEmailClient
+smtp_pool = SMTPConnectionPool()
+
+# Say QUIT to servers on shutdown instead of dropping idle sessions
+atexit.register(smtp_pool.close_all)
@@ -0,0 +1,273 @@
+"""
+Suppression List - Addresses an organization must not message again
+Unsubscribes and the recipients of bounced deliveries are stored per
+organization in the suppressions table. Send workers test each recipient
+against an in-memory Bloom filter of the organization's suppressions,
+refreshed incrementally and rebuilt periodically, and only query the table
+for the few addresses the filter reports as possible matches. Every email
+carries a signed unsubscribe link that feeds the table.
+"""
+
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Set
+from urllib.parse import urlsplit
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import MessageCampaign, MessageDelivery, Suppression
+from campaign_metrics import increment_campaign_counters
+
+# Seconds before a worker picks up suppressions added by other processes
+SUPPRESSION_REFRESH_SECONDS = float(os.environ.get('SUPPRESSION_REFRESH_SECONDS', '5'))
+
+# Refreshes re-read suppressions created this long before the previous one,
+# so rows committed late by slow transactions are not missed
+SUPPRESSION_REFRESH_OVERLAP_SECONDS = float(os.environ.get('SUPPRESSION_REFRESH_OVERLAP_SECONDS', '60'))
+
+# Seconds after which a worker rebuilds a filter from the whole table
+SUPPRESSION_REBUILD_SECONDS = float(os.environ.get('SUPPRESSION_REBUILD_SECONDS', '600'))
+
+# Target false positive rate of the Bloom filters
+SUPPRESSION_FALSE_POSITIVE_RATE = float(os.environ.get('SUPPRESSION_FALSE_POSITIVE_RATE', '0.01'))
+
+# Reasons an address is suppressed
+SUPPRESSION_REASONS = ('unsubscribe', 'bounce', 'complaint', 'manual')
+
+# Public address of the app (e.g. https://contacts.example.com), used for
+# unsubscribe links in messages sent by background workers
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', '')
+
+# Deliveries read per transaction by the bounce backfill
+SUPPRESSION_BACKFILL_BATCH_SIZE = int(os.environ.get('SUPPRESSION_BACKFILL_BATCH_SIZE', '1000'))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        self.capacity = max(1000, capacity)
+        self.size = max(1024, int(-self.capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class _OrganizationFilter:
+    def __init__(self, bloom: BloomFilter):
+        self.bloom = bloom
+        self.loaded_at = None  # Wall clock of the last load, compared with created_at
+        self.refreshed = 0.0
+        self.built = time.monotonic()
+
+
+class SuppressionList:
+    """Per-organization suppressions with a Bloom filter in front of the table"""
+
+    def __init__(self, refresh_seconds: float = None, false_positive_rate: float = None):
+        self.refresh_seconds = refresh_seconds or SUPPRESSION_REFRESH_SECONDS
+        self.false_positive_rate = false_positive_rate or SUPPRESSION_FALSE_POSITIVE_RATE
+        self._filters: Dict[int, _OrganizationFilter] = {}
+        self._lock = threading.Lock()
+
+    def _filter(self, organization_id: int) -> _OrganizationFilter:
+        """The organization's filter, loading suppressions added since the last refresh"""
+        with self._lock:
+            entry = self._filters.get(organization_id)
+            if entry is not None and time.monotonic() - entry.refreshed < self.refresh_seconds:
+                return entry
+
+        started = datetime.utcnow()
+        full = entry is None or time.monotonic() - entry.built >= SUPPRESSION_REBUILD_SECONDS
+        rows = self._load(organization_id, None if full else
+                          entry.loaded_at - timedelta(seconds=SUPPRESSION_REFRESH_OVERLAP_SECONDS))
+        if not full and entry.bloom.count + len(rows) > entry.bloom.capacity:
+            # Rebuild with room to grow once the filter would pass its capacity
+            full = True
+            rows = self._load(organization_id, None)
+
+        with self._lock:
+            if full:
+                entry = _OrganizationFilter(BloomFilter(len(rows) * 2, self.false_positive_rate))
+            for row in rows:
+                # Overlapping refreshes see rows again; count them once
+                if row.address not in entry.bloom:
+                    entry.bloom.add(row.address)
+            entry.loaded_at = started
+            entry.refreshed = time.monotonic()
+            self._filters[organization_id] = entry
+        return entry
+
+    def _load(self, organization_id: int, created_since: Optional[datetime]):
+        query = db.session.query(Suppression.address).filter(Suppression.organization_id == organization_id)
+        if created_since is not None:
+            query = query.filter(Suppression.created_at >= created_since)
+        return query.all()
+
+    def suppressed_addresses(self, organization_id: int, addresses: Iterable[str]) -> Set[str]:
+        """
+        The addresses among `addresses` that are suppressed
+
+        Needs an app context. Addresses the filter rules out never reach the
+        database; possible matches are confirmed with a single query.
+        """
+        bloom = self._filter(organization_id).bloom
+        candidates = {address for address in addresses if address and address in bloom}
+        if not candidates:
+            return set()
+        rows = db.session.query(Suppression.address).filter(
+            Suppression.organization_id == organization_id,
+            Suppression.address.in_(candidates)
+        ).all()
+        return {row.address for row in rows}
+
+    def suppress(self, organization_id: int, address: str, reason: str,
+                 campaign_id: Optional[int] = None) -> bool:
+        """
+        Add an address to the organization's suppressions in the current transaction
+
+        Returns:
+            True if the address was not suppressed before
+        """
+        if not address:
+            return False
+        if reason not in SUPPRESSION_REASONS:
+            raise ValueError(f'Unknown suppression reason: {reason}')
+        if Suppression.query.filter_by(organization_id=organization_id, address=address).first():
+            return False
+        try:
+            with db.session.begin_nested():
+                db.session.add(Suppression(
+                    organization_id=organization_id, address=address, reason=reason, campaign_id=campaign_id
+                ))
+        except IntegrityError:
+            return False
+
+        # This process sees its own additions at once, others on their next refresh
+        with self._lock:
+            entry = self._filters.get(organization_id)
+            if entry is not None:
+                entry.bloom.add(address)
+        return True
+
+
+suppression_list = SuppressionList()
+
+
+def _unsubscribe_serializer() -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.secret_key, salt='unsubscribe')
+
+
+def unsubscribe_token(delivery_id: int) -> str:
+    """Signed token for a delivery's unsubscribe link, so links cannot be forged for other recipients"""
+    return _unsubscribe_serializer().dumps(delivery_id)
+
+
+def unsubscribe_url(delivery_id: int) -> Optional[str]:
+    """
+    Absolute unsubscribe link of a delivery; needs an app context
+
+    Built from PUBLIC_BASE_URL since send workers have no request to take
+    the host from. None when it is not configured.
+    """
+    if not PUBLIC_BASE_URL:
+        return None
+    base = urlsplit(PUBLIC_BASE_URL)
+    adapter = current_app.url_map.bind(base.netloc, script_name=base.path or '/', url_scheme=base.scheme or 'https')
+    return adapter.build('analytics.unsubscribe', {'token': unsubscribe_token(delivery_id)}, force_external=True)
+
+
+def add_unsubscribe_link(content: str, url: Optional[str]) -> str:
+    """Append an unsubscribe footer to an email body, HTML or plain text"""
+    if not url:
+        return content
+    if '<' in content:
+        return f'{content}\n<p style="font-size:12px;color:#888"><a href="{url}">Unsubscribe</a></p>'
+    return f'{content}\n\nUnsubscribe: {url}'
+
+
+def unsubscribe_headers(url: Optional[str]) -> Dict[str, str]:
+    """List-Unsubscribe headers for an email, so mail clients can offer one-click unsubscribe"""
+    if not url:
+        return {}
+    return {'List-Unsubscribe': f'<{url}>', 'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click'}
+
+
+def delivery_for_unsubscribe_token(token: str) -> Optional[MessageDelivery]:
+    """The delivery an unsubscribe token was issued for, or None if the token is invalid"""
+    try:
+        delivery_id = _unsubscribe_serializer().loads(token)
+    except BadSignature:
+        return None
+    return db.session.get(MessageDelivery, delivery_id)
+
+
+def record_unsubscribe(delivery: MessageDelivery) -> bool:
+    """Suppress the recipient of a delivery who unsubscribed and count it on the campaign"""
+    added = suppression_list.suppress(delivery.organization_id, delivery.recipient, 'unsubscribe', delivery.campaign_id)
+    if added:
+        increment_campaign_counters(delivery.campaign_id, {'unsubscribes': 1})
+    db.session.commit()
+    return added
+
+
+def backfill_bounce_suppressions(batch_size: int = None) -> int:
+    """
+    Suppress the recipients of deliveries that bounced before bounces were
+    suppressed, in id order and bounded batches; safe to re-run
+
+    Must run inside an app context.
+
+    Returns:
+        Number of addresses added
+    """
+    batch_size = batch_size or SUPPRESSION_BACKFILL_BATCH_SIZE
+    last_id = 0
+    added = 0
+    while True:
+        rows = db.session.query(
+            MessageDelivery.id, MessageDelivery.recipient, MessageDelivery.campaign_id,
+            MessageCampaign.organization_id
+        ).join(MessageCampaign, MessageCampaign.id == MessageDelivery.campaign_id).filter(
+            MessageDelivery.status == 'bounced',
+            MessageDelivery.id > last_id
+        ).order_by(MessageDelivery.id).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            if suppression_list.suppress(row.organization_id, row.recipient, 'bounce', row.campaign_id):
+                added += 1
+        db.session.commit()
+        last_id = rows[-1].id
+    return added
+
+
+if __name__ == "__main__":
+    import main  # noqa: F401 - registers routes before the app is used
+    from app import app
+
+    with app.app_context():
+        logging.info("Suppressing recipients of bounced deliveries")
+        count = backfill_bounce_suppressions()
+        logging.info(f"Suppressed {count} addresses")
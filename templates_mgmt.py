@@ -1,12 +1,17 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
 from app import db
-from models import Template, Organization, User, Contact
+from models import Template, Organization, User, Contact, MessageCampaign
 from forms import TemplateForm
 from utils import login_required, get_current_user, get_current_organization
 from messaging import MessagingService
+from campaign_controls import pause_campaign, resume_campaign, cancel_campaign, set_campaign_rate
+from idempotency import idempotency_keys, request_fingerprint
+from campaign_metrics import campaign_counter_totals
 import logging
 import json
 import os
+import uuid
+from datetime import datetime
 
 templates_bp = Blueprint('templates', __name__)
 
@@ -290,18 +295,67 @@ def send_message():
                 if name.strip() and value.strip():
                     custom_variables[name.strip()] = value.strip()
             
+            # Optional start time (UTC)
+            scheduled_at = None
+            scheduled_at_str = request.form.get('scheduled_at', '').strip()
+            if scheduled_at_str:
+                try:
+                    scheduled_at = datetime.strptime(scheduled_at_str, '%Y-%m-%dT%H:%M')
+                except ValueError:
+                    flash('Invalid schedule time.', 'error')
+                    return redirect(url_for('templates.send_message'))
+            
+            # Optional recipient-local send window (quiet hours outside it)
+            send_window = None
+            window_start = request.form.get('send_window_start', '').strip()
+            window_end = request.form.get('send_window_end', '').strip()
+            if window_start or window_end:
+                try:
+                    send_window = (datetime.strptime(window_start, '%H:%M').time(),
+                                   datetime.strptime(window_end, '%H:%M').time())
+                except ValueError:
+                    flash('Please enter both send window times.', 'error')
+                    return redirect(url_for('templates.send_message'))
+                if send_window[0] == send_window[1]:
+                    flash('Send window start and end must differ.', 'error')
+                    return redirect(url_for('templates.send_message'))
+            
             # Initialize messaging service and send
             messaging_service = MessagingService()
-            results = messaging_service.send_message(
-                template_id=int(template_id),
-                contact_ids=contact_ids,
-                custom_variables=custom_variables,
-                organization_id=organization.id
-            )
+            
+            def send():
+                return messaging_service.send_message(
+                    template_id=int(template_id),
+                    contact_ids=contact_ids,
+                    custom_variables=custom_variables,
+                    organization_id=organization.id,
+                    scheduled_at=scheduled_at,
+                    send_window=send_window
+                )
+            
+            # A resubmitted form or retried request with the same key is not sent again
+            idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+            if idempotency_key:
+                fingerprint = request_fingerprint({
+                    'template_id': int(template_id),
+                    'contact_ids': contact_ids,
+                    'custom_variables': custom_variables,
+                    'scheduled_at': scheduled_at,
+                    'send_window': send_window
+                })
+                results = idempotency_keys.run(organization.id, idempotency_key, fingerprint, send)
+                if results.get('conflict'):
+                    flash(results['error'], 'error')
+                    return redirect(url_for('templates.send_message'))
+            else:
+                results = send()
             
             # Flash result message
-            if results.get('success'):
-                flash(f'Message processed: {results.get("sent", 0)} sent, {results.get("failed", 0)} failed.', 'success')
+            duplicates = f' ({results["collapsed"]} duplicate addresses skipped)' if results.get('collapsed') else ''
+            if results.get('success') and results.get('status') == 'scheduled':
+                flash(f'Message scheduled for {results.get("queued", 0)} contacts{duplicates}.', 'success')
+            elif results.get('success'):
+                flash(f'Message queued for {results.get("queued", 0)} contacts{duplicates}.', 'success')
             else:
                 flash(f'Error processing messages: {results.get("error", "Unknown error")}', 'error')
             
@@ -323,7 +377,63 @@ def send_message():
     return render_template('messaging/send_message.html', 
                          templates=templates,
                          contacts=contacts,
-                         selected_template_id=selected_template_id)
+                         selected_template_id=selected_template_id,
+                         idempotency_key=uuid.uuid4().hex)
+
+
+@templates_bp.route('/campaigns/<int:campaign_id>/progress')
+@login_required
+def campaign_progress(campaign_id):
+    """Poll delivery progress of a dispatched campaign"""
+    organization = get_current_organization()
+    if not organization:
+        return jsonify({'success': False, 'error': 'No active organization'}), 403
+    
+    campaign = MessageCampaign.query.filter_by(id=campaign_id, organization_id=organization.id).first_or_404()
+    counters = campaign_counter_totals([campaign.id])[campaign.id]
+    
+    return jsonify({
+        'success': True,
+        'campaign_id': campaign.id,
+        'status': campaign.status,
+        'send_rate': campaign.send_rate,
+        'recipient_count': campaign.recipient_count,
+        'sent': counters['messages_sent'],
+        'failed': counters['messages_failed'],
+        'checkpoint_contact_id': campaign.checkpoint_contact_id,
+        'checkpoint_at': campaign.checkpoint_at.isoformat() if campaign.checkpoint_at else None,
+        'completed_at': campaign.completed_at.isoformat() if campaign.completed_at else None
+    })
+
+
+@templates_bp.route('/campaigns/<int:campaign_id>/<action>', methods=['POST'])
+@login_required
+def campaign_control(campaign_id, action):
+    """Pause, resume, cancel or change the send rate of a campaign"""
+    organization = get_current_organization()
+    if not organization:
+        return jsonify({'success': False, 'error': 'No active organization'}), 403
+    
+    campaign = MessageCampaign.query.filter_by(id=campaign_id, organization_id=organization.id).first_or_404()
+    
+    if action == 'pause':
+        result = pause_campaign(campaign)
+    elif action == 'resume':
+        result = resume_campaign(campaign)
+    elif action == 'cancel':
+        result = cancel_campaign(campaign)
+    elif action == 'rate':
+        data = request.get_json(silent=True) or request.form
+        send_rate = data.get('send_rate')
+        try:
+            send_rate = float(send_rate) if send_rate not in (None, '') else None
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Invalid send rate'}), 400
+        result = set_campaign_rate(campaign, send_rate)
+    else:
+        return jsonify({'success': False, 'error': f'Unknown action: {action}'}), 404
+    
+    return jsonify(result), 200 if result.get('success') else 400
 
 
 @templates_bp.route('/test-email', methods=['POST'])
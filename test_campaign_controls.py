@@ -0,0 +1,72 @@
+"""
+Tests for pausing, resuming, cancelling and throttling campaigns
+"""
+
+import pytest
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from campaign_controls import cancel_campaign, pause_campaign, resume_campaign, set_campaign_rate
+from models import MessageCampaign, MessageDelivery
+
+
+def delivery_statuses(campaign):
+    return sorted(d.status for d in MessageDelivery.query.filter_by(campaign_id=campaign.id))
+
+
+def change_behind_its_back(campaign, status):
+    """Another process changes the campaign after this one read it"""
+    read = campaign.status
+    db.session.execute(db.update(MessageCampaign).where(MessageCampaign.id == campaign.id).values(status=status)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+    set_committed_value(campaign, 'status', read)
+
+
+def test_pause_and_resume_move_queued_deliveries(queue_campaign):
+    campaign = queue_campaign(3)
+
+    result = pause_campaign(campaign)
+    assert result['success'] and result['status'] == 'paused' and result['held'] == 3
+    assert delivery_statuses(campaign) == ['paused'] * 3
+
+    result = resume_campaign(campaign)
+    assert result['success'] and result['status'] == 'sending' and result['released'] == 3
+    assert delivery_statuses(campaign) == ['queued'] * 3
+
+
+def test_pause_does_not_overwrite_a_campaign_completed_meanwhile(queue_campaign):
+    campaign = queue_campaign(3)
+    assert campaign.status == 'sending'
+    change_behind_its_back(campaign, 'completed')
+
+    result = pause_campaign(campaign)
+
+    assert not result['success']
+    assert db.session.get(MessageCampaign, campaign.id).status == 'completed'
+    assert delivery_statuses(campaign) == ['queued'] * 3
+
+
+def test_cancel_cancels_unsent_deliveries(queue_campaign):
+    campaign = queue_campaign(3)
+
+    result = cancel_campaign(campaign)
+
+    assert result['success'] and result['cancelled'] == 3
+    assert campaign.completed_at is not None
+    assert not cancel_campaign(campaign)['success']
+
+
+@pytest.mark.parametrize('rate', [0, -1, float('inf'), float('-inf'), float('nan')])
+def test_invalid_send_rates_are_rejected(queue_campaign, rate):
+    campaign = queue_campaign(1)
+
+    assert not set_campaign_rate(campaign, rate)['success']
+    assert db.session.get(MessageCampaign, campaign.id).send_rate is None
+
+
+def test_send_rate_can_be_set_and_removed(queue_campaign):
+    campaign = queue_campaign(1)
+
+    assert set_campaign_rate(campaign, 2.5)['send_rate'] == 2.5
+    assert set_campaign_rate(campaign, None)['send_rate'] is None
@@ -0,0 +1,78 @@
+"""
+Tests for starting scheduled campaigns and the scheduler's wait
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import campaign_scheduler
+from app import db
+from campaign_scheduler import CampaignScheduler
+from models import MessageCampaign, MessageDelivery
+
+
+@pytest.fixture
+def scheduler(app, monkeypatch):
+    monkeypatch.setattr(campaign_scheduler, 'SCHEDULER_MIN_SLEEP_SECONDS', 1)
+    return CampaignScheduler(max_sleep=15)
+
+
+def delivery_statuses(campaign):
+    return sorted(d.status for d in MessageDelivery.query.filter_by(campaign_id=campaign.id))
+
+
+def test_due_campaigns_are_started_once(queue_campaign, scheduler):
+    campaign = queue_campaign(3, scheduled_at=datetime.utcnow() + timedelta(hours=1))
+    assert campaign.status == 'scheduled'
+    assert delivery_statuses(campaign) == ['scheduled'] * 3
+
+    assert scheduler.run_once() == 15
+    assert campaign.status == 'scheduled'
+
+    campaign.scheduled_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    scheduler.run_once()
+
+    db.session.refresh(campaign)
+    assert campaign.status == 'sending' and campaign.sent_at
+    assert delivery_statuses(campaign) == ['queued'] * 3
+    assert not scheduler.start_campaign(campaign.id)
+
+
+def test_wait_until_the_next_scheduled_start(queue_campaign, scheduler):
+    queue_campaign(1, scheduled_at=datetime.utcnow() + timedelta(seconds=5))
+
+    assert 3 < scheduler.run_once() <= 5
+
+
+def test_overdue_slots_of_a_paused_campaign_do_not_spin_the_loop(queue_campaign, scheduler):
+    campaign = queue_campaign(2)
+    db.session.execute(db.update(MessageDelivery).where(MessageDelivery.campaign_id == campaign.id).values(
+        status='scheduled', next_attempt_at=datetime.utcnow() - timedelta(minutes=5)))
+    campaign.status = 'paused'
+    db.session.commit()
+
+    assert scheduler.run_once() == 15
+    assert delivery_statuses(campaign) == ['scheduled'] * 2
+
+
+def test_wait_never_drops_below_the_floor(queue_campaign, scheduler):
+    campaign = queue_campaign(1)
+    db.session.execute(db.update(MessageDelivery).values(
+        status='scheduled', next_attempt_at=datetime.utcnow() + timedelta(milliseconds=10)))
+    db.session.commit()
+
+    assert scheduler.run_once() == 1
+    db.session.refresh(campaign)
+    assert campaign.status == 'sending'
+
+
+def test_drained_campaigns_are_completed(queue_campaign, scheduler):
+    campaign = queue_campaign(2)
+    db.session.execute(db.update(MessageDelivery).values(status='sent', sent_at=datetime.utcnow()))
+    db.session.commit()
+
+    scheduler.run_once()
+
+    assert db.session.get(MessageCampaign, campaign.id).status == 'completed'
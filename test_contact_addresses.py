@@ -0,0 +1,59 @@
+"""
+Tests for email and phone address normalization
+"""
+
+import pytest
+
+import contact_addresses
+from contact_addresses import canonical_email, gateway_number, normalize_phone, phone_key
+
+
+@pytest.mark.parametrize('email, expected', [
+    ('  Ada@Example.COM ', 'ada@example.com'),
+    ('', None),
+    (None, None),
+    ('not-an-email', None),
+])
+def test_canonical_email(email, expected):
+    assert canonical_email(email) == expected
+
+
+@pytest.mark.parametrize('phone, country, expected', [
+    ('+1 (555) 010-0001', None, '+15550100001'),
+    ('0044 20 7946 0958', None, '+442079460958'),
+    ('020 7946 0958', 'UK', '+442079460958'),
+    ('98765 43210', 'India', '+919876543210'),
+    ('91 98765 43210', 'in', '+919876543210'),
+    ('06 1234 5678', 'it', '+390612345678'),
+    ('555 01', 'us', None),
+    ('+1234567890123456', None, None),
+    ('', 'us', None),
+    (None, None, None),
+])
+def test_normalize_phone(phone, country, expected):
+    assert normalize_phone(phone, country) == expected
+
+
+def test_numbers_without_a_country_need_a_default_code(monkeypatch):
+    contact_addresses._normalize_phone.cache_clear()
+    assert normalize_phone('555 010 0001') is None
+
+    monkeypatch.setattr(contact_addresses, 'DEFAULT_PHONE_COUNTRY_CODE', '1')
+    contact_addresses._normalize_phone.cache_clear()
+    assert normalize_phone('555 010 0001') == '+15550100001'
+    contact_addresses._normalize_phone.cache_clear()
+
+
+def test_phone_key_falls_back_to_digits():
+    assert phone_key('+1 555 010 0001') == phone_key('001-555-010-0001') == '+15550100001'
+    assert phone_key('ext. 1234') == '1234'
+    assert phone_key('n/a') is None
+
+
+@pytest.mark.parametrize('number, expected', [
+    ('+15550100001', '15550100001'),
+    ('+1 555 010 0001', '15550100001'),
+    ('5550100001', '5550100001'),
+])
+def test_gateway_number(number, expected):
+    assert gateway_number(number) == expected
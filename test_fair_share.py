@@ -0,0 +1,107 @@
+"""
+Tests for deficit round-robin scheduling across organizations
+"""
+
+from collections import Counter
+
+import pytest
+
+import fair_share
+from fair_share import FairShareQueue, send_concurrency_limit, send_weight
+from app import db
+from models import OrganizationConfig
+
+
+@pytest.fixture
+def due_organizations(monkeypatch):
+    due = []
+    monkeypatch.setattr(fair_share, 'organizations_with_due_work', lambda channel, priority: list(due))
+    return due
+
+
+@pytest.fixture
+def configs(app):
+    """Add OrganizationConfig rows with configs.add(...)"""
+    class Configs:
+        def add(self, *rows):
+            db.session.add_all(rows)
+            db.session.commit()
+
+    return Configs()
+
+
+def config(organization_id, weight=1, limit=None):
+    return OrganizationConfig(organization_id=organization_id, send_weight=weight, send_concurrency_limit=limit)
+
+
+@pytest.mark.parametrize('weight, expected', [(None, 1), (0, 1), (-5, 1), (3, 3), (10_000, 10)])
+def test_send_weight_is_clamped(weight, expected, monkeypatch):
+    monkeypatch.setattr(fair_share, 'FAIR_SHARE_MAX_WEIGHT', 10)
+    assert send_weight(config(1, weight)) == expected
+    assert send_weight(None) == 1
+
+
+@pytest.mark.parametrize('limit, expected', [(None, None), (0, None), (-1, None), (1, 1), (4, 4)])
+def test_invalid_concurrency_limits_mean_no_cap(limit, expected):
+    assert send_concurrency_limit(config(1, limit=limit)) == expected
+
+
+def serve(queue, turns, max_batch=100):
+    served = Counter()
+    for _ in range(turns):
+        org, batch = queue.acquire(max_batch)
+        served[org] += batch
+        queue.release(org, batch, batch)
+    return served
+
+
+def test_batches_follow_send_weight(due_organizations, configs):
+    due_organizations.extend([1, 2])
+    configs.add(config(1, weight=3), config(2, weight=1))
+    queue = FairShareQueue('sms', 'normal', quantum=10)
+
+    served = serve(queue, 40)
+
+    assert served[1] == 3 * served[2]
+
+
+def test_weights_above_the_maximum_are_capped(due_organizations, configs, monkeypatch):
+    monkeypatch.setattr(fair_share, 'FAIR_SHARE_MAX_WEIGHT', 2)
+    due_organizations.extend([1, 2])
+    configs.add(config(1, weight=1000), config(2, weight=1))
+    queue = FairShareQueue('sms', 'normal', quantum=10)
+
+    served = serve(queue, 30)
+
+    assert served[1] == 2 * served[2]
+
+
+def test_large_quanta_are_split_into_batches(due_organizations, configs):
+    due_organizations.append(1)
+    queue = FairShareQueue('sms', 'normal', quantum=250)
+
+    assert [queue.acquire(100)[1] for _ in range(3)] == [100, 100, 50]
+
+
+def test_concurrency_limit_skips_busy_organizations(due_organizations, configs):
+    due_organizations.extend([1, 2])
+    configs.add(config(1, limit=1), config(2))
+    queue = FairShareQueue('sms', 'normal', quantum=10)
+
+    assert queue.acquire(100) == (1, 10)
+    assert queue.acquire(100) == (2, 10)
+    assert queue.acquire(100) == (2, 10)
+
+    queue.release(1, 10, 10)
+    assert queue.acquire(100)[0] == 1
+
+
+def test_organizations_without_work_leave_the_ring(due_organizations, configs):
+    due_organizations.extend([1, 2])
+    queue = FairShareQueue('sms', 'normal', quantum=10, refresh_seconds=3600)
+
+    org, batch = queue.acquire(100)
+    queue.release(org, batch, 0)
+    due_organizations.remove(org)
+
+    assert {queue.acquire(100)[0] for _ in range(3)} == {2}
@@ -0,0 +1,109 @@
+"""
+Tests for Idempotency-Key replay, conflicts and takeover
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import idempotency
+from app import db
+from idempotency import KEY_IN_PROGRESS, KEY_REUSED, IdempotencyStore, request_fingerprint
+from models import IdempotencyKey
+
+
+@pytest.fixture
+def store(organization):
+    return IdempotencyStore()
+
+
+class Sender:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.results.pop(0)
+
+
+def test_fingerprint_ignores_key_order():
+    assert request_fingerprint({'a': 1, 'b': 2}) == request_fingerprint({'b': 2, 'a': 1})
+    assert request_fingerprint({'a': 1}) != request_fingerprint({'a': 2})
+
+
+def test_successful_result_is_replayed(organization, store):
+    send = Sender({'success': True, 'campaign_id': 7})
+
+    assert store.run(organization.id, 'key-1', 'f', send) == {'success': True, 'campaign_id': 7}
+    assert store.run(organization.id, 'key-1', 'f', send) == {'success': True, 'campaign_id': 7,
+                                                              'idempotent_replay': True}
+    assert send.calls == 1
+
+    # Another process without the cached result replays it from the table
+    assert IdempotencyStore().run(organization.id, 'key-1', 'f', send)['idempotent_replay']
+    assert send.calls == 1
+
+
+def test_key_reused_for_a_different_request_is_refused(organization, store):
+    store.run(organization.id, 'key-1', 'f', Sender({'success': True}))
+
+    assert store.run(organization.id, 'key-1', 'other', Sender())['error'] == KEY_REUSED
+    assert IdempotencyStore().run(organization.id, 'key-1', 'other', Sender())['error'] == KEY_REUSED
+
+
+def test_keys_are_scoped_to_an_organization(organization, store):
+    send = Sender({'success': True}, {'success': True})
+    store.run(organization.id, 'key-1', 'f', send)
+    store.run(organization.id + 1, 'key-1', 'f', send)
+    assert send.calls == 2
+
+
+def test_failed_send_gives_the_key_up(organization, store):
+    send = Sender({'success': False, 'error': 'Template not found'}, {'success': True})
+
+    assert not store.run(organization.id, 'key-1', 'f', send)['success']
+    assert store.run(organization.id, 'key-1', 'f', send) == {'success': True}
+    assert send.calls == 2
+
+
+def test_send_that_raises_gives_the_key_up(organization, store):
+    def crash():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        store.run(organization.id, 'key-1', 'f', crash)
+    assert IdempotencyKey.query.count() == 0
+
+
+def test_request_in_progress_is_refused(organization, store):
+    def duplicate():
+        assert IdempotencyStore().run(organization.id, 'key-1', 'f', Sender())['error'] == KEY_IN_PROGRESS
+        return {'success': True}
+
+    assert store.run(organization.id, 'key-1', 'f', duplicate) == {'success': True}
+
+
+def test_stale_reservation_is_taken_over(organization, store):
+    old = datetime.utcnow() - timedelta(seconds=idempotency.IDEMPOTENCY_IN_PROGRESS_SECONDS + 1)
+    db.session.add(IdempotencyKey(organization_id=organization.id, key_hash=idempotency._digest('key-1'),
+                                  request_hash='f', reserved_at=old, expires_at=old + timedelta(days=1)))
+    db.session.commit()
+
+    send = Sender({'success': True})
+    assert store.run(organization.id, 'key-1', 'f', send) == {'success': True}
+    assert send.calls == 1
+    assert IdempotencyKey.query.one().response is not None
+
+
+def test_expired_keys_are_purged(organization, store):
+    store.run(organization.id, 'key-1', 'f', Sender({'success': True}))
+    IdempotencyKey.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+    assert store.purge_expired() == 1
+
+
+@pytest.mark.parametrize('key', ['', 'k' * 256])
+def test_invalid_keys_are_rejected(organization, store, key):
+    assert not store.run(organization.id, key, 'f', Sender())['success']
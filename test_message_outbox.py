@@ -0,0 +1,115 @@
+"""
+Tests for claiming, renewing and recording outbox deliveries
+"""
+
+from datetime import datetime, timedelta
+
+from app import db
+from models import MessageDelivery
+import message_outbox
+from message_outbox import (
+    claim_batch, next_release_at, record_results, release_due_slots, release_stale_claims, renew_claims
+)
+
+
+def statuses(campaign):
+    return {d.id: d.status for d in MessageDelivery.query.filter_by(campaign_id=campaign.id)}
+
+
+def test_claimers_never_share_deliveries(queue_campaign):
+    campaign = queue_campaign(10)
+
+    first = claim_batch('sms', 'normal', 6, 'host:1:a')
+    second = claim_batch('sms', 'normal', 6, 'host:2:b')
+
+    assert len(first) == 6 and len(second) == 4
+    assert not {d.id for d in first} & {d.id for d in second}
+    assert set(statuses(campaign).values()) == {'sending'}
+    assert claim_batch('sms', 'normal', 6, 'host:3:c') == []
+
+
+def test_claims_only_take_one_organizations_rows_when_asked(queue_campaign, organization):
+    queue_campaign(3)
+
+    assert claim_batch('sms', 'normal', 10, 'host:1:a', organization_id=organization.id + 1) == []
+    assert len(claim_batch('sms', 'normal', 10, 'host:1:a', organization_id=organization.id)) == 3
+
+
+def test_stale_claim_loses_ownership(queue_campaign):
+    queue_campaign(3)
+    batch = claim_batch('sms', 'normal', 3, 'host:1:a')
+    token = batch[0].claimed_by
+
+    db.session.execute(db.update(MessageDelivery).values(claimed_at=datetime.utcnow() - timedelta(hours=1)))
+    db.session.commit()
+    assert release_stale_claims(lease_seconds=60) == 3
+
+    assert renew_claims(token, [d.id for d in batch]) == set()
+    taken = claim_batch('sms', 'normal', 3, 'host:2:b')
+    assert [d.id for d in taken] == [d.id for d in batch]
+
+    # The first worker's late results must not overwrite the new claim
+    assert record_results(token, [(d, {'success': True}) for d in batch]) == {}
+    db.session.commit()
+    assert {d.status for d in MessageDelivery.query} == {'sending'}
+    assert {d.claimed_by for d in MessageDelivery.query} == {taken[0].claimed_by}
+
+
+def test_renewal_extends_only_owned_claims(queue_campaign):
+    queue_campaign(2)
+    batch = claim_batch('sms', 'normal', 2, 'host:1:a')
+    token = batch[0].claimed_by
+    later = datetime.utcnow() + timedelta(minutes=5)
+
+    assert renew_claims(token, [d.id for d in batch], later) == {d.id for d in batch}
+    assert renew_claims('host:9:z:other', [d.id for d in batch]) == set()
+    db.session.commit()
+    assert {d.claimed_at for d in MessageDelivery.query} == {later}
+
+
+def test_results_requeue_only_deliveries_that_were_not_sent(queue_campaign):
+    campaign = queue_campaign(4)
+    batch = claim_batch('sms', 'normal', 4, 'host:1:a')
+    token = batch[0].claimed_by
+
+    recorded = record_results(token, zip(batch, [
+        {'success': True, 'message_id': 'm-1'},
+        {'success': False, 'error': 'HTTP 503', 'retryable': True, 'not_sent': True},
+        {'success': False, 'error': 'Read timed out', 'outcome_unknown': True},
+        {'success': False, 'error': 'HTTP 400: Invalid number'},
+    ]))
+    db.session.commit()
+
+    assert list(recorded.values()) == ['sent', 'queued', 'failed', 'failed']
+    rows = {d.id: d for d in MessageDelivery.query.filter_by(campaign_id=campaign.id)}
+    sent, retried, unknown, rejected = (rows[d.id] for d in batch)
+    assert sent.message_id == 'm-1' and sent.sent_at and sent.claimed_by is None
+    assert retried.error_code == 'retryable' and retried.next_attempt_at > datetime.utcnow()
+    assert unknown.error_code == 'unknown'
+    assert rejected.error_code is None and rejected.error_message == 'HTTP 400: Invalid number'
+
+
+def test_retryable_failures_stop_after_the_attempt_budget(queue_campaign, monkeypatch):
+    monkeypatch.setattr(message_outbox, 'OUTBOX_MAX_ATTEMPTS', 1)
+    queue_campaign(1)
+    batch = claim_batch('sms', 'normal', 1, 'host:1:a')
+
+    recorded = record_results(batch[0].claimed_by, [(batch[0], {'success': False, 'error': 'x', 'retryable': True})])
+    assert list(recorded.values()) == ['failed']
+
+
+def test_send_window_slots_of_paused_campaigns_are_ignored(queue_campaign):
+    running = queue_campaign(2)
+    paused = queue_campaign(2)
+    soon = datetime.utcnow() + timedelta(minutes=10)
+    overdue = datetime.utcnow() - timedelta(minutes=10)
+    db.session.execute(db.update(MessageDelivery).where(MessageDelivery.campaign_id == running.id).values(
+        status='scheduled', next_attempt_at=soon))
+    db.session.execute(db.update(MessageDelivery).where(MessageDelivery.campaign_id == paused.id).values(
+        status='scheduled', next_attempt_at=overdue))
+    paused.status = 'paused'
+    db.session.commit()
+
+    assert next_release_at() == soon
+    assert release_due_slots() == 0
+    assert release_due_slots(soon) == 2
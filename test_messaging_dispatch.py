@@ -0,0 +1,137 @@
+"""
+Tests for sending claimed outbox batches
+"""
+
+import pytest
+
+import messaging_dispatch
+from app import db
+from campaign_controls import campaign_states, pause_campaign
+from messaging import MessagingService
+from messaging_dispatch import CampaignDispatcher
+from models import MessageCampaign, MessageDelivery
+from rate_limiter import RateLimiter
+from suppression_list import SuppressionList
+
+
+class FakeProvider:
+    """Stands in for MessagingService.deliver_batch"""
+
+    def __init__(self):
+        self.batches = []
+        self.on_send = None
+
+    def __call__(self, template, contacts, custom_variables=None, config=None, unsubscribe_urls=None):
+        self.batches.append([contact.id for contact in contacts])
+        if self.on_send:
+            self.on_send()
+        return [{'success': True, 'message_id': f'm-{contact.id}'} for contact in contacts]
+
+
+@pytest.fixture
+def provider(app, monkeypatch):
+    provider = FakeProvider()
+    monkeypatch.setattr(MessagingService, 'deliver_batch', lambda service, *args: provider(*args))
+    monkeypatch.setattr(messaging_dispatch, 'rate_limiter', RateLimiter())
+    monkeypatch.setattr(messaging_dispatch, 'suppression_list', SuppressionList())
+    monkeypatch.setattr(messaging_dispatch.time, 'sleep', lambda seconds: None)
+    campaign_states.invalidate()
+    return provider
+
+
+@pytest.fixture
+def dispatcher(provider):
+    return CampaignDispatcher(batch_size=50)
+
+
+def delivery_statuses(campaign):
+    return sorted(d.status for d in MessageDelivery.query.filter_by(campaign_id=campaign.id))
+
+
+def test_batch_is_sent_recorded_and_completed(queue_campaign, dispatcher, provider):
+    campaign = queue_campaign(5)
+
+    assert dispatcher.process_batch('sms') == 5
+
+    assert len(provider.batches) == 1 and len(provider.batches[0]) == 5
+    assert delivery_statuses(campaign) == ['sent'] * 5
+    campaign = db.session.get(MessageCampaign, campaign.id)
+    assert campaign.status == 'completed' and campaign.messages_sent == 5
+
+
+def test_campaign_far_behind_its_rate_is_left_queued(queue_campaign, dispatcher, provider):
+    campaign = queue_campaign(3)
+    campaign.send_rate = 1.0
+    db.session.commit()
+    # Sends by other workers put the campaign's bucket more than half a lease in debt
+    messaging_dispatch.rate_limiter.acquire_campaign(campaign.id, 1.0, messaging_dispatch.OUTBOX_LEASE_SECONDS)
+
+    assert dispatcher.process_batch('sms') == 3
+
+    assert provider.batches == []
+    assert delivery_statuses(campaign) == ['queued'] * 3
+    assert {d.claimed_by for d in MessageDelivery.query} == {None}
+
+
+def test_throttled_campaign_sends_one_second_slices(queue_campaign, dispatcher, provider):
+    campaign = queue_campaign(5)
+    campaign.send_rate = 2.0
+    db.session.commit()
+
+    dispatcher.process_batch('sms')
+
+    assert [len(batch) for batch in provider.batches] == [2, 2, 1]
+    assert delivery_statuses(campaign) == ['sent'] * 5
+
+
+@pytest.mark.parametrize('rate', [float('inf'), float('nan'), 0.0])
+def test_invalid_stored_rate_sends_without_a_limit(queue_campaign, dispatcher, provider, rate):
+    campaign = queue_campaign(4)
+    db.session.execute(db.update(MessageCampaign).values(send_rate=rate))
+    db.session.commit()
+
+    dispatcher.process_batch('sms')
+
+    assert [len(batch) for batch in provider.batches] == [4]
+    assert delivery_statuses(campaign) == ['sent'] * 4
+
+
+def test_pause_between_slices_holds_the_rest(queue_campaign, dispatcher, provider):
+    campaign = queue_campaign(4)
+    campaign.send_rate = 1.0
+    db.session.commit()
+
+    def pause_after_second_slice():
+        if len(provider.batches) == 2:
+            assert pause_campaign(db.session.get(MessageCampaign, campaign.id))['success']
+
+    provider.on_send = pause_after_second_slice
+    dispatcher.process_batch('sms')
+
+    assert len(provider.batches) == 2
+    assert delivery_statuses(campaign) == ['paused', 'paused', 'sent', 'sent']
+
+
+def test_suppressed_recipients_are_skipped(queue_campaign, dispatcher, provider, organization):
+    campaign = queue_campaign(3)
+    skipped = MessageDelivery.query.filter_by(campaign_id=campaign.id).order_by(MessageDelivery.id).first()
+    messaging_dispatch.suppression_list.suppress(organization.id, skipped.recipient, 'manual')
+    db.session.commit()
+
+    dispatcher.process_batch('sms')
+
+    assert skipped.contact_id not in provider.batches[0] and len(provider.batches[0]) == 2
+    assert delivery_statuses(campaign) == ['sent', 'sent', 'suppressed']
+
+
+def test_lost_claims_are_not_sent(queue_campaign, dispatcher, provider, monkeypatch):
+    campaign = queue_campaign(3)
+
+    def renew_nothing(token, delivery_ids, now=None):
+        return set()
+
+    monkeypatch.setattr(messaging_dispatch, 'renew_claims', renew_nothing)
+    dispatcher.process_batch('sms')
+
+    assert provider.batches == []
+    assert delivery_statuses(campaign) == ['sending'] * 3
@@ -0,0 +1,98 @@
+"""
+Tests for the token bucket rate limiter
+"""
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket, process_share
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock.monotonic)
+    return clock
+
+
+def test_bucket_starts_full_and_refills_at_its_rate(clock):
+    bucket = TokenBucket(10.0, burst_seconds=1)
+
+    assert bucket.reserve(10) == 0.0
+    assert bucket.reserve(5) == pytest.approx(0.5)
+
+    # 1 second refills 10 tokens: the 5 owed plus 5 available
+    clock.now += 1
+    assert bucket.reserve(5) == 0.0
+    assert bucket.tokens == pytest.approx(0.0)
+
+
+def test_bucket_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(2.0, burst_seconds=1)
+    clock.now += 60
+
+    assert bucket.reserve(2) == 0.0
+    assert bucket.reserve(1) == pytest.approx(0.5)
+
+
+def test_priority_reservation_waits_only_for_its_own_tokens(clock):
+    bucket = TokenBucket(1.0, burst_seconds=1)
+    bucket.reserve(1)
+    assert bucket.reserve(10) == pytest.approx(10.0)
+
+    assert bucket.reserve(1, priority=True) == pytest.approx(1.0)
+
+
+def test_reservation_longer_than_max_wait_takes_no_tokens(clock):
+    bucket = TokenBucket(1.0, burst_seconds=1)
+    bucket.reserve(1)
+
+    assert bucket.reserve(5, max_wait=2) is None
+    assert bucket.tokens == pytest.approx(0.0)
+    assert bucket.reserve(2, max_wait=2) == pytest.approx(2.0)
+
+
+def test_drain_empties_the_bucket_but_keeps_debt(clock):
+    bucket = TokenBucket(4.0, burst_seconds=1)
+    bucket.drain()
+    assert bucket.reserve(1) == pytest.approx(0.25)
+
+    bucket.drain()
+    assert bucket.tokens == pytest.approx(-1.0)
+
+
+@pytest.mark.parametrize('rate', [None, 0, -1, float('inf'), float('nan')])
+def test_process_share_ignores_rates_that_are_not_positive_and_finite(rate):
+    assert process_share(rate) is None
+
+
+def test_process_share_splits_rates_between_processes(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMIT_PROCESSES', 4)
+    assert process_share(20.0) == pytest.approx(5.0)
+
+
+def test_campaign_acquire_refuses_waits_over_max_wait(clock, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rate_limiter.time, 'sleep', sleeps.append)
+    limiter = RateLimiter()
+
+    assert limiter.acquire_campaign(7, 1.0, 1, max_wait=5)
+    assert limiter.acquire_campaign(7, 1.0, 3, max_wait=5)
+    assert not limiter.acquire_campaign(7, 1.0, 10, max_wait=5)
+    assert sleeps == [pytest.approx(3.0)]
+
+
+def test_campaign_acquire_without_a_valid_rate_never_waits(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'sleep', pytest.fail)
+    limiter = RateLimiter()
+
+    assert limiter.acquire_campaign(7, float('inf'), 10_000, max_wait=0)
+    assert limiter.acquire_campaign(7, None, 10_000, max_wait=0)
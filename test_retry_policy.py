@@ -0,0 +1,94 @@
+"""
+Tests for send error classification, retries and circuit breakers
+"""
+
+import pytest
+
+import retry_policy
+from retry_policy import (
+    PERMANENT, RETRYABLE, THROTTLED, UNKNOWN, CircuitBreakerRegistry, RetryPolicy,
+    classify_error, send_batch_with_retry
+)
+
+
+@pytest.mark.parametrize('error, kind', [
+    # Refused or never reached: safe to send again
+    ("HTTPSConnectionPool(host='api.example', port=443): Max retries exceeded with url: /send "
+     "(Caused by NewConnectionError('Failed to establish a new connection: [Errno 111] Connection refused'))", RETRYABLE),
+    ("HTTPSConnectionPool(host='api.example', port=443): Max retries exceeded with url: /send "
+     "(Caused by ConnectTimeoutError('Connection to api.example timed out. (connect timeout=5)'))", RETRYABLE),
+    ('HTTP 503: Service Unavailable', RETRYABLE),
+    ('Connect timeout on endpoint URL: "https://email.us-east-1.amazonaws.com/"', RETRYABLE),
+    ('SMTP Connection failed: [Errno 111] Connection refused', RETRYABLE),
+    ("(451, b'4.3.0 Temporary local problem')", RETRYABLE),
+    ('HTTP 429: Too Many Requests', THROTTLED),
+    ('Throttling: Maximum sending rate exceeded.', THROTTLED),
+    # May have reached the provider: must not be sent again
+    ("HTTPSConnectionPool(host='api.example', port=443): Read timed out. (read timeout=30)", UNKNOWN),
+    ("('Connection aborted.', RemoteDisconnected('Remote end closed connection without response'))", UNKNOWN),
+    ('Read timeout on endpoint URL: "https://email.us-east-1.amazonaws.com/"', UNKNOWN),
+    ('HTTP 500: Internal Server Error', UNKNOWN),
+    ('HTTP 504: Gateway Timeout', UNKNOWN),
+    ('timed out', UNKNOWN),
+    ('Connection unexpectedly closed', UNKNOWN),
+    # Rejected outright
+    ('HTTP 400: Invalid phone number', PERMANENT),
+    ('MessageRejected: Email address is not verified.', PERMANENT),
+])
+def test_classify_error(error, kind):
+    assert classify_error({'success': False, 'error': error}) == kind
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(retry_policy.time, 'sleep', lambda seconds: None)
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    registry = CircuitBreakerRegistry()
+    monkeypatch.setattr(retry_policy, 'circuit_breakers', registry)
+    return registry
+
+
+def test_only_retryable_items_are_sent_again(no_sleep, breakers):
+    calls = []
+
+    def send(items):
+        calls.append(list(items))
+        return [
+            {'success': True} if len(calls) > 1 else
+            {'success': False, 'error': {'a': 'HTTP 503: busy', 'b': 'HTTP 400: bad', 'c': 'Read timed out'}[item]}
+            for item in items
+        ]
+
+    results = send_batch_with_retry('gateway', send, ['a', 'b', 'c'], RetryPolicy(max_attempts=3))
+
+    assert calls == [['a', 'b', 'c'], ['a']]
+    assert results[0] == {'success': True}
+    assert not results[1]['success'] and 'retryable' not in results[1]
+    assert results[2]['outcome_unknown'] and 'retryable' not in results[2] and 'not_sent' not in results[2]
+
+
+def test_retryable_failures_are_marked_not_sent(no_sleep, breakers):
+    results = send_batch_with_retry(
+        'gateway', lambda items: [{'success': False, 'error': 'Connection refused'} for _ in items],
+        ['a'], RetryPolicy(max_attempts=2)
+    )
+    assert results[0]['retryable'] and results[0]['not_sent']
+
+
+def test_breaker_opens_after_repeated_transient_failures(no_sleep, breakers):
+    calls = []
+
+    def send(items):
+        calls.append(items)
+        return [{'success': False, 'error': 'Read timed out'} for _ in items]
+
+    for _ in range(retry_policy.CIRCUIT_FAILURE_THRESHOLD):
+        send_batch_with_retry('gateway', send, ['a'])
+    assert breakers.states() == {'gateway': 'open'}
+
+    results = send_batch_with_retry('gateway', send, ['a'])
+    assert len(calls) == retry_policy.CIRCUIT_FAILURE_THRESHOLD
+    assert results[0]['circuit_open'] and results[0]['not_sent']
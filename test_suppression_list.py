@@ -0,0 +1,91 @@
+"""
+Tests for the Bloom-filtered suppression list
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import suppression_list
+from app import db
+from models import Suppression
+from message_outbox import claim_batch
+from suppression_list import BloomFilter, SuppressionList
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(1000, 0.01)
+    members = [f'member{i}@example.com' for i in range(1000)]
+    for member in members:
+        bloom.add(member)
+
+    assert all(member in bloom for member in members)
+    false_positives = sum(f'other{i}@example.com' in bloom for i in range(10_000))
+    assert false_positives < 300
+
+
+@pytest.fixture
+def suppressions(organization):
+    return SuppressionList(refresh_seconds=3600)
+
+
+def test_only_suppressed_addresses_are_reported(organization, suppressions):
+    assert suppressions.suppress(organization.id, 'gone@example.com', 'unsubscribe')
+    assert not suppressions.suppress(organization.id, 'gone@example.com', 'bounce')
+    db.session.commit()
+
+    found = suppressions.suppressed_addresses(organization.id, ['gone@example.com', 'here@example.com', None])
+    assert found == {'gone@example.com'}
+    assert suppressions.suppressed_addresses(organization.id + 1, ['gone@example.com']) == set()
+
+
+def test_unknown_reasons_are_rejected(organization, suppressions):
+    with pytest.raises(ValueError):
+        suppressions.suppress(organization.id, 'gone@example.com', 'spite')
+
+
+def test_rows_added_by_other_processes_are_picked_up_on_refresh(organization, suppressions, monkeypatch):
+    assert suppressions.suppressed_addresses(organization.id, ['+15550100001']) == set()
+
+    # Committed late by another worker, with a created_at before this filter's last load
+    db.session.add(Suppression(organization_id=organization.id, address='+15550100001', reason='bounce',
+                               created_at=datetime.utcnow() - timedelta(seconds=30)))
+    db.session.commit()
+    assert suppressions.suppressed_addresses(organization.id, ['+15550100001']) == set()
+
+    suppressions.refresh_seconds = 0
+    assert suppressions.suppressed_addresses(organization.id, ['+15550100001']) == {'+15550100001'}
+
+
+def test_filter_is_rebuilt_when_it_outgrows_its_capacity(organization, suppressions):
+    suppressions.refresh_seconds = 0
+    suppressions.suppressed_addresses(organization.id, ['x'])
+    capacity = suppressions._filters[organization.id].bloom.capacity
+
+    now = datetime.utcnow()
+    db.session.add_all([Suppression(organization_id=organization.id, address=f'{i}@example.com', reason='manual',
+                                    created_at=now) for i in range(capacity + 1)])
+    db.session.commit()
+
+    assert suppressions.suppressed_addresses(organization.id, ['0@example.com', f'{capacity}@example.com']) == {
+        '0@example.com', f'{capacity}@example.com'}
+    assert suppressions._filters[organization.id].bloom.capacity > capacity
+
+
+def test_unsubscribe_tokens_round_trip(queue_campaign):
+    queue_campaign(1)
+    delivery = claim_batch('sms', 'normal', 1, 'host:1:a')[0]
+    token = suppression_list.unsubscribe_token(delivery.id)
+
+    assert suppression_list.delivery_for_unsubscribe_token(token).id == delivery.id
+    assert suppression_list.delivery_for_unsubscribe_token(token + 'x') is None
+
+
+def test_unsubscribing_suppresses_the_recipient_once(queue_campaign, monkeypatch):
+    monkeypatch.setattr(suppression_list, 'suppression_list', SuppressionList(refresh_seconds=0))
+    campaign = queue_campaign(1)
+    delivery = campaign.deliveries[0]
+
+    assert suppression_list.record_unsubscribe(delivery)
+    assert not suppression_list.record_unsubscribe(delivery)
+    assert Suppression.query.one().address == delivery.recipient
@@ -0,0 +1,194 @@
+"""
+Tracking Buffer - Batched ingestion of email open and click events
+Tracking hits only append to an in-process buffer; a background flusher
+writes them in batches: one conditional UPDATE of opened_at / clicked_at
+per event kind and one counter increment per campaign. Only the first open
+or click of a delivery is counted, even across processes. Events of failed
+flushes are retried a few times, and hits arriving while the buffer is full
+are dropped, so a database outage never grows the buffer without bound or
+blocks tracking requests.
+"""
+
+import os
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from app import db
+from models import MessageDelivery
+from campaign_metrics import CounterBatch
+
+# Seconds between flushes of buffered events
+TRACKING_FLUSH_SECONDS = float(os.environ.get('TRACKING_FLUSH_SECONDS', '1'))
+
+# Buffered events that trigger an early flush
+TRACKING_FLUSH_SIZE = int(os.environ.get('TRACKING_FLUSH_SIZE', '1000'))
+
+# Buffered events above which new hits are dropped until a flush succeeds
+TRACKING_BUFFER_LIMIT = int(os.environ.get('TRACKING_BUFFER_LIMIT', '100000'))
+
+# Flushes an event is part of before it is dropped
+TRACKING_MAX_FLUSH_ATTEMPTS = int(os.environ.get('TRACKING_MAX_FLUSH_ATTEMPTS', '3'))
+
+# Largest id of the message_deliveries integer primary key
+MAX_DELIVERY_ID = 2 ** 31 - 1
+
+# Event kind -> (delivery timestamp column, campaign counter column)
+TRACKED_EVENTS = {
+    'open': ('opened_at', 'messages_opened'),
+    'click': ('clicked_at', 'messages_clicked')
+}
+
+
+class TrackingBuffer:
+    """Process-wide buffer of tracking events with a background flusher"""
+
+    def __init__(self, flush_seconds: float = None, flush_size: int = None):
+        self.flush_seconds = flush_seconds or TRACKING_FLUSH_SECONDS
+        self.flush_size = flush_size or TRACKING_FLUSH_SIZE
+        self.logger = logging.getLogger(__name__)
+        self._events: List[Tuple[str, int, int]] = []  # (kind, delivery id, failed flushes)
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._app = None
+
+    def start(self, app):
+        """Start (once) the background flusher"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._loop, name='tracking-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.shutdown)
+
+    def record(self, kind: str, delivery_id: int):
+        """Buffer an 'open' or 'click' of a delivery, or drop it while the buffer is full"""
+        if kind not in TRACKED_EVENTS:
+            raise ValueError(f'Unknown tracking event: {kind}')
+        with self._lock:
+            pending = len(self._events)
+            if pending >= TRACKING_BUFFER_LIMIT:
+                self._dropped += 1
+            else:
+                self._events.append((kind, delivery_id, 0))
+                pending += 1
+        if pending >= self.flush_size:
+            self._wakeup.set()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            with self._app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    db.session.rollback()
+                    self.logger.error(f"Error flushing tracking events: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def flush(self) -> int:
+        """
+        Write buffered events; needs an app context
+
+        Timestamps are those of the flush, within a flush interval of the hit.
+
+        Returns:
+            Number of first opens and clicks recorded
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                dropped, self._dropped = self._dropped, 0
+            if dropped:
+                self.logger.warning(f"Dropped {dropped} tracking events while the buffer was full")
+            if not events:
+                return 0
+
+            by_kind: Dict[str, set] = {}
+            for kind, delivery_id, _ in events:
+                by_kind.setdefault(kind, set()).add(delivery_id)
+
+            now = datetime.utcnow()
+            recorded = 0
+            counters = CounterBatch()
+            try:
+                for kind, delivery_ids in by_kind.items():
+                    timestamp_column, counter_column = TRACKED_EVENTS[kind]
+                    counts = self._mark_first(timestamp_column, sorted(delivery_ids), now)
+                    for campaign_id, count in counts.items():
+                        counters.add(campaign_id, counter_column, count)
+                    recorded += sum(counts.values())
+                counters.apply()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self._requeue(events)
+                raise
+            return recorded
+
+    def _requeue(self, events: List[Tuple[str, int, int]]):
+        """Keep the events of a failed flush for the next one, up to the attempt and buffer limits"""
+        retry = [(kind, delivery_id, failures + 1) for kind, delivery_id, failures in events
+                 if failures + 1 < TRACKING_MAX_FLUSH_ATTEMPTS]
+        with self._lock:
+            retry = retry[:max(0, TRACKING_BUFFER_LIMIT - len(self._events))]
+            self._events[:0] = retry
+        if len(retry) < len(events):
+            self.logger.error(f"Dropped {len(events) - len(retry)} tracking events after failed flushes")
+
+    def _mark_first(self, column_name: str, delivery_ids: List[int], now: datetime) -> Counter:
+        """Set a timestamp on deliveries that do not have it yet; returns newly set rows per campaign"""
+        column = getattr(MessageDelivery, column_name)
+        condition = (MessageDelivery.id.in_(delivery_ids), column.is_(None))
+        if db.engine.dialect.update_returning:
+            rows = db.session.execute(
+                update(MessageDelivery).where(*condition).values({column: now})
+                .returning(MessageDelivery.campaign_id)
+                .execution_options(synchronize_session=False)
+            ).all()
+        else:
+            rows = db.session.execute(select(MessageDelivery.campaign_id).where(*condition)).all()
+            db.session.execute(
+                update(MessageDelivery).where(*condition).values({column: now})
+                .execution_options(synchronize_session=False)
+            )
+        return Counter(row.campaign_id for row in rows)
+
+    def shutdown(self):
+        """Stop the flusher and write what is left"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None and self._app is not None:
+            self._thread.join(timeout=self.flush_seconds + 5)
+            with self._app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.logger.error(f"Error flushing tracking events on shutdown: {str(e)}")
+                finally:
+                    db.session.remove()
+
+
+tracking_buffer = TrackingBuffer()
+
+
+def parse_delivery_id(value: str) -> Optional[int]:
+    """Delivery id from a tracking URL segment, or None if it cannot be one"""
+    if not value.isascii() or not value.isdigit() or len(value) > 10:
+        return None
+    delivery_id = int(value)
+    return delivery_id if 0 < delivery_id <= MAX_DELIVERY_ID else None